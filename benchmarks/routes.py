@@ -0,0 +1,272 @@
+'''
+Requests per second and p50/p99 latency of every kind of route (hello,
+echo, articles and the generated CRUD routes) on each framework adapter,
+driven in-process: the Flask and Bottle apps are called as WSGI apps and
+the Tornado app is served on a loopback port of a background IOLoop. The
+CRUD routes need the database, url validation is skipped by seeding the
+validation cache.
+
+Run from the project root:
+
+  python -m benchmarks.routes
+  ITERATIONS=1000 ADAPTERS=flask,tornado ROUTES=urls python -m benchmarks.routes
+  python -m benchmarks.routes --save baseline.json
+  python -m benchmarks.routes --compare baseline.json
+
+With --compare the exit status is 1 if the p50 latency of any route is
+more than THRESHOLD percent (default 10) above the baseline. The median is
+compared since it is less noisy than the mean (requests per second).
+'''
+import io
+import os
+import sys
+import json
+import time
+import logging
+import uuid
+import asyncio
+import argparse
+import threading
+from datetime import datetime
+from wsgiref.util import setup_testing_defaults
+from content_api.db import db
+from content_api.etag import doc_etag
+from content_api.url_validation import url_validator
+
+ITERATIONS = int(os.environ.get('ITERATIONS', 200))
+WARMUP = int(os.environ.get('WARMUP', 20))
+ADAPTERS = os.environ.get('ADAPTERS', 'flask,bottle,tornado').split(',')
+ROUTES = os.environ.get('ROUTES', '')
+THRESHOLD = float(os.environ.get('THRESHOLD', 10))
+
+def percentile(values, p):
+  values = sorted(values)
+  return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+def wsgi_client(app):
+  def request(method, path, body=None, headers=None):
+    (path, _, query) = path.partition('?')
+    content = json.dumps(body).encode('utf-8') if body is not None else b''
+    environ = {
+      'REQUEST_METHOD': method,
+      'PATH_INFO': path,
+      'QUERY_STRING': query,
+      'CONTENT_TYPE': 'application/json' if body is not None else '',
+      'CONTENT_LENGTH': str(len(content)),
+      'wsgi.input': io.BytesIO(content),
+      **{f'HTTP_{k.upper().replace("-", "_")}': v for k, v in (headers or {}).items()}
+    }
+    setup_testing_defaults(environ)
+    status = []
+    result = app(environ, lambda s, h, exc_info=None: status.append(s))
+    try:
+      data = b''.join(result)
+    finally:
+      if hasattr(result, 'close'):
+        result.close()
+    return (int(status[0].split(' ')[0]), data)
+  return request
+
+class TornadoClient:
+  '''
+    Serves the Tornado app on a loopback port of an IOLoop on a background
+    thread, request blocks until the response has been read
+  '''
+  def __init__(self):
+    from tornado.ioloop import IOLoop
+    from tornado.httpserver import HTTPServer
+    from tornado.httpclient import AsyncHTTPClient
+    from tornado.testing import bind_unused_port
+    import tornado_app
+    # 4xx responses are logged as warnings, which would be timed as well
+    logging.getLogger('tornado.access').setLevel(logging.ERROR)
+    started = threading.Event()
+    def run():
+      asyncio.set_event_loop(asyncio.new_event_loop())
+      self.loop = IOLoop.current()
+      (sock, port) = bind_unused_port()
+      self.server = HTTPServer(tornado_app.make_app(debug=False))
+      self.server.add_sockets([sock])
+      self.client = AsyncHTTPClient(force_instance=True)
+      self.base_url = f'http://127.0.0.1:{port}'
+      started.set()
+      self.loop.start()
+    self.thread = threading.Thread(target=run, daemon=True)
+    self.thread.start()
+    started.wait()
+
+  def request(self, method, path, body=None, headers=None):
+    async def fetch():
+      response = await self.client.fetch(f'{self.base_url}{path}', method=method, headers=headers,
+        body=json.dumps(body) if body is not None else (b'' if method in ['POST', 'PUT'] else None),
+        allow_nonstandard_methods=True, raise_error=False, decompress_response=False)
+      return (response.code, response.body or b'')
+    return asyncio.run_coroutine_threadsafe(fetch(), self.loop.asyncio_loop).result()
+
+  def close(self):
+    def stop():
+      self.client.close()
+      self.server.stop()
+      self.loop.stop()
+    self.loop.add_callback(stop)
+    self.thread.join()
+
+def make_client(adapter):
+  if adapter == 'flask':
+    import flask_app
+    return (wsgi_client(flask_app.app), lambda: None)
+  if adapter == 'bottle':
+    import bottle_app
+    return (wsgi_client(bottle_app.app), lambda: None)
+  if adapter == 'tornado':
+    client = TornadoClient()
+    return (client.request, client.close)
+  raise Exception(f'Unknown adapter {adapter}')
+
+class Fixtures:
+  '''
+    Database rows for the CRUD routes: a url to get and update, urls to
+    delete (one per request) and the users created by the requests
+  '''
+  def __init__(self, count):
+    self.run_id = uuid.uuid4().hex
+    now = datetime.now()
+    self.urls = db.create_many('urls', [{'url': self.url(i), 'created_at': now, 'updated_at': now} for i in range(count + 1)])
+    for doc in self.urls:
+      url_validator.cache.set(doc['url'], (None,))
+    self.url_doc = self.urls[0]
+    self.deletable = [doc['id'] for doc in self.urls[1:]]
+    self.etag = None
+
+  def url(self, i):
+    return f'https://benchmark.example.com/{self.run_id}/{i}'
+
+  def email(self, i):
+    return f'{self.run_id}.{i}@benchmark.example.com'
+
+  def cleanup(self):
+    db.delete_many('urls', [doc['id'] for doc in self.urls])
+    users = db.find('users', limit=1_000_000, offset=0, sort='id', filter={'email': {'op': 'contains', 'value': self.run_id}})
+    db.delete_many('users', [user['id'] for user in users])
+
+def make_routes(fixtures):
+  '''
+    (name, expected status, request(i) -> (method, path, body, headers))
+  '''
+  counter = iter(range(10 ** 9))
+  routes = [
+    ('hello', 200, lambda i: ('GET', '/v1/hello', None, None)),
+    ('echo', 200, lambda i: ('GET', '/v1/echo?foo=bar', None, None)),
+    ('articles_list', 200, lambda i: ('GET', '/v1/articles?q=ba', None, None)),
+    ('articles_list_premium', 200, lambda i: ('GET', '/v1/articles', None, {'Authorization': 'secret'})),
+    ('articles_create', 200, lambda i: ('POST', '/v1/articles', {'title': f'Benchmark {i}'}, None)),
+    ('articles_invalid', 400, lambda i: ('GET', '/v1/articles?q=b', None, None)),
+    ('swagger', 200, lambda i: ('GET', '/v1/swagger.json', None, None))
+  ]
+  if fixtures:
+    url_path = f'/v1/urls/{fixtures.url_doc["id"]}'
+    routes += [
+      ('urls_list', 200, lambda i: ('GET', '/v1/urls?limit=20', None, None)),
+      ('urls_list_fields', 200, lambda i: ('GET', '/v1/urls?limit=20&fields=id,url&count=none', None, None)),
+      ('urls_list_filter', 200, lambda i: ('GET', f'/v1/urls?limit=20&filter.url[contains]={fixtures.run_id}', None, None)),
+      ('urls_get', 200, lambda i: ('GET', url_path, None, None)),
+      ('urls_get_not_modified', 304, lambda i: ('GET', url_path, None, {'If-None-Match': fixtures.etag})),
+      ('urls_update', 200, lambda i: ('PUT', url_path, {'url': fixtures.url_doc['url']}, None)),
+      ('urls_delete', 200, lambda i: ('DELETE', f'/v1/urls/{fixtures.deletable.pop()}', None, None)),
+      ('urls_invalid', 400, lambda i: ('POST', '/v1/urls', {'url': 'foobar'}, None)),
+      ('users_create', 200, lambda i: ('POST', '/v1/users', {'email': fixtures.email(next(counter))}, None))
+    ]
+  return [route for route in routes if not ROUTES or any(name in route[0] for name in ROUTES.split(','))]
+
+def measure(request, make_request, expected_status):
+  for i in range(WARMUP):
+    request(*make_request(i))
+  latencies = []
+  for i in range(ITERATIONS):
+    args = make_request(i)
+    start = time.perf_counter()
+    (status, _) = request(*args)
+    latencies.append(time.perf_counter() - start)
+    if status != expected_status:
+      raise Exception(f'Expected status {expected_status} but got {status} for {args[0]} {args[1]}')
+  return {
+    'requests_per_second': len(latencies) / sum(latencies),
+    'p50_ms': percentile(latencies, 50) * 1000,
+    'p99_ms': percentile(latencies, 99) * 1000
+  }
+
+def run_benchmarks():
+  import models.articles as articles
+  try:
+    fixtures = Fixtures(len(ADAPTERS) * (ITERATIONS + WARMUP))
+  except Exception as error:
+    print(f'Skipping the database routes: {type(error).__name__}: {error}')
+    fixtures = None
+  results = {}
+  try:
+    routes = make_routes(fixtures)
+    for adapter in ADAPTERS:
+      (request, close) = make_client(adapter)
+      results[adapter] = {}
+      try:
+        for (name, expected_status, make_request) in routes:
+          if name == 'urls_get_not_modified':
+            # The ETag changes with urls_update (on the previous adapter)
+            fixtures.etag = doc_etag(db.find_one('urls', fixtures.url_doc['id']))
+          titles = list(articles.ARTICLES)
+          results[adapter][name] = measure(request, make_request, expected_status)
+          # articles_create appends to the articles that are listed
+          articles.ARTICLES[:] = titles
+          print_result(adapter, name, results[adapter][name])
+      finally:
+        close()
+  finally:
+    if fixtures:
+      fixtures.cleanup()
+  return results
+
+def print_result(adapter, name, result, baseline=None):
+  line = f'{adapter:>8} {name:<24} {result["requests_per_second"]:9.1f} req/s  p50 {result["p50_ms"]:7.3f}ms  p99 {result["p99_ms"]:7.3f}ms'
+  if baseline:
+    line += f'  {change(result, baseline):+6.1f}% p50'
+  print(line)
+
+def change(result, baseline):
+  return (result['p50_ms'] / baseline['p50_ms'] - 1) * 100
+
+def compare(results, baseline):
+  '''
+    Prints the change from the baseline per route, returns the routes
+    (adapter, name) that regressed more than THRESHOLD percent
+  '''
+  regressions = []
+  print(f'\nCompared to the baseline (regression threshold {THRESHOLD}%):')
+  for adapter, routes in results.items():
+    for name, result in routes.items():
+      route_baseline = baseline.get(adapter, {}).get(name)
+      if not route_baseline:
+        continue
+      print_result(adapter, name, result, route_baseline)
+      if change(result, route_baseline) > THRESHOLD:
+        regressions.append((adapter, name))
+  return regressions
+
+def main():
+  parser = argparse.ArgumentParser(description='Benchmarks the routes of each framework adapter')
+  parser.add_argument('--save', help='save the results as a JSON baseline to this file')
+  parser.add_argument('--compare', help='compare the results with a JSON baseline saved with --save')
+  args = parser.parse_args()
+  print(f'{ITERATIONS} requests per route after {WARMUP} warmup requests')
+  results = run_benchmarks()
+  if args.save:
+    with open(args.save, 'w') as f:
+      json.dump(results, f, indent=2)
+  if args.compare:
+    with open(args.compare) as f:
+      regressions = compare(results, json.load(f))
+    if regressions:
+      print(f'Regressed: {", ".join(f"{adapter} {name}" for (adapter, name) in regressions)}')
+      sys.exit(1)
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,65 @@
+'''
+Serialization time and size of a 100 row list response, comparing the
+indented json.dumps with a JSONEncoder that the framework adapters used to
+do with content_api.serialization.dumps using the standard library json and
+orjson (if installed).
+
+Run from the project root:
+
+  python -m benchmarks.serialization
+  ROWS=1000 ITERATIONS=200 python -m benchmarks.serialization
+'''
+import os
+import json
+import timeit
+from datetime import date, datetime, timedelta
+import content_api.serialization as serialization
+
+ROWS = int(os.environ.get('ROWS', 100))
+ITERATIONS = int(os.environ.get('ITERATIONS', 1000))
+
+class JsonEncoder(json.JSONEncoder):
+  def default(self, obj):
+    if isinstance(obj, date): # ISO date formating
+      return str(obj)
+    return json.JSONEncoder.default(self, obj)
+
+def list_response(rows):
+  now = datetime(2023, 12, 2, 9, 31, 28, 92946)
+  return {
+    'count': rows,
+    'count_mode': 'exact',
+    'limit': rows,
+    'offset': 0,
+    'sort': '-updated_at',
+    'filter': None,
+    'data': [{
+      'id': i,
+      'url': f'https://www.example.com/articles/{i}?utm_source=benchmark',
+      'fetch_id': i * 10,
+      'created_at': now - timedelta(hours=i),
+      'updated_at': now - timedelta(minutes=i)
+    } for i in range(1, rows + 1)]
+  }
+
+def indented_dumps(data):
+  return json.dumps(data, indent=4, cls=JsonEncoder).encode('utf-8')
+
+def backend_dumps(backend):
+  def dumps(data):
+    serialization.JSON_BACKEND = backend
+    return serialization.dumps(data)
+  return dumps
+
+def main():
+  data = list_response(ROWS)
+  candidates = [('json indent=4 (before)', indented_dumps), ('dumps json', backend_dumps('json'))]
+  if serialization.orjson:
+    candidates.append(('dumps orjson', backend_dumps('orjson')))
+  print(f'{ROWS} rows, {ITERATIONS} iterations')
+  for name, dumps in candidates:
+    seconds = timeit.timeit(lambda: dumps(data), number=ITERATIONS)
+    print(f'{name:24} {seconds / ITERATIONS * 1e6:9.1f} us/op {len(dumps(data)):8} bytes')
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,92 @@
+'''
+Concurrent throughput of the Tornado adapter with a slow blocking handler,
+comparing handlers running on the IOLoop thread with handlers running on the
+executor (see TORNADO_EXECUTOR_WORKERS in tornado_app.py). The slow handler
+blocks like urls.create does when it fetches the url to validate it, while
+a fast hello route is requested in parallel to measure how much the slow
+requests stall everything else.
+
+Run from the project root:
+
+  python -m benchmarks.tornado_executor
+  SLOW_SECONDS=0.2 CONCURRENCY=50 python -m benchmarks.tornado_executor
+'''
+import os
+import time
+import asyncio
+from tornado.httpclient import AsyncHTTPClient
+from tornado.httpserver import HTTPServer
+from tornado.testing import bind_unused_port
+import tornado_app
+from content_api.models import set_route_defaults
+
+SLOW_SECONDS = float(os.environ.get('SLOW_SECONDS', 0.1))
+CONCURRENCY = int(os.environ.get('CONCURRENCY', 20))
+REQUESTS = int(os.environ.get('REQUESTS', 100))
+WORKERS = int(os.environ.get('WORKERS', CONCURRENCY))
+
+def slow_create(request):
+  time.sleep(SLOW_SECONDS)
+  return {'body': request.get('body')}
+
+def hello(request):
+  return {'body': {'hello': 'World!'}}
+
+routes = [
+  set_route_defaults({'method': 'POST', 'path': '/v1/slow_create', 'handler': slow_create}, 'benchmark'),
+  set_route_defaults({'path': '/v1/hello', 'handler': hello}, 'benchmark')
+]
+
+def percentile(values, p):
+  values = sorted(values)
+  return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+async def run(executor):
+  (sock, port) = bind_unused_port()
+  server = HTTPServer(tornado_app.make_app(routes, executor=executor, debug=False))
+  server.add_sockets([sock])
+  client = AsyncHTTPClient(force_instance=True, max_clients=CONCURRENCY + 1)
+  base_url = f'http://127.0.0.1:{port}'
+  remaining = [REQUESTS]
+  hello_latencies = []
+
+  async def slow_worker():
+    while remaining[0] > 0:
+      remaining[0] -= 1
+      await client.fetch(f'{base_url}/v1/slow_create', method='POST', body='{"url": "https://www.example.com"}')
+
+  async def hello_worker(done):
+    while not done.is_set():
+      start = time.perf_counter()
+      await client.fetch(f'{base_url}/v1/hello')
+      hello_latencies.append(time.perf_counter() - start)
+
+  done = asyncio.Event()
+  start = time.perf_counter()
+  hello_task = asyncio.ensure_future(hello_worker(done))
+  await asyncio.gather(*[slow_worker() for _ in range(CONCURRENCY)])
+  elapsed = time.perf_counter() - start
+  done.set()
+  await hello_task
+  client.close()
+  server.stop()
+  return {
+    'slow_requests_per_second': REQUESTS / elapsed,
+    'hello_requests': len(hello_latencies),
+    'hello_p50_ms': percentile(hello_latencies, 50) * 1000,
+    'hello_p99_ms': percentile(hello_latencies, 99) * 1000
+  }
+
+def main():
+  print(f'slow handler {SLOW_SECONDS}s, {REQUESTS} slow requests, concurrency {CONCURRENCY}')
+  modes = [('ioloop', lambda: None), (f'executor({WORKERS})', lambda: tornado_app.make_executor(WORKERS))]
+  for (name, make_executor) in modes:
+    executor = make_executor()
+    result = asyncio.run(run(executor))
+    if executor:
+      executor.shutdown()
+    print(f'{name:>14}: {result["slow_requests_per_second"]:8.1f} slow req/s, '
+      f'hello p50 {result["hello_p50_ms"]:7.1f}ms p99 {result["hello_p99_ms"]:7.1f}ms ({result["hello_requests"]} requests)')
+
+if __name__ == '__main__':
+  main()
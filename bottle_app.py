@@ -1,28 +1,28 @@
-from bottle import Bottle, run, request, response, static_file, redirect, HTTPResponse
+from bottle import Bottle, run, request, response, redirect, HTTPResponse
 import os
-import json
-from datetime import date
-from content_api.swagger import generate_swagger
+from content_api.serialization import dumps, split_pretty
+from content_api.swagger import swagger_document, swagger_response
+from content_api.metrics import metrics_response
+from content_api.etag import conditional_response
+from content_api.compression import gzip_response
+from content_api.static_assets import load_static_assets, static_response
 from content_api.models import all_model_routes
 
 app = Bottle()
 
-class JsonEncoder(json.JSONEncoder):
-	def default(self, obj):
-		if isinstance(obj, date): # ISO date formating
-			return str(obj)
-		return json.JSONEncoder.default(self, obj)
-
-def bottle_response(model_response):
-    headers = {'Content-type': 'application/json'}
+def bottle_response(model_response, pretty=False, request_headers=None):
     status = model_response.get('status', 200)
-    body = json.dumps(model_response.get('body', {}), indent=4, cls=JsonEncoder)
     response.status = status
     response.set_header('Content-Type', 'application/json')
-    for k, v in model_response.get('headers', {}).items():
+    if 'stream' in model_response or status == 304:
+        for k, v in model_response.get('headers', {}).items():
+            response.set_header(k, v)
+        # Bottle writes iterables (i.e. exports) chunk by chunk
+        return model_response.get('stream', '')
+    (content, headers) = gzip_response(request_headers, dumps(model_response.get('body', {}), pretty), model_response.get('headers', {}))
+    for k, v in headers.items():
         response.set_header(k, v)
-    return body
-    #return HTTPResponse(status=status, body=body, headers=headers)
+    return content
 
 def make_bottle_routes(model_routes):
     pass
@@ -30,11 +30,13 @@ def make_bottle_routes(model_routes):
         handler = route['handler']
         @app.route(route['path'], method = [route['method']])
         def bottle_handler(**kwargs):
-            return bottle_response(handler({
+            headers = dict(request.headers)
+            query, pretty = split_pretty(dict(request.query))
+            return bottle_response(conditional_response(headers, handler({
                 'path_params': kwargs,
                 'body': request.json,
-                'headers': dict(request.headers),
-                'query': dict(request.query)}))
+                'headers': headers,
+                'query': query})), pretty, headers)
         bottle_handler.__name__ = f'{route["model_name"]}_{route["name"]}'
     for route in model_routes:
         generate_bottle_handler(route)
@@ -42,13 +44,33 @@ def make_bottle_routes(model_routes):
 model_routes = all_model_routes()
 make_bottle_routes(model_routes)
 
+static = load_static_assets('static')
+
 @app.route('/static/<filename:path>')
 def server_static(filename):
-    return static_file(filename, root='static')
+    result = static_response(static, filename, request.headers, request.query)
+    response.status = result['status']
+    for k, v in result['headers'].items():
+        response.set_header(k, v)
+    return result['content']
+
+swagger = swagger_document(model_routes)
 
 @app.route('/v1/swagger.json')
 def swagger_json():
-    return bottle_response({'body': generate_swagger(model_routes)})
+    result = swagger_response(swagger, request.headers)
+    response.status = result['status']
+    for k, v in result['headers'].items():
+        response.set_header(k, v)
+    return result['content']
+
+@app.route('/metrics')
+def metrics():
+    result = metrics_response()
+    response.status = result['status']
+    for k, v in result['headers'].items():
+        response.set_header(k, v)
+    return result['content']
 
 @app.route('/')
 def redirect_to_swagger():
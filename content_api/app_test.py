@@ -64,7 +64,7 @@ def test_crud():
     assert response.json()['url'] == doc['url']
 
     # Get 404
-    missing_id = 12345 if DATABASE == 'pg' else '5f299b3e9cd7d821d2b898c1'
+    missing_id = 12345 if DATABASE != 'mongodb' else '5f299b3e9cd7d821d2b898c1'
     get_url_404 = f'{list_url}/{missing_id}'
     response = requests.get(get_url_404)
     assert response.status_code == 404
@@ -74,7 +74,7 @@ def test_crud():
     assert response.status_code == 400
     assert get(response.json(), 'error.message')
 
-    if DATABASE == 'pg':
+    if DATABASE in ['pg', 'sqlite']:
         # Create with url that already exists
         response = requests.post(list_url, json={'url': doc['url']})
         print(response.json())
@@ -223,6 +223,296 @@ def test_list_query_params():
     # response = requests.get(f'{list_url}?filter.created_at[lt]={created_at_lt}')
     # assert response.json()['data'][0]['url'] == doc2['url']
 
+def test_list_count_modes():
+    response = requests.get(list_url)
+    assert response.status_code == 200
+    assert response.json()['count_mode'] == 'exact'
+    count = response.json()['count']
+
+    response = requests.get(f'{list_url}?count=exact')
+    assert response.status_code == 200
+    assert response.json()['count'] == count
+
+    response = requests.get(f'{list_url}?count=estimate')
+    assert response.status_code == 200
+    assert response.json()['count_mode'] in ['exact', 'estimate']
+    assert response.json()['count'] >= 0
+
+    response = requests.get(f'{list_url}?count=none')
+    assert response.status_code == 200
+    assert response.json()['count_mode'] == 'none'
+    assert 'count' not in response.json()
+
+    # Invalid count mode yields 400
+    response = requests.get(f'{list_url}?count=foo')
+    assert response.status_code == 400
+
+def test_list_count_exact():
+    # Exact counts see the writes of other processes (this one) at once
+    if DATABASE == 'memory':
+        return
+    from content_api.db import db
+    response = requests.post(list_url, json=get_valid_doc())
+    assert response.status_code == 200
+    id = response.json()['id']
+    count = requests.get(f'{list_url}?limit=1').json()['count']
+    db.delete('urls', id)
+    assert requests.get(f'{list_url}?limit=1').json()['count'] == count - 1
+
+def test_list_count_with_page():
+    doc = get_valid_doc()
+    response = requests.post(list_url, json=doc)
+    assert response.status_code == 200
+    uuid = re.search('uuid=(.+)$', doc['url']).group(1)
+
+    # The count of a page comes from the same query as the docs
+    response = requests.get(f'{list_url}?filter.url[contains]={uuid}')
+    assert response.status_code == 200
+    assert response.json()['count'] == 1
+    assert len(response.json()['data']) == 1
+
+    # An empty page past the last doc still has the count
+    response = requests.get(f'{list_url}?filter.url[contains]={uuid}&offset=5')
+    assert response.status_code == 200
+    assert response.json()['count'] == 1
+    assert response.json()['data'] == []
+
+def test_list_cursor():
+    docs = []
+    for _ in range(3):
+        response = requests.post(list_url, json=get_valid_doc())
+        assert response.status_code == 200
+        docs.append(response.json())
+
+    # First page has a next_cursor
+    response = requests.get(f'{list_url}?limit=2&sort=-created_at')
+    assert response.status_code == 200
+    assert [d['id'] for d in response.json()['data']] == [docs[2]['id'], docs[1]['id']]
+    next_cursor = response.json()['next_cursor']
+
+    # Next page continues after the last doc of the previous page
+    response = requests.get(f'{list_url}?limit=2&sort=-created_at&cursor={next_cursor}')
+    assert response.status_code == 200
+    assert response.json()['cursor'] == next_cursor
+    assert response.json()['data'][0]['id'] == docs[0]['id']
+
+    # Cursor is combined with filters
+    response = requests.get(f'{list_url}?limit=1&sort=-created_at&filter.url={docs[1]["url"]}&cursor={next_cursor}')
+    assert response.status_code == 200
+    assert response.json()['data'] == []
+    assert 'next_cursor' not in response.json()
+
+    # A cursor for a different sort yields 400
+    response = requests.get(f'{list_url}?limit=2&sort=created_at&cursor={next_cursor}')
+    assert response.status_code == 400
+
+    # An invalid cursor yields 400
+    response = requests.get(f'{list_url}?cursor=foobar')
+    assert response.status_code == 400
+
+    for doc in docs:
+        response = requests.delete(f'{list_url}/{doc["id"]}')
+        assert response.status_code == 200
+
+def test_list_cursor_nulls():
+    # validated_at is NULL until a url is validated (or never, depending on
+    # URL_VALIDATION_MODE), pages continue across the NULL sort key values
+    prefix = uuid_hex()
+    docs = []
+    for _ in range(3):
+        response = requests.post(list_url, json={'url': f'https://www.google.com?uuid={prefix}{uuid_hex()}'})
+        assert response.status_code == 200
+        docs.append(response.json())
+
+    for sort in ['-validated_at', 'validated_at', 'validation_status,-created_at']:
+        response = requests.get(f'{list_url}?limit=3&sort={sort}&filter.url[contains]={prefix}')
+        assert response.status_code == 200
+        ids = [d['id'] for d in response.json()['data']]
+        assert sorted(ids) == sorted(doc['id'] for doc in docs)
+        seen = []
+        cursor = ''
+        while True:
+            response = requests.get(f'{list_url}?limit=1&sort={sort}&filter.url[contains]={prefix}{cursor}')
+            assert response.status_code == 200
+            seen += [d['id'] for d in response.json()['data']]
+            if 'next_cursor' not in response.json():
+                break
+            cursor = f'&cursor={response.json()["next_cursor"]}'
+        assert seen == ids
+
+    for doc in docs:
+        response = requests.delete(f'{list_url}/{doc["id"]}')
+        assert response.status_code == 200
+
+def test_fields():
+    response = requests.post(list_url, json=get_valid_doc())
+    assert response.status_code == 200
+    doc = response.json()
+    get_url = f'{list_url}/{doc["id"]}'
+
+    # Get returns only the requested fields, with an ETag of its own
+    response = requests.get(f'{get_url}?fields=id,url')
+    assert response.status_code == 200
+    assert response.json() == {'id': doc['id'], 'url': doc['url']}
+    etag = response.headers['ETag']
+    assert etag != requests.get(get_url).headers['ETag']
+    response = requests.get(f'{get_url}?fields=id,url', headers={'If-None-Match': etag})
+    assert response.status_code == 304
+
+    # List pages with a cursor, also when the sort key is not in the fields
+    response = requests.get(f'{list_url}?fields=url&limit=1&sort=-created_at')
+    assert response.status_code == 200
+    assert response.json()['fields'] == 'url'
+    assert response.json()['data'] == [{'url': doc['url']}]
+    next_cursor = response.json()['next_cursor']
+    response = requests.get(f'{list_url}?fields=url&limit=1&sort=-created_at&cursor={next_cursor}')
+    assert response.status_code == 200
+    assert response.json()['data'] != [{'url': doc['url']}]
+
+    # Unknown fields yield 400
+    response = requests.get(f'{list_url}?fields=url,foo')
+    assert response.status_code == 400
+    response = requests.get(f'{get_url}?fields=foo')
+    assert response.status_code == 400
+
+    response = requests.delete(get_url)
+    assert response.status_code == 200
+
+def test_bulk():
+    bulk_url = f'{list_url}/_bulk'
+    docs = [get_valid_doc() for _ in range(3)]
+
+    # Bulk create with invalid items reports errors per item
+    response = requests.post(bulk_url, json=[docs[0], {'url': 123}, {**docs[2], 'foo': 1}])
+    assert response.status_code == 400
+    assert [item['index'] for item in get(response.json(), 'error.items')] == [1, 2]
+
+    # Bulk create of empty array yields 400
+    response = requests.post(bulk_url, json=[])
+    assert response.status_code == 400
+
+    # Successful bulk create
+    response = requests.post(bulk_url, json=docs)
+    assert response.status_code == 200
+    assert response.json()['count'] == 3
+    created = response.json()['data']
+    assert [d['url'] for d in created] == [d['url'] for d in docs]
+    assert all(d['id'] and d['created_at'] for d in created)
+    ids = [d['id'] for d in created]
+
+    if DATABASE in ['pg', 'sqlite']:
+        # A failing item rolls back the whole batch
+        response = requests.post(bulk_url, json=[get_valid_doc(), {'url': docs[0]['url']}])
+        assert response.status_code == 400
+        response = requests.get(f'{list_url}?filter.url={docs[0]["url"]}')
+        assert response.json()['count'] == 1
+
+    # Bulk update requires ids
+    response = requests.put(bulk_url, json=[{'url': get_valid_doc()['url']}])
+    assert response.status_code == 400
+
+    # Bulk update items need a column to update
+    response = requests.put(bulk_url, json=[{'id': ids[0], 'url': get_valid_doc()['url']}, {'id': ids[1]}])
+    assert response.status_code == 400
+    assert [item['index'] for item in get(response.json(), 'error.items')] == [1]
+
+    # Successful bulk update
+    missing_id = 12345 if DATABASE != 'mongodb' else '5f299b3e9cd7d821d2b898c1'
+    updates = [{'id': id, 'url': get_valid_doc()['url']} for id in ids[:2]]
+    response = requests.put(bulk_url, json=updates + [{'id': missing_id, 'url': get_valid_doc()['url']}])
+    assert response.status_code == 200
+    assert response.json()['count'] == 2
+    assert [d['url'] for d in response.json()['data']] == [d['url'] for d in updates]
+    assert all(d['updated_at'] for d in response.json()['data'])
+    assert response.json()['not_found'] == [missing_id]
+    response = requests.get(f'{list_url}/{ids[0]}')
+    assert response.json()['url'] == updates[0]['url']
+
+    # Successful bulk delete
+    response = requests.delete(bulk_url, json=ids + [missing_id])
+    assert response.status_code == 200
+    assert [d['id'] for d in response.json()['data']] == ids
+    assert response.json()['not_found'] == [missing_id]
+    for id in ids:
+        response = requests.get(f'{list_url}/{id}')
+        assert response.status_code == 404
+
+def test_export():
+    export_url = f'{list_url}/_export'
+    response = requests.post(f'{list_url}/_bulk', json=[get_valid_doc() for _ in range(3)])
+    assert response.status_code == 200
+    docs = response.json()['data']
+    (uuid1,) = re.search('uuid=(.+)', docs[1]['url']).groups()
+
+    # NDJSON (default) honors filter and sort
+    response = requests.get(f'{export_url}?sort=-id')
+    assert response.status_code == 200
+    assert response.headers['Content-Type'].startswith('application/x-ndjson')
+    rows = [json.loads(line) for line in response.text.splitlines()]
+    assert len(rows) == requests.get(list_url).json()['count']
+    assert [r['id'] for r in rows if r['id'] in [d['id'] for d in docs]] == [d['id'] for d in reversed(docs)]
+
+    response = requests.get(f'{export_url}?format=ndjson&filter.url[contains]={uuid1}')
+    assert response.status_code == 200
+    rows = [json.loads(line) for line in response.text.splitlines()]
+    assert [r['url'] for r in rows] == [docs[1]['url']]
+
+    # CSV has a header row
+    response = requests.get(f'{export_url}?format=csv&filter.url={docs[1]["url"]}')
+    assert response.status_code == 200
+    assert response.headers['Content-Type'].startswith('text/csv')
+    lines = response.text.splitlines()
+    assert lines[0] == 'id,url,created_at,updated_at,validation_status,validation_error,validated_at,next_fetch_at'
+    assert lines[1].startswith(f'{docs[1]["id"]},{docs[1]["url"]},')
+    assert len(lines) == 2
+
+    # Invalid format or sort yields 400
+    response = requests.get(f'{export_url}?format=xml')
+    assert response.status_code == 400
+    response = requests.get(f'{export_url}?sort=foo')
+    assert response.status_code == 400
+
+    response = requests.delete(f'{list_url}/_bulk', json=[d['id'] for d in docs])
+    assert response.status_code == 200
+
+def test_conditional_get():
+    response = requests.post(list_url, json=get_valid_doc())
+    assert response.status_code == 200
+    get_url = f'{list_url}/{response.json()["id"]}'
+
+    # Get with matching If-None-Match yields 304 without body
+    response = requests.get(get_url)
+    assert response.status_code == 200
+    etag = response.headers['ETag']
+    assert etag
+    response = requests.get(get_url, headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.text == ''
+    assert response.headers['ETag'] == etag
+    response = requests.get(get_url, headers={'If-None-Match': '"foobar"'})
+    assert response.status_code == 200
+
+    # List
+    response = requests.get(f'{list_url}?limit=5')
+    assert response.status_code == 200
+    list_etag = response.headers['ETag']
+    response = requests.get(f'{list_url}?limit=5', headers={'If-None-Match': list_etag})
+    assert response.status_code == 304
+    response = requests.get(f'{list_url}?limit=4', headers={'If-None-Match': list_etag})
+    assert response.status_code == 200
+
+    # The ETags change with an update
+    response = requests.put(get_url, json=get_valid_doc())
+    assert response.status_code == 200
+    response = requests.get(get_url, headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+    response = requests.get(f'{list_url}?limit=5', headers={'If-None-Match': list_etag})
+    assert response.status_code == 200
+
+    response = requests.delete(get_url)
+    assert response.status_code == 200
+
 def test_update_full_doc():
     # Successful create
     doc = get_valid_doc()
@@ -261,6 +551,101 @@ def test_update_full_doc():
     response = requests.delete(get_url)
     assert response.status_code == 200
 
+def test_swagger_caching():
+    swagger_url = f'{BASE_URL}/v1/swagger.json'
+    response = requests.get(swagger_url, headers={'Accept-Encoding': 'gzip'})
+    assert response.status_code == 200
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert response.headers['Cache-Control']
+    etag = response.headers['ETag']
+    assert response.json()['paths']
+
+    response = requests.get(swagger_url, headers={'Accept-Encoding': 'identity'})
+    assert response.status_code == 200
+    assert 'Content-Encoding' not in response.headers
+    assert response.headers['ETag'] == etag
+    assert response.json()['paths']
+
+    response = requests.get(swagger_url, headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.text == ''
+
+def test_compression():
+    docs = requests.post(f'{list_url}/_bulk', json=[get_valid_doc() for _ in range(10)]).json()['data']
+    response = requests.get(f'{list_url}?limit=10', headers={'Accept-Encoding': 'gzip'})
+    assert response.status_code == 200
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert 'Accept-Encoding' in response.headers['Vary']
+    assert len(response.json()['data']) == 10
+
+    response = requests.get(f'{list_url}?limit=10', headers={'Accept-Encoding': 'identity'})
+    assert response.status_code == 200
+    assert 'Content-Encoding' not in response.headers
+    assert len(response.json()['data']) == 10
+
+    # Small responses are not compressed
+    response = requests.get(f'{list_url}/{docs[0]["id"]}', headers={'Accept-Encoding': 'gzip'})
+    assert response.status_code == 200
+    assert 'Content-Encoding' not in response.headers
+
+    response = requests.delete(f'{list_url}/_bulk', json=[d['id'] for d in docs])
+    assert response.status_code == 200
+
+def test_static():
+    response = requests.get(f'{BASE_URL}/static/swagger/index.html')
+    assert response.status_code == 200
+    assert response.headers['Cache-Control'] == 'no-cache'
+    css_url = re.search(r'href="\./(swagger-ui\.css\?v=[0-9a-f]+)"', response.text).group(1)
+
+    # Hashed urls are immutable and precompressed
+    response = requests.get(f'{BASE_URL}/static/swagger/{css_url}', headers={'Accept-Encoding': 'gzip'})
+    assert response.status_code == 200
+    assert response.headers['Cache-Control'] == 'public, max-age=31536000, immutable'
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert response.headers['Content-Type'].startswith('text/css')
+    etag = response.headers['ETag']
+
+    response = requests.get(f'{BASE_URL}/static/swagger/swagger-ui.css', headers={'If-None-Match': etag})
+    assert response.status_code == 304
+
+    response = requests.get(f'{BASE_URL}/static/swagger/missing.js')
+    assert response.status_code == 404
+
+def test_metrics():
+    def requests_total(text, status):
+        match = re.search(r'^content_api_requests_total\{model="hello_world",route="hello",method="GET",status="%s"\} (\d+)$' % status, text, re.MULTILINE)
+        return int(match.group(1)) if match else 0
+    before = requests_total(requests.get(f'{BASE_URL}/metrics').text, '2xx')
+    requests.get(f'{BASE_URL}/v1/hello')
+    response = requests.get(f'{BASE_URL}/metrics')
+    assert response.status_code == 200
+    assert response.headers['Content-Type'].startswith('text/plain; version=0.0.4')
+    assert requests_total(response.text, '2xx') == before + 1
+    assert re.search(r'^content_api_request_duration_seconds_bucket\{model="urls",route="list",method="GET",le="\+Inf"\} \d+$', response.text, re.MULTILINE)
+
+    # Database time and calls per request
+    response = requests.get(f'{BASE_URL}/v1/urls?limit=1')
+    assert re.match(r'^db;dur=[0-9.]+;desc="[1-9][0-9]* queries"$', response.headers['Server-Timing'])
+    response = requests.get(f'{BASE_URL}/metrics')
+    assert re.search(r'^content_api_db_query_duration_seconds_count\{operation="[a-z_]+",table="urls"\} [1-9]', response.text, re.MULTILINE)
+    assert re.search(r'^content_api_request_db_queries_total\{model="urls",route="list",method="GET"\} [1-9]', response.text, re.MULTILINE)
+
+    # Collector stats that only increase are counters
+    assert '# TYPE content_api_url_validation_requests_total counter' in response.text
+    assert '# TYPE content_api_entity_cache_size gauge' in response.text
+
+def test_pretty():
+    response = requests.get(f'{list_url}?limit=2')
+    assert response.status_code == 200
+    assert response.headers['Content-Type'].startswith('application/json')
+    assert '\n' not in response.text
+    data = response.json()
+
+    response = requests.get(f'{list_url}?limit=2&pretty')
+    assert response.status_code == 200
+    assert '\n' in response.text
+    assert response.json()['data'] == data['data']
+
 def test_missing_path():
     response = requests.get(f'{BASE_URL}/fooooooobar')
     assert response.status_code == 404
@@ -0,0 +1,72 @@
+import time
+import threading
+from collections import OrderedDict
+
+class TTLCache:
+  '''
+    A thread safe LRU cache with a size bound where entries also expire
+    ttl seconds after they were set. A ttl or max_size of 0 disables the cache.
+  '''
+  def __init__(self, max_size=1000, ttl=60):
+    self.max_size = max_size
+    self.ttl = ttl
+    self._data = OrderedDict()
+    self._lock = threading.Lock()
+    self.hits = 0
+    self.misses = 0
+    self.evictions = 0
+
+  @property
+  def enabled(self):
+    return self.max_size > 0 and self.ttl > 0
+
+  def get(self, key, default=None):
+    with self._lock:
+      entry = self._data.get(key)
+      if entry is None:
+        self.misses += 1
+        return default
+      (expires_at, value) = entry
+      if expires_at <= time.monotonic():
+        del self._data[key]
+        self.misses += 1
+        return default
+      self._data.move_to_end(key)
+      self.hits += 1
+      return value
+
+  def set(self, key, value, ttl=None):
+    if not self.enabled:
+      return
+    expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+    with self._lock:
+      self._data[key] = (expires_at, value)
+      self._data.move_to_end(key)
+      while len(self._data) > self.max_size:
+        self._data.popitem(last=False)
+        self.evictions += 1
+
+  def delete(self, key):
+    with self._lock:
+      self._data.pop(key, None)
+
+  def clear(self, predicate=None):
+    with self._lock:
+      if predicate is None:
+        self._data.clear()
+      else:
+        for key in [k for k in self._data if predicate(k)]:
+          del self._data[key]
+
+  def __len__(self):
+    return len(self._data)
+
+  def stats(self):
+    return {
+      'size': len(self._data),
+      'max_size': self.max_size,
+      'ttl': self.ttl,
+      'hits': self.hits,
+      'misses': self.misses,
+      'evictions': self.evictions
+    }
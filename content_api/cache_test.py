@@ -0,0 +1,48 @@
+import time
+from content_api.cache import TTLCache
+
+def test_get_set():
+  cache = TTLCache(max_size=10, ttl=60)
+  assert cache.get('foo') == None
+  assert cache.get('foo', 'the default') == 'the default'
+  cache.set('foo', 1)
+  assert cache.get('foo') == 1
+  cache.delete('foo')
+  assert cache.get('foo') == None
+  assert cache.stats()['hits'] == 1
+  assert cache.stats()['misses'] == 3
+
+def test_lru_eviction():
+  cache = TTLCache(max_size=2, ttl=60)
+  cache.set('a', 1)
+  cache.set('b', 2)
+  cache.get('a')
+  cache.set('c', 3)
+  assert cache.get('b') == None
+  assert cache.get('a') == 1
+  assert cache.get('c') == 3
+  assert cache.stats()['evictions'] == 1
+  assert len(cache) == 2
+
+def test_ttl():
+  cache = TTLCache(max_size=10, ttl=60)
+  cache.set('foo', 1, ttl=0.01)
+  time.sleep(0.02)
+  assert cache.get('foo') == None
+  assert len(cache) == 0
+
+def test_clear():
+  cache = TTLCache(max_size=10, ttl=60)
+  cache.set(('urls', 1), 1)
+  cache.set(('urls', 2), 2)
+  cache.set(('users', 1), 3)
+  cache.clear(lambda key: key[0] == 'urls')
+  assert len(cache) == 1
+  assert cache.get(('users', 1)) == 3
+  cache.clear()
+  assert len(cache) == 0
+
+def test_disabled():
+  cache = TTLCache(max_size=10, ttl=0)
+  cache.set('foo', 1)
+  assert cache.get('foo') == None
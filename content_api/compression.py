@@ -0,0 +1,35 @@
+import os
+import gzip
+from content_api.etag import get_header
+
+# JSON bodies smaller than this are sent uncompressed since gzip doesn't
+# make them (much) smaller
+COMPRESSION_MIN_SIZE = int(os.environ.get('COMPRESSION_MIN_SIZE', 1024))
+COMPRESSION_LEVEL = int(os.environ.get('COMPRESSION_LEVEL', 6))
+
+def accepts_gzip(accept_encoding):
+  '''
+    Whether an Accept-Encoding header value allows gzip, i.e.
+    "gzip, deflate, br" but not "gzip;q=0" or "identity"
+  '''
+  if not accept_encoding:
+    return False
+  for encoding in accept_encoding.split(','):
+    (name, _, params) = encoding.strip().partition(';')
+    if name.strip().lower() in ['gzip', '*']:
+      q = params.strip().removeprefix('q=') if params.strip().startswith('q=') else '1'
+      try:
+        return float(q) > 0
+      except ValueError:
+        return False
+  return False
+
+def gzip_response(request_headers, content, headers=None, min_size=COMPRESSION_MIN_SIZE, level=COMPRESSION_LEVEL):
+  '''
+    Returns (content, headers) where content (bytes) is gzipped if the
+    client accepts gzip and it is at least min_size bytes
+  '''
+  headers = {**(headers or {}), 'Vary': 'Accept-Encoding'}
+  if len(content) < min_size or not accepts_gzip(get_header(request_headers, 'Accept-Encoding')):
+    return (content, headers)
+  return (gzip.compress(content, compresslevel=level, mtime=0), {**headers, 'Content-Encoding': 'gzip'})
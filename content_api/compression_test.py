@@ -0,0 +1,22 @@
+import gzip
+from content_api.compression import accepts_gzip, gzip_response
+
+def test_accepts_gzip():
+  assert accepts_gzip('gzip')
+  assert accepts_gzip('gzip, deflate, br')
+  assert accepts_gzip('br;q=1.0, gzip;q=0.8')
+  assert accepts_gzip('*')
+  assert not accepts_gzip('gzip;q=0')
+  assert not accepts_gzip('identity')
+  assert not accepts_gzip('')
+  assert not accepts_gzip(None)
+
+def test_gzip_response():
+  content = b'{"data": [' + b'{"id": 1}, ' * 200 + b'{"id": 1}]}'
+  (body, headers) = gzip_response({'Accept-Encoding': 'gzip'}, content, {'ETag': '"a"'})
+  assert headers == {'ETag': '"a"', 'Vary': 'Accept-Encoding', 'Content-Encoding': 'gzip'}
+  assert gzip.decompress(body) == content
+  assert len(body) < len(content)
+  # Not accepted or too small
+  assert gzip_response({}, content) == (content, {'Vary': 'Accept-Encoding'})
+  assert gzip_response({'accept-encoding': 'gzip'}, b'{}') == (b'{}', {'Vary': 'Accept-Encoding'})
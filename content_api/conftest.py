@@ -0,0 +1,38 @@
+import time
+import threading
+from types import SimpleNamespace
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import pytest
+
+@pytest.fixture
+def stub_server():
+  '''
+    An HTTP server on a free local port for the tests of code that fetches
+    urls. A GET responds with 200 and "page <path>" unless the path starts
+    with a prefix in responses, which maps prefixes to dicts with the
+    status, body (bytes) and delay (seconds) to respond with instead.
+    requests are the (path, monotonic time) of the requests received.
+  '''
+  stub = SimpleNamespace(url=None, responses={}, requests=[])
+
+  class StubHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+      stub.requests.append((self.path, time.monotonic()))
+      response = next((r for prefix, r in stub.responses.items() if self.path.startswith(prefix)), {})
+      if response.get('delay'):
+        time.sleep(response['delay'])
+      body = response.get('body', f'page {self.path}'.encode())
+      self.send_response(response.get('status', 200))
+      self.send_header('Content-Length', str(len(body)))
+      self.end_headers()
+      self.wfile.write(body)
+    def log_message(self, *args):
+      pass
+
+  server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+  thread = threading.Thread(target=server.serve_forever, daemon=True)
+  thread.start()
+  stub.url = f'http://127.0.0.1:{server.server_port}'
+  yield stub
+  server.shutdown()
+  server.server_close()
@@ -1,6 +1,36 @@
 import os
 import importlib
+from content_api.db.instrumentation import InstrumentedDatabase
 
 DATABASE = os.environ.get('DATABASE', 'pg')
 print(f'DATABASE={DATABASE}')
+
+# The functions (and id_json_schema and integrity_errors, the exceptions
+# of constraint violations) that a database module implements
+INTERFACE = [
+  'id_json_schema',
+  'integrity_errors',
+  'count',
+  'estimate_count',
+  'find',
+  'find_with_count',
+  'find_iter',
+  'find_one',
+  'create',
+  'create_returning',
+  'create_many',
+  'update',
+  'update_returning',
+  'update_many',
+  'delete',
+  'delete_returning',
+  'delete_many',
+  'claim_due',
+  'create_index'
+]
+
+# Every call of the interface is timed and counted (see instrumentation.py)
+# unless DATABASE_INSTRUMENTATION=0
 db = importlib.import_module(f'content_api.db.{DATABASE}')
+if os.environ.get('DATABASE_INSTRUMENTATION', '1') != '0':
+  db = InstrumentedDatabase(db, INTERFACE)
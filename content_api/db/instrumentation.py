@@ -0,0 +1,225 @@
+'''
+Times every call of the database interface (see INTERFACE) and records
+the duration and row count per operation and table. Calls slower than
+DATABASE_SLOW_QUERY_MS are logged with their arguments and a
+DATABASE_QUERY_SAMPLE_RATE fraction of the others with their query shape
+(operation, table, filter columns and operators, sort and columns), to the
+content_api.db.queries logger as JSON.
+
+The calls made within a query_scope (one per request, see
+content_api/metrics.py) are added up so that the DB time and query count of
+a request can be reported.
+'''
+import os
+import json
+import time
+import random
+import inspect
+import logging
+import threading
+import contextvars
+from bisect import bisect_left
+from types import SimpleNamespace
+from contextlib import contextmanager
+from functools import wraps
+
+SLOW_QUERY_MS = float(os.environ.get('DATABASE_SLOW_QUERY_MS', 100))
+SAMPLE_RATE = float(os.environ.get('DATABASE_QUERY_SAMPLE_RATE', 0))
+
+# Upper bounds (seconds) of the query duration histogram buckets
+DURATION_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+
+# Slow calls are logged with the repr of their arguments cut to this length
+MAX_ARGUMENT_LENGTH = 1000
+
+logger = logging.getLogger('content_api.db.queries')
+
+# The totals of the current request, None outside of a query_scope
+current_scope = contextvars.ContextVar('query_scope', default=None)
+
+@contextmanager
+def query_scope():
+  '''
+    Yields a namespace with the duration (seconds) and count of the
+    database calls made until the end of the block
+  '''
+  scope = SimpleNamespace(duration=0.0, count=0)
+  token = current_scope.set(scope)
+  try:
+    yield scope
+  finally:
+    current_scope.reset(token)
+
+class QueryMetrics:
+  '''
+    The counters of one operation on one table
+  '''
+  def __init__(self, operation, table_name, buckets=DURATION_BUCKETS):
+    self.labels = {'operation': operation, 'table': table_name}
+    self.buckets = buckets
+    self.bucket_counts = [0] * (len(buckets) + 1)
+    self.sum = 0.0
+    self.count = 0
+    self.rows = 0
+    self.errors = 0
+    self.lock = threading.Lock()
+
+  def observe(self, duration, rows, error):
+    i = bisect_left(self.buckets, duration)
+    with self.lock:
+      self.bucket_counts[i] += 1
+      self.sum += duration
+      self.count += 1
+      self.rows += rows
+      self.errors += 1 if error else 0
+
+  def snapshot(self):
+    with self.lock:
+      return SimpleNamespace(bucket_counts=list(self.bucket_counts), sum=self.sum, count=self.count, rows=self.rows, errors=self.errors)
+
+# QueryMetrics by (operation, table name)
+query_metrics = {}
+query_metrics_lock = threading.Lock()
+
+def get_query_metrics(operation, table_name):
+  key = (operation, table_name)
+  metrics = query_metrics.get(key)
+  if metrics is None:
+    with query_metrics_lock:
+      metrics = query_metrics.setdefault(key, QueryMetrics(operation, table_name))
+  return metrics
+
+# Calls that return a number that is not a row, i.e. the number of rows
+SCALAR_OPERATIONS = {'count', 'estimate_count'}
+
+def row_count(result, operation=None):
+  '''
+    The number of rows returned or written by a database call
+  '''
+  if result is None or operation in SCALAR_OPERATIONS:
+    return 0
+  if isinstance(result, int) and operation in ['update', 'delete']:
+    # The rowcount that pg.py returns
+    return max(result, 0)
+  if isinstance(result, tuple):
+    # find_with_count
+    return len(result[0])
+  if isinstance(result, list):
+    return len(result)
+  if isinstance(result, (dict, int, str)):
+    # A doc, or the id of a created doc
+    return 1
+  for attribute in ['rowcount', 'modified_count', 'deleted_count']:
+    # The cursors and results of update and delete
+    if isinstance(getattr(result, attribute, None), int):
+      return max(getattr(result, attribute), 0)
+  return 0
+
+def query_shape(operation, arguments):
+  '''
+    A description of the query without its values, i.e.
+    "find urls filter=url:contains sort=-updated_at,-id"
+  '''
+  (table_name, *_) = arguments.values()
+  parts = [operation, str(table_name)]
+  if arguments.get('filter'):
+    parts.append('filter=' + ','.join(f'{column}:{f["op"]}' for column, f in arguments['filter'].items()))
+  if arguments.get('sort'):
+    parts.append(f'sort={arguments["sort"]}')
+  if arguments.get('after'):
+    parts.append('after')
+  if arguments.get('fields'):
+    parts.append('fields=' + ','.join(arguments['fields']))
+  if isinstance(arguments.get('doc'), dict):
+    parts.append('columns=' + ','.join(arguments['doc'].keys()))
+  if arguments.get('docs') is not None or arguments.get('ids') is not None:
+    parts.append(f'count={len(arguments.get("docs") or arguments.get("ids") or [])}')
+  return ' '.join(parts)
+
+def log_query(operation, arguments, duration, rows, error):
+  slow = duration * 1000 >= SLOW_QUERY_MS
+  entry = {
+    'shape': query_shape(operation, arguments),
+    'duration_ms': round(duration * 1000, 3),
+    'rows': rows,
+    'slow': slow
+  }
+  if error:
+    entry['error'] = f'{type(error).__name__}: {error}'
+  if slow:
+    entry['arguments'] = {name: repr(value)[:MAX_ARGUMENT_LENGTH] for name, value in arguments.items()}
+    logger.warning(json.dumps(entry))
+  else:
+    logger.info(json.dumps(entry))
+
+def record(operation, signature, args, kwargs, duration, rows, error=None):
+  # The table (or collection) is the first argument of every call
+  table_name = args[0] if args else next(iter(signature.bind(*args, **kwargs).arguments.values()))
+  get_query_metrics(operation, str(table_name)).observe(duration, rows, error is not None)
+  scope = current_scope.get()
+  if scope is not None:
+    scope.duration += duration
+    scope.count += 1
+  if duration * 1000 >= SLOW_QUERY_MS or (SAMPLE_RATE > 0 and random.random() < SAMPLE_RATE):
+    # Only bound for the calls that are logged since binding takes time
+    log_query(operation, signature.bind(*args, **kwargs).arguments, duration, rows, error)
+
+def instrument(operation, function):
+  signature = inspect.signature(function)
+  @wraps(function)
+  def instrumented(*args, **kwargs):
+    start = time.perf_counter()
+    try:
+      result = function(*args, **kwargs)
+    except Exception as error:
+      record(operation, signature, args, kwargs, time.perf_counter() - start, 0, error)
+      raise
+    record(operation, signature, args, kwargs, time.perf_counter() - start, row_count(result, operation))
+    return result
+  return instrumented
+
+def instrument_iter(operation, function):
+  '''
+    Times the generator of find_iter while it fetches rows, not while the
+    caller processes them
+  '''
+  signature = inspect.signature(function)
+  @wraps(function)
+  def instrumented(*args, **kwargs):
+    duration = 0.0
+    rows = 0
+    error = None
+    iterator = function(*args, **kwargs)
+    try:
+      while True:
+        start = time.perf_counter()
+        try:
+          row = next(iterator)
+        except StopIteration:
+          return
+        finally:
+          duration += time.perf_counter() - start
+        rows += 1
+        yield row
+    except Exception as e:
+      error = e
+      raise
+    finally:
+      iterator.close()
+      record(operation, signature, args, kwargs, duration, rows, error)
+  return instrumented
+
+class InstrumentedDatabase:
+  '''
+    The database module with its interface functions instrumented, other
+    attributes (i.e. pg.pool or pg.execute) are those of the module
+  '''
+  def __init__(self, module, interface):
+    self.module = module
+    for name in interface:
+      function = getattr(module, name, None)
+      if callable(function):
+        setattr(self, name, (instrument_iter if inspect.isgeneratorfunction(function) else instrument)(name, function))
+
+  def __getattr__(self, name):
+    return getattr(self.module, name)
@@ -0,0 +1,81 @@
+import json
+import logging
+from types import SimpleNamespace
+import pytest
+from content_api.db import instrumentation
+from content_api.db.instrumentation import InstrumentedDatabase, query_scope, query_metrics, query_shape, row_count
+
+def find(table_name, limit=100, offset=0, sort=None, filter=None, after=None, fields=None):
+  return [{'id': 1}, {'id': 2}][:limit]
+
+def find_iter(table_name, sort=None, filter=None, batch_size=1000):
+  yield from [{'id': 1}, {'id': 2}, {'id': 3}]
+
+def create(table_name, doc):
+  raise ValueError('duplicate')
+
+def make_database():
+  return InstrumentedDatabase(SimpleNamespace(find=find, find_iter=find_iter, create=create, id_json_schema={}, pool='the pool'), ['id_json_schema', 'find', 'find_iter', 'create'])
+
+def test_instrumented_database():
+  database = make_database()
+  assert database.find('test_instrumented', 1) == [{'id': 1}]
+  assert database.pool == 'the pool'
+  assert database.id_json_schema == {}
+  assert database.find.__name__ == 'find'
+  with pytest.raises(ValueError):
+    database.create('test_instrumented', {'url': 'a'})
+  assert list(database.find_iter(table_name='test_instrumented')) == [{'id': 1}, {'id': 2}, {'id': 3}]
+  find_metrics = query_metrics[('find', 'test_instrumented')].snapshot()
+  assert (find_metrics.count, find_metrics.rows, find_metrics.errors) == (1, 1, 0)
+  assert query_metrics[('create', 'test_instrumented')].snapshot().errors == 1
+  assert query_metrics[('find_iter', 'test_instrumented')].snapshot().rows == 3
+
+def test_query_scope():
+  database = make_database()
+  database.find('test_scope')
+  with query_scope() as outer:
+    database.find('test_scope')
+    with query_scope() as inner:
+      database.find('test_scope')
+      database.find('test_scope')
+    database.find('test_scope')
+  assert (outer.count, inner.count) == (2, 2)
+  assert outer.duration > 0
+
+def test_logging(monkeypatch, caplog):
+  database = make_database()
+  caplog.set_level(logging.INFO, logger='content_api.db.queries')
+  database.find('test_logging', 1, filter={'url': {'op': 'contains', 'value': 'secret'}})
+  assert caplog.records == []
+  monkeypatch.setattr(instrumentation, 'SAMPLE_RATE', 1)
+  database.find('test_logging', 1, filter={'url': {'op': 'contains', 'value': 'secret'}})
+  (sampled,) = caplog.records
+  assert sampled.levelname == 'INFO'
+  assert json.loads(sampled.message)['shape'] == 'find test_logging filter=url:contains'
+  assert 'secret' not in sampled.message
+  caplog.clear()
+  monkeypatch.setattr(instrumentation, 'SAMPLE_RATE', 0)
+  monkeypatch.setattr(instrumentation, 'SLOW_QUERY_MS', 0)
+  database.find('test_logging', 1, filter={'url': {'op': 'contains', 'value': 'secret'}})
+  (slow,) = caplog.records
+  assert slow.levelname == 'WARNING'
+  assert json.loads(slow.message)['rows'] == 1
+  assert 'secret' in json.loads(slow.message)['arguments']['filter']
+
+def test_query_shape():
+  assert query_shape('find', {'table_name': 'urls', 'limit': 10, 'sort': '-updated_at,-id', 'after': ('x', 1), 'fields': ('id', 'url')}) == 'find urls sort=-updated_at,-id after fields=id,url'
+  assert query_shape('update', {'table_name': 'urls', 'id': 1, 'doc': {'url': 'a', 'updated_at': 'b'}}) == 'update urls columns=url,updated_at'
+  assert query_shape('delete_many', {'table_name': 'urls', 'ids': [1, 2]}) == 'delete_many urls count=2'
+
+def test_row_count():
+  assert row_count(None) == 0
+  assert row_count(([{'id': 1}], 10)) == 1
+  assert row_count(5) == 1
+  assert row_count(5, 'create') == 1
+  assert row_count(5000, 'count') == 0
+  assert row_count(5000, 'estimate_count') == 0
+  assert row_count(0, 'update') == 0
+  assert row_count(1, 'delete') == 1
+  assert row_count(SimpleNamespace(rowcount=-1)) == 0
+  assert row_count(SimpleNamespace(deleted_count=2)) == 2
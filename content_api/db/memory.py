@@ -0,0 +1,485 @@
+'''
+An in-memory, thread safe database backend (DATABASE=memory) for
+benchmarks, tests and small reference data. Tables are created on first use
+and live as long as the process, each process has its own. The column
+defaults of a db_schema are applied (see define_table), its constraints
+(UNIQUE, foreign keys) are not, only unique indexes created with
+create_index are enforced.
+
+Each table keeps sorted (value, id) indexes for the columns that are
+indexed with create_index or are filtered or sorted on (built on first
+use). eq/lt/gt filters are answered by bisecting the most selective index
+and sorts on column,id (which model_api.seek_sort produces) walk an index
+in order, stopping at the end of the page.
+'''
+import re
+import threading
+from datetime import datetime
+from bisect import bisect_left, bisect_right, insort
+from functools import cmp_to_key
+from content_api.db.seek import null_values, seek_clauses
+
+class IntegrityError(Exception):
+  pass
+
+class UniqueViolation(IntegrityError):
+  pass
+
+class Index:
+  '''
+    Sorted (value, id) keys of the rows where column is not None, the ids
+    of the other rows are in nulls
+  '''
+  def __init__(self, column, unique=False):
+    self.column = column
+    self.unique = unique
+    self.keys = []
+    self.nulls = set()
+
+  def add(self, doc):
+    value = doc.get(self.column)
+    if value is None:
+      self.nulls.add(doc['id'])
+      return
+    if self.unique and any(id != doc['id'] for id in self.ids('eq', value)):
+      raise UniqueViolation(f'duplicate key value violates unique constraint: {self.column}={value}')
+    insort(self.keys, (value, doc['id']))
+
+  def remove(self, doc):
+    value = doc.get(self.column)
+    if value is None:
+      self.nulls.discard(doc['id'])
+      return
+    i = bisect_left(self.keys, (value, doc['id']))
+    if i < len(self.keys) and self.keys[i] == (value, doc['id']):
+      del self.keys[i]
+
+  def range(self, op, value):
+    '''
+      The (start, end) slice of keys matching an eq, lt or gt filter
+    '''
+    if op == 'eq':
+      return (bisect_left(self.keys, (value,)), bisect_right(self.keys, (value, float('inf'))))
+    if op == 'lt':
+      return (0, bisect_left(self.keys, (value,)))
+    if op == 'gt':
+      return (bisect_right(self.keys, (value, float('inf'))), len(self.keys))
+    return None
+
+  def ids(self, op, value):
+    (start, end) = self.range(op, value)
+    return [id for (_, id) in self.keys[start:end]]
+
+  def ordered_ids(self, descending, after=None):
+    '''
+      Ids in (value, id) order, NULLs last like PostgreSQL (first when
+      descending), starting after the (value, id) key if given
+    '''
+    nulls = sorted(self.nulls, reverse=descending)
+    if descending:
+      if after is None:
+        yield from nulls
+        end = len(self.keys)
+      elif after[0] is None:
+        yield from (id for id in nulls if id < after[1])
+        end = len(self.keys)
+      else:
+        end = bisect_left(self.keys, after)
+      for i in range(end - 1, -1, -1):
+        yield self.keys[i][1]
+    else:
+      if after is not None and after[0] is None:
+        yield from (id for id in nulls if id > after[1])
+        return
+      start = bisect_right(self.keys, after) if after is not None else 0
+      for i in range(start, len(self.keys)):
+        yield self.keys[i][1]
+      yield from nulls
+
+class Table:
+  def __init__(self):
+    self.rows = {}
+    self.next_id = 1
+    self.indexes = {}
+    # Functions returning the default value by column, see define_table
+    self.defaults = {}
+    self.lock = threading.RLock()
+
+  def index(self, column):
+    if column not in self.indexes:
+      index = Index(column)
+      for doc in self.rows.values():
+        index.add(doc)
+      self.indexes[column] = index
+    return self.indexes[column]
+
+  def insert(self, doc):
+    defaults = {column: default() for column, default in self.defaults.items() if column not in doc}
+    doc = {**defaults, **doc, 'id': self.next_id}
+    added = []
+    try:
+      for index in self.indexes.values():
+        index.add(doc)
+        added.append(index)
+    except IntegrityError:
+      for index in added:
+        index.remove(doc)
+      raise
+    self.next_id += 1
+    self.rows[doc['id']] = doc
+    return doc
+
+  def replace(self, old, new):
+    for index in self.indexes.values():
+      index.remove(old)
+    try:
+      for index in self.indexes.values():
+        index.add(new)
+    except IntegrityError:
+      for index in self.indexes.values():
+        index.remove(new)
+        index.add(old)
+      raise
+    self.rows[new['id']] = new
+
+  def remove(self, doc):
+    for index in self.indexes.values():
+      index.remove(doc)
+    del self.rows[doc['id']]
+
+tables = {}
+tables_lock = threading.Lock()
+
+def table(table_name):
+  with tables_lock:
+    if table_name not in tables:
+      tables[table_name] = Table()
+    return tables[table_name]
+
+# A column definition with a DEFAULT, i.e. "next_fetch_at TIMESTAMP NOT NULL DEFAULT 'epoch'"
+COLUMN_DEFAULT = re.compile(r"^\s*([a-zA-Z0-9_]+)\s+([a-zA-Z]+)[^,\n]*?\bDEFAULT\s+('(?:[^']|'')*'|[^\s,]+)", re.IGNORECASE | re.MULTILINE)
+
+def column_default(type_name, value):
+  '''
+    A function returning the value of a PostgreSQL DEFAULT expression,
+    None for expressions that are not supported (i.e. NULL or nextval)
+  '''
+  type_name = type_name.lower()
+  if re.match(r'\A(now\(\)|current_timestamp)\Z', value, re.IGNORECASE):
+    return datetime.now
+  if value.startswith("'"):
+    text = value[1:-1].replace("''", "'")
+    if type_name.startswith('timestamp') or type_name == 'date':
+      parsed = datetime(1970, 1, 1) if text.lower() == 'epoch' else datetime.fromisoformat(text)
+      parsed = parsed.date() if type_name == 'date' else parsed
+      return lambda: parsed
+    return lambda: text
+  if value.lower() in ['true', 'false']:
+    return lambda: value.lower() == 'true'
+  if re.match(r'\A-?[0-9]+\Z', value):
+    return lambda: int(value)
+  if re.match(r'\A-?[0-9]*\.[0-9]+\Z', value):
+    return lambda: float(value)
+  return None
+
+def define_table(table_name, db_schema):
+  '''
+    Applies the column defaults of the PostgreSQL db_schema of a model to
+    the docs created in the table
+  '''
+  defaults = {}
+  for (column, type_name, value) in COLUMN_DEFAULT.findall(db_schema):
+    default = column_default(type_name, value)
+    if default is not None:
+      defaults[column] = default
+  t = table(table_name)
+  with t.lock:
+    t.defaults = defaults
+
+def row_id(id):
+  try:
+    return int(id)
+  except (TypeError, ValueError):
+    return None
+
+def matches(doc, filter):
+  for column, f in (filter or {}).items():
+    value = doc.get(column)
+    if f['op'] == 'contains':
+      if value is None or str(f['value']) not in str(value):
+        return False
+    elif value is None:
+      return False
+    elif f['op'] == 'lt' and not value < f['value']:
+      return False
+    elif f['op'] == 'gt' and not value > f['value']:
+      return False
+    elif f['op'] == 'eq' and value != f['value']:
+      return False
+  return True
+
+def parse_sort(sort):
+  if not sort:
+    return [('id', False)]
+  return [(item[1:], True) if item.startswith('-') else (item, False) for item in sort.split(',')]
+
+def compare(a, b, sort_items):
+  for (column, descending) in sort_items:
+    (x, y) = (a.get(column), b.get(column))
+    # NULLs sort last (first when descending) like PostgreSQL
+    (kx, ky) = ((x is None, x), (y is None, y))
+    if kx != ky:
+      result = -1 if kx < ky else 1
+      return -result if descending else result
+  return 0
+
+def is_after(doc, after, sort_items):
+  '''
+    Whether the doc comes after the sort key values, NULLs are the largest
+    values like in compare
+  '''
+  def holds(index, condition):
+    (column, descending) = sort_items[index]
+    (x, y) = (doc.get(column), after[index])
+    if condition in ['null', 'not_null']:
+      return (x is None) == (condition == 'null')
+    if condition == 'eq':
+      return x == y
+    if x is None:
+      return condition == 'after_or_null'
+    return x < y if descending else x > y
+  clauses = seek_clauses(sort_items, null_values(after), True)
+  return any(all(holds(index, condition) for (index, condition) in clause) for clause in clauses)
+
+def best_range(t, filter):
+  '''
+    The (index, start, end) range with the fewest rows of the eq, lt and
+    gt filters, None if there are none
+  '''
+  best = None
+  for column, f in (filter or {}).items():
+    if f['op'] in ['eq', 'lt', 'gt']:
+      (start, end) = t.index(column).range(f['op'], f['value'])
+      if best is None or end - start < best[2] - best[1]:
+        best = (t.indexes[column], start, end)
+  return best
+
+def candidates(t, best):
+  # The rows to check against the filter
+  if best is None:
+    return list(t.rows.values())
+  (index, start, end) = best
+  return [t.rows[id] for (_, id) in index.keys[start:end]]
+
+def index_order(sort_items):
+  # column,id sorts in one direction are in the order of the column index
+  if len(sort_items) == 1 and sort_items[0][0] == 'id':
+    return ('id', sort_items[0][1])
+  if len(sort_items) == 2 and sort_items[1][0] == 'id' and sort_items[0][1] == sort_items[1][1]:
+    return sort_items[0]
+  return None
+
+def select(t, sort, filter, after=None):
+  '''
+    Generator of the rows matching the filter in sort order, after the sort
+    key values if given. Call with the table lock held.
+  '''
+  sort_items = parse_sort(sort)
+  best = best_range(t, filter)
+  order = index_order(sort_items)
+  # A selective filter is cheaper to sort than to find in the index order
+  if order and (best is None or (best[2] - best[1]) * 10 > len(t.rows)):
+    (column, descending) = order
+    start = None if after is None else (after[0], after[-1])
+    for id in t.index(column).ordered_ids(descending, start):
+      doc = t.rows[id]
+      if matches(doc, filter):
+        yield doc
+    return
+  rows = [doc for doc in candidates(t, best) if matches(doc, filter)]
+  if after is not None:
+    rows = [doc for doc in rows if is_after(doc, after, sort_items)]
+  yield from sorted(rows, key=cmp_to_key(lambda a, b: compare(a, b, sort_items)))
+
+def project(doc, fields):
+  if not fields:
+    return dict(doc)
+  return {name: doc[name] for name in fields if name in doc}
+
+def page(t, limit, offset, sort, filter, after, fields):
+  docs = []
+  for i, doc in enumerate(select(t, sort, filter, after)):
+    if i >= offset + limit:
+      break
+    if i >= offset:
+      docs.append(project(doc, fields))
+  return docs
+
+def count_rows(t, filter):
+  if not filter:
+    return len(t.rows)
+  if len(filter) == 1:
+    ((column, f),) = filter.items()
+    if f['op'] in ['eq', 'lt', 'gt']:
+      (start, end) = t.index(column).range(f['op'], f['value'])
+      return end - start
+  return sum(1 for doc in candidates(t, best_range(t, filter)) if matches(doc, filter))
+
+#############################################################
+#
+# Database Interface
+#
+#############################################################
+
+id_json_schema = {'type': 'integer', 'minimum': 1, 'x-meta': {'writable': False}}
+
+integrity_errors = (IntegrityError,)
+
+def count(table_name, filter=None):
+  t = table(table_name)
+  with t.lock:
+    return count_rows(t, filter)
+
+def estimate_count(table_name, filter=None):
+  # Counts are cheap, see count_rows
+  return count(table_name, filter)
+
+def find(table_name, limit=100, offset=0, sort=None, filter=None, after=None, fields=None):
+  t = table(table_name)
+  with t.lock:
+    return page(t, limit, offset, sort, filter, after, fields)
+
+def find_with_count(table_name, limit=100, offset=0, sort=None, filter=None, fields=None):
+  t = table(table_name)
+  with t.lock:
+    return (page(t, limit, offset, sort, filter, None, fields), count_rows(t, filter))
+
+def find_iter(table_name, sort=None, filter=None, batch_size=1000):
+  '''
+    Generator of all rows matching the filter, from a snapshot taken
+    batch_size rows at a time so that writes are not blocked for long
+  '''
+  t = table(table_name)
+  after = None
+  sort = sort or 'id'
+  sort_items = parse_sort(sort)
+  if sort_items[-1][0] != 'id':
+    # A total order so that a batch can continue after the previous one
+    sort = f'{sort},{"-" if sort_items[-1][1] else ""}id'
+    sort_items = parse_sort(sort)
+  while True:
+    with t.lock:
+      docs = page(t, batch_size, 0, sort, filter, after, None)
+    yield from docs
+    if len(docs) < batch_size:
+      return
+    after = tuple(docs[-1].get(column) for (column, _) in sort_items)
+
+def find_one(table_name, id, fields=None):
+  t = table(table_name)
+  with t.lock:
+    doc = t.rows.get(row_id(id))
+    return project(doc, fields) if doc else None
+
+def create(table_name, doc):
+  return create_returning(table_name, doc)['id']
+
+def update(table_name, id, doc):
+  return update_returning(table_name, id, doc)
+
+def delete(table_name, id):
+  return delete_returning(table_name, id)
+
+def create_returning(table_name, doc):
+  t = table(table_name)
+  with t.lock:
+    return dict(t.insert(doc))
+
+def update_returning(table_name, id, doc):
+  t = table(table_name)
+  with t.lock:
+    old = t.rows.get(row_id(id))
+    if old is None:
+      return None
+    new = {**old, **doc, 'id': old['id']}
+    t.replace(old, new)
+    return dict(new)
+
+def delete_returning(table_name, id):
+  t = table(table_name)
+  with t.lock:
+    doc = t.rows.get(row_id(id))
+    if doc is None:
+      return None
+    t.remove(doc)
+    return dict(doc)
+
+def create_many(table_name, docs):
+  # All or nothing, like the transaction of the PostgreSQL backend
+  t = table(table_name)
+  with t.lock:
+    created = []
+    try:
+      for doc in docs:
+        created.append(t.insert(doc))
+    except IntegrityError:
+      for doc in created:
+        t.remove(doc)
+      raise
+    return [dict(doc) for doc in created]
+
+def update_many(table_name, docs):
+  t = table(table_name)
+  with t.lock:
+    replaced = []
+    try:
+      for doc in docs:
+        old = t.rows.get(row_id(doc['id']))
+        if old is not None:
+          new = {**old, **doc, 'id': old['id']}
+          t.replace(old, new)
+          replaced.append((old, new))
+    except IntegrityError:
+      for (old, new) in reversed(replaced):
+        t.replace(new, old)
+      raise
+    return [dict(new) for (_, new) in replaced]
+
+def delete_many(table_name, ids):
+  t = table(table_name)
+  with t.lock:
+    docs = [t.rows[row_id(id)] for id in ids if row_id(id) in t.rows]
+    for doc in docs:
+      t.remove(doc)
+    return [dict(doc) for doc in docs]
+
+def claim_due(table_name, column, due, until, limit, doc=None):
+  '''
+    Claims up to limit rows where column is before due (the earliest
+    first) by setting it to until (and the columns of doc) and returns
+    them, under the table lock
+  '''
+  t = table(table_name)
+  with t.lock:
+    claimed = []
+    for old in page(t, limit, 0, f'{column},id', {column: {'op': 'lt', 'value': due}}, None, None):
+      new = {**old, **(doc or {}), column: until, 'id': old['id']}
+      t.replace(t.rows[old['id']], new)
+      claimed.append(dict(new))
+    return claimed
+
+def create_index(table_name, index):
+  '''
+    Indexes the first column of the index (see content_api/indexes.py),
+    which serves both sort directions. Unique indexes reject duplicates.
+  '''
+  column = index['columns'][0].removeprefix('-')
+  t = table(table_name)
+  with t.lock:
+    if index['unique'] and len(index['columns']) == 1:
+      unique = Index(column, unique=True)
+      for doc in t.rows.values():
+        unique.add(doc)
+      t.indexes[column] = unique
+    else:
+      t.index(column)
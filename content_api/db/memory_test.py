@@ -0,0 +1,166 @@
+import threading
+from datetime import datetime, timedelta
+import pytest
+import content_api.db.memory as memory
+
+@pytest.fixture
+def table_name(request):
+  return f'test_{request.node.name}'
+
+def make_docs(table_name, n=10):
+  start = datetime(2023, 12, 2)
+  return memory.create_many(table_name, [{
+    'url': f'https://example.com/{i % 3}/{i}',
+    'created_at': start + timedelta(hours=i),
+    'rank': None if i % 4 == 0 else i % 5
+  } for i in range(n)])
+
+def eq(value):
+  return {'op': 'eq', 'value': value}
+
+def test_crud(table_name):
+  doc = memory.create_returning(table_name, {'url': 'a'})
+  assert doc == {'id': 1, 'url': 'a'}
+  assert memory.find_one(table_name, '1') == doc
+  assert memory.find_one(table_name, '01', fields=('url',)) == {'url': 'a'}
+  assert memory.find_one(table_name, 'foo') == None
+  assert memory.update_returning(table_name, 1, {'url': 'b'}) == {'id': 1, 'url': 'b'}
+  assert memory.update_returning(table_name, 2, {'url': 'b'}) == None
+  assert memory.delete_returning(table_name, '1') == {'id': 1, 'url': 'b'}
+  assert memory.find_one(table_name, 1) == None
+  # Ids are not reused
+  assert memory.create(table_name, {'url': 'c'}) == 2
+  # Returned docs are copies
+  memory.find_one(table_name, 2)['url'] = 'd'
+  assert memory.find_one(table_name, 2)['url'] == 'c'
+
+def test_filter_and_count(table_name):
+  docs = make_docs(table_name)
+  assert memory.count(table_name) == 10
+  assert memory.count(table_name, {'rank': eq(1)}) == len([d for d in docs if d['rank'] == 1])
+  assert memory.count(table_name, {'url': {'op': 'contains', 'value': '/1/'}}) == 3
+  cutoff = datetime(2023, 12, 2, 5)
+  assert [d['id'] for d in memory.find(table_name, sort='id', filter={'created_at': {'op': 'lt', 'value': cutoff}})] == [1, 2, 3, 4, 5]
+  assert [d['id'] for d in memory.find(table_name, sort='id', filter={'created_at': {'op': 'gt', 'value': cutoff}, 'rank': {'op': 'gt', 'value': 2}})] == \
+    [d['id'] for d in docs if d['created_at'] > cutoff and d['rank'] is not None and d['rank'] > 2]
+  # NULLs match no comparison
+  assert memory.count(table_name, {'rank': {'op': 'lt', 'value': 100}}) == 7
+  (page, count) = memory.find_with_count(table_name, 2, 1, '-created_at,-id', {'url': {'op': 'contains', 'value': '/1/'}}, fields=('id',))
+  assert (page, count) == ([{'id': 5}, {'id': 2}], 3)
+
+def test_sort_and_seek(table_name):
+  docs = make_docs(table_name)
+  def expected(key, reverse):
+    return [d['id'] for d in sorted(docs, key=key, reverse=reverse)]
+  # NULLs last ascending, first descending
+  rank_key = lambda d: (d['rank'] is None, d['rank'] if d['rank'] is not None else 0, d['id'])
+  for (sort, reverse) in [('rank,id', False), ('-rank,-id', True)]:
+    ids = [d['id'] for d in memory.find(table_name, 100, 0, sort)]
+    assert ids == expected(rank_key, reverse)
+    # Keyset pages continue after the sort key of the previous page
+    seen = []
+    after = None
+    while True:
+      page = memory.find(table_name, 3, 0, sort, after=after)
+      seen += [d['id'] for d in page]
+      if len(page) < 3:
+        break
+      after = (page[-1]['rank'], page[-1]['id'])
+    assert seen == ids
+  # Mixed directions are sorted without an index order, also across NULLs
+  for sort in ['rank,-id', '-rank,id', 'rank,-created_at,id']:
+    ids = [d['id'] for d in memory.find(table_name, 100, 0, sort)]
+    seen = []
+    after = None
+    while len(seen) < len(ids):
+      page = memory.find(table_name, 1, 0, sort, after=after)
+      assert page
+      seen += [d['id'] for d in page]
+      after = tuple(page[-1][item.lstrip('-')] for item in sort.split(','))
+    assert seen == ids
+  ids = [d['id'] for d in memory.find(table_name, 100, 0, 'url,-created_at')]
+  assert ids == [d['id'] for d in sorted(sorted(docs, key=lambda d: d['created_at'], reverse=True), key=lambda d: d['url'])]
+  assert [d['id'] for d in memory.find(table_name, 3, 2, '-id')] == [8, 7, 6]
+  assert [d['id'] for d in memory.find_iter(table_name, '-created_at', batch_size=3)] == expected(lambda d: d['created_at'], True)
+
+def test_indexes_follow_writes(table_name):
+  make_docs(table_name)
+  assert memory.count(table_name, {'rank': eq(7)}) == 0
+  memory.update_many(table_name, [{'id': 1, 'rank': 7}, {'id': 2, 'rank': 7}, {'id': 99, 'rank': 7}])
+  assert [d['id'] for d in memory.find(table_name, sort='id', filter={'rank': eq(7)})] == [1, 2]
+  assert [d['id'] for d in memory.delete_many(table_name, [2, 99, 1])] == [2, 1]
+  assert memory.count(table_name, {'rank': eq(7)}) == 0
+
+def test_unique_index(table_name):
+  memory.create_many(table_name, [{'email': 'a'}, {'email': 'b'}])
+  memory.create_index(table_name, {'columns': ['email'], 'unique': True})
+  with pytest.raises(memory.UniqueViolation):
+    memory.create(table_name, {'email': 'a'})
+  with pytest.raises(memory.UniqueViolation):
+    memory.update(table_name, 2, {'email': 'a'})
+  # Bulk writes are all or nothing
+  with pytest.raises(memory.UniqueViolation):
+    memory.create_many(table_name, [{'email': 'c'}, {'email': 'b'}])
+  with pytest.raises(memory.UniqueViolation):
+    memory.update_many(table_name, [{'id': 1, 'email': 'd'}, {'id': 2, 'email': 'd'}])
+  assert [d['email'] for d in memory.find(table_name, sort='id')] == ['a', 'b']
+  assert memory.update(table_name, 1, {'email': 'a'})['email'] == 'a'
+
+def test_concurrent_writes(table_name):
+  def create():
+    for i in range(200):
+      memory.create(table_name, {'n': i})
+  threads = [threading.Thread(target=create) for _ in range(4)]
+  for thread in threads:
+    thread.start()
+  for thread in threads:
+    thread.join()
+  assert memory.count(table_name) == 800
+  assert memory.count(table_name, {'n': eq(5)}) == 4
+  assert [d['id'] for d in memory.find(table_name, 800, 0, 'id')] == list(range(1, 801))
+
+def test_claim_due(table_name):
+  docs = make_docs(table_name, 4)
+  until = datetime(2024, 1, 1)
+  claimed = memory.claim_due(table_name, 'created_at', datetime(2023, 12, 2, 2), until, 10, {'rank': 0})
+  assert [d['id'] for d in claimed] == [1, 2]
+  assert all(d['created_at'] == until and d['rank'] == 0 for d in claimed)
+  # Claimed docs are no longer due
+  assert [d['id'] for d in memory.claim_due(table_name, 'created_at', datetime(2023, 12, 3), until, 1)] == [3]
+  assert [d['id'] for d in memory.find(table_name, sort='created_at,id', filter={'created_at': eq(until)})] == [1, 2, 3]
+
+def test_concurrent_claims(table_name):
+  memory.create_many(table_name, [{'due': i} for i in range(400)])
+  claimed = []
+  def claim():
+    while True:
+      docs = memory.claim_due(table_name, 'due', 1000, 1000, 7)
+      if not docs:
+        return
+      claimed.extend(d['id'] for d in docs)
+  threads = [threading.Thread(target=claim) for _ in range(4)]
+  for thread in threads:
+    thread.start()
+  for thread in threads:
+    thread.join()
+  # Each doc is claimed exactly once
+  assert sorted(claimed) == list(range(1, 401))
+
+def test_define_table(table_name):
+  memory.define_table(table_name, f'''
+    CREATE TABLE {table_name} (
+      id serial PRIMARY KEY,
+      url VARCHAR (355) UNIQUE NOT NULL,
+      created_at TIMESTAMP NOT NULL DEFAULT now(),
+      next_fetch_at TIMESTAMP NOT NULL DEFAULT 'epoch',
+      status VARCHAR (16) DEFAULT 'it''s new',
+      rank integer DEFAULT 3,
+      active boolean DEFAULT true,
+      note TEXT DEFAULT NULL
+    )
+  ''')
+  doc = memory.create_returning(table_name, {'url': 'a', 'rank': None})
+  assert doc['next_fetch_at'] == datetime(1970, 1, 1)
+  assert (datetime.now() - doc['created_at']).total_seconds() < 1
+  assert (doc['status'], doc['rank'], doc['active']) == ("it's new", None, True)
+  assert 'note' not in doc
@@ -1,27 +1,73 @@
 import os
 import pymongo
+from pymongo import UpdateOne, ReturnDocument
+from pymongo.errors import DuplicateKeyError, BulkWriteError
 from bson.objectid import ObjectId
-from content_api.util import remove_none
+from content_api.util import remove_none, omit
+from content_api.db.seek import null_values, seek_clauses
 
 DATABASE_URL = os.environ.get('MONGODB_URI', os.environ.get('DATABASE_URL', 'mongodb://localhost:27017/python-rest-api'))
 DATABASE_URL += '?retryWrites=false' # This seems to be needed for mlab on Heroku
 client = pymongo.MongoClient(DATABASE_URL)
 db = client.get_default_database()
 
+def find_many(collection, ids):
+  docs = {doc['_id']: doc for doc in db[collection].find({'_id': {'$in': [ObjectId(id) for id in ids]}})}
+  return [with_id_str(docs[ObjectId(id)]) for id in ids if ObjectId(id) in docs]
+
 def with_id_str(doc):
   if not doc or not '_id' in doc:
     return doc
   return remove_none({**doc, 'id': str(doc['_id']), '_id': None})
 
+def field_name(name):
+  return '_id' if name == 'id' else name
+
+def field_value(name, value):
+  return ObjectId(value) if name == 'id' else value
+
 def parse_sort(sort):
   if not sort:
     return None
   def parse_item(item):
     name = item[1:] if item.startswith('-') else item
     direction = -1 if item.startswith('-') else 1
-    return (name, direction)
+    return (field_name(name), direction)
   return [parse_item(item) for item in sort.split(',')]
 
+def seek_filter(sort, after):
+  '''
+    Keyset pagination filter selecting the documents that come after the
+    given sort key values in the sort order
+  '''
+  names = [item[1:] if item.startswith('-') else item for item in sort.split(',')]
+  fields = parse_sort(sort)
+  def condition_filter(index, condition):
+    (field, direction) = fields[index]
+    value = None if after[index] is None else field_value(names[index], after[index])
+    op = '$lt' if direction == -1 else '$gt'
+    return {
+      'null': {field: None},
+      'eq': {field: value},
+      'not_null': {field: {'$ne': None}},
+      'after': {field: {op: value}},
+      'after_or_null': {'$or': [{field: {op: value}}, {field: None}]}
+    }[condition]
+  # MongoDB orders null (and missing fields) before all other values
+  clauses = seek_clauses([(name, direction == -1) for (name, (_, direction)) in zip(names, fields)], null_values(after), False)
+  if not clauses:
+    return {'_id': {'$in': []}}
+  return {'$or': [{'$and': [condition_filter(index, condition) for (index, condition) in clause]} for clause in clauses]}
+
+def find_filter(filter, sort=None, after=None):
+  if not after:
+    return parse_filter(filter)
+  return {'$and': [parse_filter(filter), seek_filter(sort, after)]}
+
+def projection(fields):
+  # _id is always included
+  return {field_name(name): 1 for name in fields} if fields else None
+
 def parse_filter(filter):
   if not filter:
     return {}
@@ -38,16 +84,45 @@ def parse_filter(filter):
 
 id_json_schema = {'type': 'string', 'pattern': '^[a-z0-9]{24}$', 'x-meta': {'writable': False}}
 
+# Unique index violations, BulkWriteError for the bulk writes
+integrity_errors = (DuplicateKeyError, BulkWriteError)
+
 def count(collection, filter={}):
-  print(f'count filter={parse_filter(filter)}')
   return db[collection].count_documents(parse_filter(filter))
 
-def find(collection, limit=100, offset=0, sort=None, filter=None):
-  print(f'find filter={parse_filter(filter)}')
-  return [with_id_str(doc) for doc in list(db[collection].find(limit=limit, skip=offset, sort=parse_sort(sort), filter=parse_filter(filter)))]
+def estimate_count(collection, filter=None):
+  # There is no estimate for filtered counts, the caller falls back to count
+  if filter:
+    return None
+  return db[collection].estimated_document_count()
+
+def find(collection, limit=100, offset=0, sort=None, filter=None, after=None, fields=None):
+  return [with_id_str(doc) for doc in list(db[collection].find(limit=limit, skip=offset, sort=parse_sort(sort), filter=find_filter(filter, sort, after), projection=projection(fields)))]
+
+def find_with_count(collection, limit=100, offset=0, sort=None, filter=None, fields=None):
+  '''
+    Returns (docs, count) where count is the number of documents matching
+    the filter, from one $facet aggregation
+  '''
+  page = ([{'$sort': dict(parse_sort(sort))}] if sort else []) + [{'$skip': offset}, {'$limit': limit}] + ([{'$project': projection(fields)}] if fields else [])
+  pipeline = [
+    {'$match': parse_filter(filter)},
+    {'$facet': {'data': page, 'count': [{'$count': 'count'}]}}
+  ]
+  result = next(db[collection].aggregate(pipeline))
+  count = result['count'][0]['count'] if result['count'] else 0
+  return ([with_id_str(doc) for doc in result['data']], count)
+
+def find_iter(collection, sort=None, filter=None, batch_size=1000):
+  cursor = db[collection].find(sort=parse_sort(sort), filter=parse_filter(filter)).batch_size(batch_size)
+  try:
+    for doc in cursor:
+      yield with_id_str(doc)
+  finally:
+    cursor.close()
 
-def find_one(collection, id):
-  return with_id_str(db[collection].find_one({'_id': ObjectId(id)}))
+def find_one(collection, id, fields=None):
+  return with_id_str(db[collection].find_one({'_id': ObjectId(id)}, projection=projection(fields)))
 
 def create(collection, doc):
   result = db[collection].insert_one(doc)
@@ -63,3 +138,62 @@ def delete(collection, id):
   result = db[collection].delete_one({'_id': ObjectId(id)})
   # TODO: use result.deleted_count?
   return result
+
+# The *_returning writes return the written doc (None if there is no doc
+# with the id) without reading it back
+
+def create_returning(collection, doc):
+  doc = dict(doc) # insert_one sets _id on the doc
+  db[collection].insert_one(doc)
+  return with_id_str(doc)
+
+def update_returning(collection, id, doc):
+  return with_id_str(db[collection].find_one_and_update({'_id': ObjectId(id)}, {'$set': doc}, return_document=ReturnDocument.AFTER))
+
+def delete_returning(collection, id):
+  return with_id_str(db[collection].find_one_and_delete({'_id': ObjectId(id)}))
+
+def create_index(collection, index):
+  '''
+    Creates the index (see content_api/indexes.py) unless it exists. There
+    are no substring indexes in MongoDB so a trigram index is a regular
+    index, which a contains (regex) filter scans instead of the documents.
+  '''
+  keys = [(field_name(c[1:]), pymongo.DESCENDING) if c.startswith('-') else (field_name(c), pymongo.ASCENDING) for c in index['columns']]
+  db[collection].create_index(keys, name=index['name'], unique=index['unique'])
+
+def claim_due(collection, column, due, until, limit, doc=None):
+  '''
+    Claims up to limit documents where column is before due (the earliest
+    first) by setting it to until (and the fields of doc) and returns them.
+    Each document is claimed by an atomic find_one_and_update, so
+    concurrent workers never claim the same one.
+  '''
+  claimed = []
+  for _ in range(limit):
+    found = db[collection].find_one_and_update({column: {'$lt': due}}, {'$set': {**(doc or {}), column: until}},
+      sort=[(column, pymongo.ASCENDING)], return_document=ReturnDocument.AFTER)
+    if found is None:
+      break
+    claimed.append(with_id_str(found))
+  return claimed
+
+# NOTE: the bulk writes below are ordered but not transactional, MongoDB
+# transactions require a replica set
+
+def create_many(collection, docs):
+  docs = [dict(doc) for doc in docs] # insert_many sets _id on the docs
+  db[collection].insert_many(docs, ordered=True)
+  return [with_id_str(doc) for doc in docs]
+
+def update_many(collection, docs):
+  # $set can't be empty, docs with only an id are returned unchanged
+  requests = [UpdateOne({'_id': ObjectId(doc['id'])}, {'$set': omit(doc, ['id'])}) for doc in docs if omit(doc, ['id'])]
+  if requests:
+    db[collection].bulk_write(requests, ordered=True)
+  return find_many(collection, [doc['id'] for doc in docs])
+
+def delete_many(collection, ids):
+  docs = find_many(collection, ids)
+  db[collection].delete_many({'_id': {'$in': [ObjectId(id) for id in ids]}})
+  return docs
@@ -1,74 +1,99 @@
 import psycopg2
 import psycopg2.extras
+import psycopg2.errors
 import os
-import re
+import json
+import uuid
+from datetime import date
+from contextlib import contextmanager
+from content_api.db.pg_pool import ConnectionPool
+from content_api.db.pg_statements import make_connection_factory, statement_stats
+from content_api.db.seek import null_values
+from content_api.db.sql_builder import SqlBuilder, COUNT_COLUMN, group_by_columns, assert_valid_columns, filter_shape, order_sql
 
 DATABASE_URL = os.environ.get('DATABASE_URL', 'postgresql://postgres:@localhost/python-rest-api')
-conn = psycopg2.connect(DATABASE_URL)
-conn.autocommit = True
 
-def execute(*args):
-    cur = conn.cursor()
-    cur.execute(*args)
-    return cur
+# Connections are opened lazily on first use, i.e. after any fork
+pool = ConnectionPool(DATABASE_URL,
+    min_size=int(os.environ.get('DATABASE_POOL_MIN', 1)),
+    max_size=int(os.environ.get('DATABASE_POOL_MAX', 10)),
+    timeout=float(os.environ.get('DATABASE_POOL_TIMEOUT', 30)),
+    check_interval=float(os.environ.get('DATABASE_POOL_CHECK_INTERVAL', 30)),
+    max_idle=float(os.environ.get('DATABASE_POOL_MAX_IDLE', 300)),
+    max_lifetime=float(os.environ.get('DATABASE_POOL_MAX_LIFETIME', 3600)),
+    # Statements executed DATABASE_PREPARE_THRESHOLD times on a connection are
+    # prepared, set DATABASE_PREPARED_STATEMENTS=0 to never prepare (i.e. with
+    # PgBouncer in transaction pooling mode)
+    connection_factory=make_connection_factory(
+      max_statements=int(os.environ.get('DATABASE_PREPARED_STATEMENTS', 100)),
+      threshold=int(os.environ.get('DATABASE_PREPARE_THRESHOLD', 5))))
 
-def query_tuple(*args):
-    cur = conn.cursor()
-    cur.execute(*args)
-    return cur.fetchall()
+# Generated SQL is cached per query shape (table, filter columns and
+# operators, sort and columns), see sql_cache_stats
+SQL_CACHE_SIZE = int(os.environ.get('DATABASE_SQL_CACHE_SIZE', 1024))
 
-def query(*args):
-    cur = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
-    cur.execute(*args)
-    return list(map(dict, cur.fetchall()))
-
-def query_one(*args):
-    rows = query(*args)
-    return rows[0] if len(rows) > 0 else None
+builder = SqlBuilder('%s', '{column} like %s', lambda value: f'%{value}%', SQL_CACHE_SIZE)
 
-def is_valid_column(column):
-  return re.match('\A[a-zA-Z0-9_]+\Z', column)
+def pool_stats():
+    return pool.stats()
 
-def assert_valid_columns(columns):
-  # sanity check columns to protect against SQL injection
-  invalid_columns = [c for c in columns if not is_valid_column(c)]
-  if invalid_columns:
-    raise Exception(f'Invalid column names: {invalid_columns}')
+def sql_cache_stats():
+    return {
+      'prepared_statements': statement_stats(),
+      'sql_cache': builder.cache_stats()
+    }
 
-def where_sql(filter):
-  if not filter:
-    return ('', ())
-  columns = filter.keys()
-  def clause(column):
-    if filter[column]['op'] == 'contains':
-      return f'{column} like %s'
-    elif filter[column]['op'] == 'lt':
-      return f'{column} < %s'
-    elif filter[column]['op'] == 'gt':
-      return f'{column} > %s'
+def run(conn, cur, sql, values, prepare):
+    # Only statements built from cached query shapes are prepared, others
+    # (i.e. DDL) can't be or are not executed often enough to be worth it
+    if prepare and hasattr(conn, 'execute_prepared'):
+        conn.execute_prepared(cur, sql, values)
     else:
-      return f'{column} = %s'
-  def sql_value(column):
-    value = filter[column]['value']
-    if filter[column]['op'] == 'contains':
-      return f'%{value}%'
-    else:
-      return value
-  clauses = [clause(column) for column in columns]
-  sql = 'WHERE ' + ' and '.join(clauses)
-  values = tuple([sql_value(column) for column in columns])
-  return (sql, values)
-
-def order_sql(sort):
-  if not sort:
-    return ''
-  def parse_order(item):
-    direction = 'DESC' if item.startswith('-') else 'ASC'
-    name = item[1:] if item.startswith('-') else item
-    return {'direction': direction, 'name': name}
-  columns = [parse_order(item) for item in sort.split(',')]
-  assert_valid_columns([c['name'] for c in columns])
-  return 'ORDER BY ' + ', '.join([f'{c["name"]} {c["direction"]}' for c in columns])
+        cur.execute(sql, values)
+
+def execute(sql, values=None, prepare=False):
+    # Returns the rowcount, the cursor can't be used once the connection is
+    # back in the pool
+    with pool.connection() as conn:
+        cur = conn.cursor()
+        run(conn, cur, sql, values, prepare)
+        return cur.rowcount
+
+def query_tuple(sql, values=None, prepare=False):
+    with pool.connection() as conn:
+        cur = conn.cursor()
+        run(conn, cur, sql, values, prepare)
+        return cur.fetchall()
+
+def query(sql, values=None, prepare=False):
+    with pool.connection() as conn:
+        cur = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+        run(conn, cur, sql, values, prepare)
+        return list(map(dict, cur.fetchall()))
+
+@contextmanager
+def transaction():
+    '''
+      Yields a pooled connection where everything runs in one transaction,
+      committed on success and rolled back on any exception
+    '''
+    with pool.connection() as conn:
+        conn.autocommit = False
+        try:
+            with conn:
+                yield conn
+        finally:
+            if not conn.closed:
+                conn.autocommit = True
+
+def query_one(sql, values=None, prepare=False):
+    rows = query(sql, values, prepare)
+    return rows[0] if len(rows) > 0 else None
+
+def json_value(value):
+  if isinstance(value, date):
+    return value.isoformat()
+  raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
 
 #############################################################
 #
@@ -78,39 +103,170 @@ def order_sql(sort):
 
 id_json_schema = {'type': 'integer', 'minimum': 1, 'x-meta': {'writable': False}}
 
+# The constraint violations that are client errors (400)
+integrity_errors = (psycopg2.errors.UniqueViolation, psycopg2.errors.ForeignKeyViolation)
+
 def count(table_name, filter=None):
-  (where_clauses, where_values) = where_sql(filter)
-  return query_one(f'select count(*) from {table_name} {where_clauses}', where_values)['count']
+  return query_one(builder.count_sql(table_name, filter_shape(filter)), builder.where_values(filter), prepare=True)['count']
+
+def estimate_count(table_name, filter=None):
+  if not filter:
+    # reltuples is -1 for tables that have not been vacuumed or analyzed yet
+    row = query_one('select reltuples::bigint as estimate from pg_class where oid = to_regclass(%s)', [table_name])
+    if row and row['estimate'] >= 0:
+      return row['estimate']
+  (where_clauses, where_values) = builder.where_sql(filter)
+  plan = query_tuple(f'EXPLAIN (FORMAT JSON) select 1 from {table_name} {where_clauses}', where_values)[0][0]
+  return plan[0]['Plan']['Plan Rows']
 
-def find(table_name, limit=100, offset=0, sort=None, filter=None):
-  (where_clauses, where_values) = where_sql(filter)
-  values = where_values + (limit, offset)
-  sql = f'select * from {table_name} {where_clauses} {order_sql(sort)} LIMIT %s OFFSET %s'
-  print(f'find sql={sql} values={values}')
-  return query(sql, values)
+# fields is a tuple of the columns to select (all if None), a tuple since
+# it is part of the cached SQL shape
 
-def find_one(table_name, id):
-  return query_one(f'select * from {table_name} where id = %s', [id])
+def find(table_name, limit=100, offset=0, sort=None, filter=None, after=None, fields=None):
+  (sql, seek_indexes) = builder.find_sql(table_name, filter_shape(filter), sort, null_values(after), fields)
+  values = builder.where_values(filter, seek_indexes, after) + (limit, offset)
+  return query(sql, values, prepare=True)
+
+def find_with_count(table_name, limit=100, offset=0, sort=None, filter=None, fields=None):
+  '''
+    Returns (rows, count) where count is the number of rows matching the
+    filter, from one statement. Only an empty page past the first one
+    (where the window function has no rows to report on) needs a count query.
+  '''
+  sql = builder.find_with_count_sql(table_name, filter_shape(filter), sort, fields)
+  values = builder.where_values(filter) + (limit, offset)
+  rows = query(sql, values, prepare=True)
+  if not rows:
+    return ([], count(table_name, filter) if offset > 0 else 0)
+  total = rows[0][COUNT_COLUMN]
+  return ([{k: v for k, v in row.items() if k != COUNT_COLUMN} for row in rows], total)
+
+def find_iter(table_name, sort=None, filter=None, batch_size=1000):
+  '''
+    Generator of all rows matching the filter, fetched batch_size rows at a
+    time with a server side (named) cursor so that memory use stays flat.
+    Holds a pooled connection until the generator is exhausted or closed.
+  '''
+  (where_clauses, where_values) = builder.where_sql(filter)
+  sql = f'select * from {table_name} {where_clauses} {order_sql(sort)}'
+  with transaction() as conn:
+    with conn.cursor(name=f'find_iter_{uuid.uuid4().hex}', cursor_factory=psycopg2.extras.DictCursor) as cur:
+      cur.itersize = batch_size
+      cur.execute(sql, where_values)
+      for row in cur:
+        yield dict(row)
+
+def find_one(table_name, id, fields=None):
+  return query_one(builder.find_one_sql(table_name, fields), [id], prepare=True)
 
 def create(table_name, doc):
-  columns = list(doc.keys())
-  assert_valid_columns(columns)
-  values = [doc[k] for k in columns]
-  interpolate_values = ['%s' for _ in values]
-  sql = f'INSERT INTO {table_name} ({", ".join(columns)}) VALUES ({", ".join(interpolate_values)}) RETURNING id'
-  print(sql)
-  cur = execute(sql, values)
-  id = cur.fetchone()[0]
-  return id
+  columns = tuple(doc.keys())
+  sql = builder.insert_sql(table_name, columns)
+  return query_tuple(sql, [doc[k] for k in columns], prepare=True)[0][0]
 
 def update(table_name, id, doc):
-  columns = list(doc.keys())
-  assert_valid_columns(columns)
-  interpolate_values = [f'{c} = %s' for c in columns]
-  values = [doc[k] for k in columns] + [id]
-  sql = f'UPDATE {table_name} SET {", ".join(interpolate_values)} where id = %s'
-  print(sql)
-  return execute(sql, values)
+  columns = tuple(doc.keys())
+  sql = builder.update_sql(table_name, columns)
+  return execute(sql, [doc[k] for k in columns] + [id], prepare=True)
 
 def delete(table_name, id):
-  return execute(f'DELETE from {table_name} where id = %s', [id])
+  return execute(builder.delete_sql(table_name), [id], prepare=True)
+
+# The *_returning writes return the written row (None if there is no row
+# with the id) from the same statement, so there is no need to read it back
+
+def create_returning(table_name, doc):
+  columns = tuple(doc.keys())
+  sql = builder.insert_sql(table_name, columns, '*')
+  return query_one(sql, [doc[k] for k in columns], prepare=True)
+
+def update_returning(table_name, id, doc):
+  columns = tuple(doc.keys())
+  sql = builder.update_sql(table_name, columns, '*')
+  return query_one(sql, [doc[k] for k in columns] + [id], prepare=True)
+
+def delete_returning(table_name, id):
+  return query_one(builder.delete_sql(table_name, '*'), [id], prepare=True)
+
+def create_many(table_name, docs):
+  '''
+    Inserts the docs with multi row INSERT ... RETURNING * statements in
+    one transaction and returns the created rows in the order of the docs
+  '''
+  rows = [None] * len(docs)
+  with transaction() as conn:
+    cur = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+    for columns, indexes in group_by_columns(docs).items():
+      assert_valid_columns(columns)
+      sql = f'INSERT INTO {table_name} ({", ".join(columns)}) VALUES %s RETURNING *'
+      values = [[docs[i][c] for c in columns] for i in indexes]
+      created = psycopg2.extras.execute_values(cur, sql, values, page_size=len(values), fetch=True)
+      for index, row in zip(indexes, created):
+        rows[index] = dict(row)
+  return rows
+
+def update_many(table_name, docs):
+  '''
+    Updates docs (that need to have an id) in one transaction with one
+    UPDATE ... FROM json_populate_recordset(...) statement per column set.
+    Returns the updated rows in the order of the docs, docs with an id
+    that doesn't exist are left out. Docs with only an id are returned
+    unchanged.
+  '''
+  updated = {}
+  with transaction() as conn:
+    cur = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+    for columns, indexes in group_by_columns(docs).items():
+      assert_valid_columns(columns)
+      set_sql = ', '.join([f'{c} = v.{c}' for c in columns if c != 'id'])
+      if not set_sql:
+        cur.execute(f'select * from {table_name} where id = ANY(%s)', [[docs[i]['id'] for i in indexes]])
+      else:
+        sql = f'UPDATE {table_name} t SET {set_sql} FROM json_populate_recordset(NULL::{table_name}, %s) v WHERE t.id = v.id RETURNING t.*'
+        data = psycopg2.extras.Json([docs[i] for i in indexes], dumps=lambda v: json.dumps(v, default=json_value))
+        cur.execute(sql, [data])
+      for row in cur.fetchall():
+        updated[row['id']] = dict(row)
+  return [updated[doc['id']] for doc in docs if doc['id'] in updated]
+
+def claim_due(table_name, column, due, until, limit, doc=None):
+  '''
+    Claims up to limit rows where column is before due (the earliest
+    first) by setting it to until (and the columns of doc) and returns
+    them, in one statement. Rows claimed by a concurrent transaction are
+    skipped, so concurrent workers never claim the same row.
+  '''
+  doc = {**(doc or {}), column: until}
+  columns = tuple(doc.keys())
+  sql = builder.claim_sql(table_name, column, columns, 'FOR UPDATE SKIP LOCKED')
+  return query(sql, [doc[c] for c in columns] + [due, limit], prepare=True)
+
+def create_index(table_name, index, concurrently=True):
+  '''
+    Creates the index (see content_api/indexes.py) unless it exists,
+    concurrently so that writes to an existing table are not blocked.
+    Trigram indexes (for filter.column[contains]) need the pg_trgm extension.
+  '''
+  columns = [c[1:] if c.startswith('-') else c for c in index['columns']]
+  assert_valid_columns(columns + [index['name']])
+  if index['type'] == 'trigram':
+    execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    using = 'USING gin '
+    columns_sql = ', '.join([f'{c} gin_trgm_ops' for c in columns])
+  else:
+    using = ''
+    columns_sql = ', '.join([f'{c[1:]} DESC' if c.startswith('-') else c for c in index['columns']])
+  unique = 'UNIQUE ' if index['unique'] else ''
+  try:
+    execute(f'CREATE {unique}INDEX {"CONCURRENTLY " if concurrently else ""}IF NOT EXISTS {index["name"]} ON {table_name} {using}({columns_sql})')
+  except psycopg2.Error:
+    if concurrently:
+      # A failed concurrent build leaves an invalid index behind that
+      # IF NOT EXISTS would then skip
+      execute(f'DROP INDEX CONCURRENTLY IF EXISTS {index["name"]}')
+    raise
+
+def delete_many(table_name, ids):
+  rows = query(f'DELETE from {table_name} where id = ANY(%s) RETURNING *', [list(ids)])
+  deleted = {row['id']: row for row in rows}
+  return [deleted[id] for id in ids if id in deleted]
@@ -0,0 +1,214 @@
+import os
+import time
+import threading
+from contextlib import contextmanager
+import psycopg2
+import psycopg2.extensions
+
+class PoolTimeout(Exception):
+  pass
+
+class ConnectionPool:
+  '''
+    A thread safe PostgreSQL connection pool.
+
+    Connections are opened lazily on checkout so that a pool created before
+    a fork (i.e. gunicorn --preload) never shares sockets with the workers.
+    Idle connections are health checked on checkout and broken connections
+    are replaced instead of being handed out.
+  '''
+  def __init__(self, dsn, min_size=1, max_size=10, timeout=30, check_interval=30, max_idle=300, max_lifetime=3600, connection_factory=None):
+    self.dsn = dsn
+    self.connection_factory = connection_factory
+    self.min_size = min_size
+    self.max_size = max_size
+    self.timeout = timeout
+    self.check_interval = check_interval
+    self.max_idle = max_idle
+    self.max_lifetime = max_lifetime
+    self._cond = threading.Condition()
+    self._orphans = []
+    self._reset()
+    if hasattr(os, 'register_at_fork'):
+      os.register_at_fork(after_in_child=self._after_fork)
+
+  def _reset(self):
+    self._pid = os.getpid()
+    self._idle = [] # (conn, last_used) tuples, most recently used last
+    self._created = {}
+    self._size = 0
+    self._stats = {
+      'checkouts': 0,
+      'waits': 0,
+      'wait_time_total': 0.0,
+      'wait_time_max': 0.0,
+      'timeouts': 0,
+      'connects': 0,
+      'discarded': 0
+    }
+
+  def _after_fork(self):
+    # Keep references to inherited connections so that they are never
+    # garbage collected (and closed) in the child, which would terminate
+    # the session of the parent process sharing the same socket.
+    self._orphans.extend(self._created.keys())
+    self._cond = threading.Condition()
+    self._reset()
+
+  def _check_pid(self):
+    if self._pid != os.getpid():
+      self._after_fork()
+
+  def _connect(self):
+    conn = psycopg2.connect(self.dsn, connection_factory=self.connection_factory)
+    conn.autocommit = True
+    with self._cond:
+      self._created[conn] = time.monotonic()
+      self._stats['connects'] += 1
+    return conn
+
+  def _close(self, conn):
+    with self._cond:
+      self._created.pop(conn, None)
+      self._stats['discarded'] += 1
+    try:
+      conn.close()
+    except Exception:
+      pass
+
+  def _is_healthy(self, conn, last_used):
+    if conn.closed:
+      return False
+    now = time.monotonic()
+    if self.max_lifetime and now - self._created.get(conn, now) > self.max_lifetime:
+      return False
+    if now - last_used > self.check_interval:
+      try:
+        conn.cursor().execute('SELECT 1')
+      except psycopg2.Error:
+        return False
+    return True
+
+  def _prune_idle(self):
+    # Called with the lock held, closes connections idle for too long
+    now = time.monotonic()
+    expired = []
+    while self._size > self.min_size and self._idle and now - self._idle[0][1] > self.max_idle:
+      (conn, _) = self._idle.pop(0)
+      self._size -= 1
+      expired.append(conn)
+    return expired
+
+  def _prefill(self):
+    # Open min_size connections on first use in this process
+    while True:
+      with self._cond:
+        if self._size >= self.min_size:
+          return
+        self._size += 1
+      try:
+        conn = self._connect()
+      except Exception:
+        with self._cond:
+          self._size -= 1
+        raise
+      self.putconn(conn)
+
+  def getconn(self):
+    self._check_pid()
+    if self._size < self.min_size:
+      self._prefill()
+    start = time.monotonic()
+    deadline = start + self.timeout
+    conn = None
+    with self._cond:
+      while True:
+        if self._idle:
+          (conn, last_used) = self._idle.pop()
+          break
+        if self._size < self.max_size:
+          self._size += 1
+          break
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+          self._stats['timeouts'] += 1
+          raise PoolTimeout(f'Could not get a database connection within {self.timeout}s (max_size={self.max_size})')
+        self._stats['waits'] += 1
+        self._cond.wait(remaining)
+      wait_time = time.monotonic() - start
+      self._stats['checkouts'] += 1
+      self._stats['wait_time_total'] += wait_time
+      self._stats['wait_time_max'] = max(self._stats['wait_time_max'], wait_time)
+    if conn is not None and not self._is_healthy(conn, last_used):
+      self._close(conn)
+      conn = None
+    if conn is None:
+      try:
+        conn = self._connect()
+      except Exception:
+        with self._cond:
+          self._size -= 1
+          self._cond.notify()
+        raise
+    return conn
+
+  def putconn(self, conn, broken=False):
+    if conn not in self._created:
+      # Connection from before a fork or already discarded
+      return
+    if not broken and not conn.closed and conn.info.transaction_status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+      try:
+        conn.rollback()
+      except psycopg2.Error:
+        broken = True
+    if broken or conn.closed:
+      self._close(conn)
+      with self._cond:
+        self._size -= 1
+        self._cond.notify()
+      return
+    with self._cond:
+      self._idle.append((conn, time.monotonic()))
+      expired = self._prune_idle()
+      self._cond.notify()
+    for expired_conn in expired:
+      self._close(expired_conn)
+
+  @contextmanager
+  def connection(self):
+    conn = self.getconn()
+    try:
+      yield conn
+    except (psycopg2.OperationalError, psycopg2.InterfaceError):
+      self.putconn(conn, broken=True)
+      raise
+    except BaseException:
+      self.putconn(conn)
+      raise
+    else:
+      self.putconn(conn)
+
+  def stats(self):
+    with self._cond:
+      idle = len(self._idle)
+      in_use = self._size - idle
+      checkouts = self._stats['checkouts']
+      return {
+        **self._stats,
+        'pid': self._pid,
+        'min_size': self.min_size,
+        'max_size': self.max_size,
+        'size': self._size,
+        'idle': idle,
+        'in_use': in_use,
+        'utilization': in_use / self.max_size,
+        'wait_time_avg': (self._stats['wait_time_total'] / checkouts) if checkouts else 0.0
+      }
+
+  def close(self):
+    with self._cond:
+      idle = [conn for (conn, _) in self._idle]
+      self._size -= len(idle)
+      self._idle = []
+    for conn in idle:
+      self._close(conn)
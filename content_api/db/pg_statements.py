@@ -0,0 +1,121 @@
+import threading
+from collections import OrderedDict
+import psycopg2
+import psycopg2.errors
+import psycopg2.extensions
+
+# Statement counters of all connections in the process, see statement_stats
+_lock = threading.Lock()
+_stats = {
+  'hits': 0,
+  'prepares': 0,
+  'evictions': 0,
+  'invalidations': 0,
+  'unprepared': 0
+}
+
+def count(name, n=1):
+  with _lock:
+    _stats[name] += n
+
+def statement_stats():
+  with _lock:
+    return dict(_stats)
+
+def reset_stats():
+  with _lock:
+    for name in _stats:
+      _stats[name] = 0
+
+def prepared_sql(sql):
+  '''
+    Converts the %s placeholders of a psycopg2 statement to the $1, $2, ...
+    parameters of a PREPARE statement. Returns (sql, parameter count).
+  '''
+  parts = sql.split('%s')
+  return (''.join([part + (f'${i + 1}' if i < len(parts) - 1 else '') for i, part in enumerate(parts)]), len(parts) - 1)
+
+def make_connection_factory(max_statements=100, threshold=5):
+  '''
+    Returns a psycopg2 connection class that runs statements as server side
+    prepared statements once the same SQL has been executed threshold times
+    on the connection. The max_statements most recently used statements are
+    kept prepared per connection, the least recently used one is
+    deallocated when there are more. Statements are only prepared and
+    executed as prepared statements on autocommit connections, in a
+    transaction a failed PREPARE or EXECUTE would abort the transaction.
+  '''
+  class PreparingConnection(psycopg2.extensions.connection):
+    def __init__(self, *args, **kwargs):
+      super().__init__(*args, **kwargs)
+      self.prepared = OrderedDict() # sql -> (name, parameter count)
+      self.executions = {} # sql -> times executed before being prepared
+      self.unpreparable = set() # sql that PREPARE failed for
+      self.statement_number = 0
+
+    def clear_prepared(self):
+      self.prepared.clear()
+      self.executions.clear()
+      self.unpreparable.clear()
+
+    def should_prepare(self, sql):
+      if max_statements <= 0 or sql in self.unpreparable:
+        return False
+      if len(self.executions) > max_statements * 10:
+        self.executions.clear()
+      self.executions[sql] = self.executions.get(sql, 0) + 1
+      return self.executions[sql] >= threshold
+
+    def prepare(self, cur, sql):
+      if len(self.prepared) >= max_statements:
+        (_, (evicted_name, _)) = self.prepared.popitem(last=False)
+        cur.execute(f'DEALLOCATE {evicted_name}')
+        count('evictions')
+      self.statement_number += 1
+      name = f'content_api_{self.statement_number}'
+      (sql_with_parameters, parameter_count) = prepared_sql(sql)
+      cur.execute(f'PREPARE {name} AS {sql_with_parameters}')
+      self.executions.pop(sql, None)
+      self.prepared[sql] = (name, parameter_count)
+      count('prepares')
+      return self.prepared[sql]
+
+    def execute_prepared(self, cur, sql, values):
+      '''
+        Executes sql (with %s placeholders) as a prepared statement if it is
+        (or just became) one, or as a regular statement otherwise
+      '''
+      if not self.autocommit:
+        count('unprepared')
+        cur.execute(sql, values)
+        return
+      if sql in self.prepared:
+        self.prepared.move_to_end(sql)
+        (name, parameter_count) = self.prepared[sql]
+        count('hits')
+      elif self.should_prepare(sql):
+        try:
+          (name, parameter_count) = self.prepare(cur, sql)
+        except psycopg2.ProgrammingError:
+          # i.e. parameter types that can't be inferred
+          self.unpreparable.add(sql)
+          return self.execute_prepared(cur, sql, values)
+      else:
+        count('unprepared')
+        cur.execute(sql, values)
+        return
+      arguments = f' ({", ".join(["%s"] * parameter_count)})' if parameter_count else ''
+      try:
+        cur.execute(f'EXECUTE {name}{arguments}', values)
+      except (psycopg2.errors.InvalidSqlStatementName, psycopg2.errors.FeatureNotSupported):
+        # The statement was deallocated behind our back (i.e. DISCARD ALL) or
+        # its cached plan is invalid after a schema change, start over
+        self.clear_prepared()
+        try:
+          cur.execute('DEALLOCATE ALL')
+        except psycopg2.Error:
+          pass
+        count('invalidations')
+        cur.execute(sql, values)
+
+  return PreparingConnection
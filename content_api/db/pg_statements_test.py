@@ -0,0 +1,64 @@
+import pytest
+import psycopg2
+from content_api.db.pg_statements import prepared_sql, make_connection_factory, statement_stats, reset_stats
+from content_api.db.pg import builder, DATABASE_URL
+
+def test_prepared_sql():
+  assert prepared_sql('select * from urls') == ('select * from urls', 0)
+  assert prepared_sql('select * from urls where url like %s LIMIT %s OFFSET %s') == ('select * from urls where url like $1 LIMIT $2 OFFSET $3', 3)
+
+def test_where_sql():
+  filter = {'url': {'op': 'contains', 'value': 'goo'}, 'id': {'op': 'gt', 'value': 5}}
+  assert builder.where_sql(filter) == ('WHERE url like %s and id > %s', ('%goo%', 5))
+  assert builder.where_sql(None) == ('', ())
+  # Same shape, different values
+  assert builder.where_sql({**filter, 'id': {'op': 'gt', 'value': 6}})[1] == ('%goo%', 6)
+  assert builder.where_sql(None, '-updated_at,-id', ['2023-12-02', 5]) == ('WHERE (updated_at, id) < (%s, %s)', ('2023-12-02', 5))
+  assert builder.where_sql(None, 'updated_at,-id', ['2023-12-02', 5]) == (
+    'WHERE (((updated_at > %s or updated_at IS NULL)) or (updated_at = %s and id < %s))', ('2023-12-02', '2023-12-02', 5))
+
+@pytest.fixture
+def conn():
+  try:
+    conn = psycopg2.connect(DATABASE_URL, connection_factory=make_connection_factory(max_statements=2, threshold=1))
+  except psycopg2.OperationalError:
+    pytest.skip('PostgreSQL is not available')
+  conn.autocommit = True
+  conn.cursor().execute('CREATE TEMPORARY TABLE prepared_test (id integer)')
+  conn.cursor().execute('INSERT INTO prepared_test VALUES (1)')
+  reset_stats()
+  yield conn
+  conn.close()
+
+SQL = 'select * from prepared_test where id = %s'
+
+def test_invalidation(conn):
+  cur = conn.cursor()
+  conn.execute_prepared(cur, SQL, [1])
+  assert cur.fetchall() == [(1,)]
+  assert SQL in conn.prepared
+  # Deallocated behind the back of the connection
+  cur.execute('DEALLOCATE ALL')
+  conn.execute_prepared(cur, SQL, [1])
+  assert cur.fetchall() == [(1,)]
+  assert SQL not in conn.prepared
+  # The result type of a cached plan changes with the schema
+  conn.execute_prepared(cur, SQL, [1])
+  cur.execute('ALTER TABLE prepared_test ADD COLUMN url text')
+  conn.execute_prepared(cur, SQL, [1])
+  assert cur.fetchall() == [(1, None)]
+  assert statement_stats()['invalidations'] == 2
+  assert statement_stats()['prepares'] == 2
+
+def test_transaction(conn):
+  cur = conn.cursor()
+  conn.execute_prepared(cur, SQL, [1])
+  cur.execute('DEALLOCATE ALL')
+  conn.autocommit = False
+  # Executed as a regular statement, a failed EXECUTE would abort the transaction
+  conn.execute_prepared(cur, SQL, [1])
+  assert cur.fetchall() == [(1,)]
+  cur.execute('INSERT INTO prepared_test VALUES (2)')
+  conn.commit()
+  assert statement_stats()['invalidations'] == 0
+  assert statement_stats()['unprepared'] == 1
@@ -0,0 +1,40 @@
+'''
+The keyset (cursor) pagination rule of the database backends: which rows
+come after the sort key values of the last row of a page. Sort key values
+can be NULL, which the databases order differently, PostgreSQL (and the
+memory backend) after all other values, SQLite and MongoDB before them.
+Each backend renders the clauses in its own query language.
+'''
+
+def null_values(after):
+  # Part of the query shape since a NULL sort key value changes the query
+  return tuple(value is None for value in after) if after else ()
+
+def seek_clauses(sort_items, nulls, nulls_largest):
+  '''
+    The rows after the sort key values are those matching any of the
+    returned clauses. sort_items are (name, descending) tuples and nulls
+    whether each sort key value is NULL. A clause is a list of (index,
+    condition) where condition is one of:
+
+      null           the column is NULL
+      eq             the column equals the value
+      not_null       the column is not NULL
+      after          the column comes after the value in the sort order
+      after_or_null  the same or the column is NULL
+  '''
+  clauses = []
+  for i, (name, descending) in enumerate(sort_items):
+    # Whether NULLs come after the other values in the order of the column,
+    # id is never NULL
+    nulls_after = nulls_largest != descending and name != 'id'
+    if nulls[i]:
+      if nulls_after:
+        # Nothing comes after a NULL
+        continue
+      condition = 'not_null'
+    else:
+      condition = 'after_or_null' if nulls_after else 'after'
+    equals = [(j, 'null' if nulls[j] else 'eq') for j in range(i)]
+    clauses.append(equals + [(i, condition)])
+  return clauses
@@ -0,0 +1,190 @@
+'''
+The SQL of the database interface shared by the PostgreSQL (pg.py) and
+SQLite (sqlite.py) backends, which differ in the placeholder style of their
+drivers and in how a contains filter is matched. The generated SQL is cached
+per query shape (table, filter columns and operators, sort and columns) by
+each SqlBuilder, see cache_stats.
+'''
+import re
+from functools import lru_cache
+from content_api.db.seek import null_values, seek_clauses
+
+# Window function column with the count of all rows matching the filter
+COUNT_COLUMN = '_content_api_count'
+
+def group_by_columns(docs):
+  # {columns: [index, ...]} so that each group can be written in one statement
+  groups = {}
+  for index, doc in enumerate(docs):
+    groups.setdefault(tuple(doc.keys()), []).append(index)
+  return groups
+
+def is_valid_column(column):
+  return re.match(r'\A[a-zA-Z0-9_]+\Z', column)
+
+def assert_valid_columns(columns):
+  # sanity check columns to protect against SQL injection
+  invalid_columns = [c for c in columns if not is_valid_column(c)]
+  if invalid_columns:
+    raise Exception(f'Invalid column names: {invalid_columns}')
+
+def filter_shape(filter):
+  return tuple([(column, filter[column]['op']) for column in filter]) if filter else ()
+
+def parse_sort(sort):
+  def parse_order(item):
+    direction = 'DESC' if item.startswith('-') else 'ASC'
+    name = item[1:] if item.startswith('-') else item
+    return {'direction': direction, 'name': name}
+  return [parse_order(item) for item in sort.split(',')]
+
+def columns_sql(fields):
+  if not fields:
+    return '*'
+  assert_valid_columns(fields)
+  return ', '.join(fields)
+
+def order_sql(sort):
+  if not sort:
+    return ''
+  columns = parse_sort(sort)
+  assert_valid_columns([c['name'] for c in columns])
+  return 'ORDER BY ' + ', '.join([f'{c["name"]} {c["direction"]}' for c in columns])
+
+class SqlBuilder:
+  '''
+    Builds the statements with the placeholder of the driver (i.e. %s or
+    ?). contains is the clause of a contains filter with a {column} field
+    and contains_value the value for its placeholder. nulls_largest is
+    whether the database orders NULLs after all other values.
+  '''
+  def __init__(self, placeholder, contains, contains_value, cache_size=1024, nulls_largest=True):
+    self.placeholder = placeholder
+    self.contains = contains
+    self.contains_value = contains_value
+    self.nulls_largest = nulls_largest
+    self.cached = ['where_shape_sql', 'count_sql', 'find_sql', 'find_with_count_sql', 'find_one_sql', 'insert_sql', 'update_sql', 'delete_sql', 'claim_sql']
+    for name in self.cached:
+      setattr(self, name, lru_cache(maxsize=cache_size)(getattr(self, name)))
+
+  def cache_stats(self):
+    return {name: getattr(self, name).cache_info()._asdict() for name in self.cached}
+
+  def where_shape_sql(self, shape, sort=None, seek=False):
+    '''
+      The WHERE clause for a filter shape ((column, op) tuples) and the
+      indexes of the sort key values of the seek predicate (if any), seek
+      is the null_values of the sort key values
+    '''
+    assert_valid_columns([column for (column, _) in shape])
+    p = self.placeholder
+    def clause(column, op):
+      if op == 'contains':
+        return self.contains.format(column=column)
+      elif op == 'lt':
+        return f'{column} < {p}'
+      elif op == 'gt':
+        return f'{column} > {p}'
+      else:
+        return f'{column} = {p}'
+    clauses = [clause(column, op) for (column, op) in shape]
+    seek_indexes = ()
+    if seek:
+      (seek_clause, seek_indexes) = self.seek_sql(sort, seek)
+      clauses.append(seek_clause)
+    if not clauses:
+      return ('', ())
+    return ('WHERE ' + ' and '.join(clauses), seek_indexes)
+
+  def where_values(self, filter, seek_indexes=(), after=None):
+    def sql_value(column):
+      value = filter[column]['value']
+      if filter[column]['op'] == 'contains':
+        return self.contains_value(value)
+      else:
+        return value
+    values = tuple([sql_value(column) for column in filter]) if filter else ()
+    return values + tuple([after[i] for i in seek_indexes])
+
+  def where_sql(self, filter, sort=None, after=None):
+    (sql, seek_indexes) = self.where_shape_sql(filter_shape(filter), sort, null_values(after))
+    return (sql, self.where_values(filter, seek_indexes, after))
+
+  def seek_sql(self, sort, nulls):
+    '''
+      Keyset pagination predicate selecting the rows that come after the
+      given sort key values in the sort order, nulls are whether they are
+      NULL. Returns the SQL and the indexes of the sort key values for its
+      placeholders.
+    '''
+    columns = parse_sort(sort)
+    assert_valid_columns([c['name'] for c in columns])
+    p = self.placeholder
+    def op(column):
+      return '<' if column['direction'] == 'DESC' else '>'
+    def nulls_after(column):
+      return self.nulls_largest == (column['direction'] == 'ASC')
+    if len(set(c['direction'] for c in columns)) == 1 and not any(nulls) and all(c['name'] == 'id' for c in columns[1:]):
+      # A row comparison can use a multi column index, it is the same as
+      # the clauses when only the first column can be NULL
+      names = ', '.join([c['name'] for c in columns])
+      placeholders = ', '.join([p for _ in columns])
+      sql = f'({names}) {op(columns[0])} ({placeholders})'
+      if nulls_after(columns[0]) and columns[0]['name'] != 'id':
+        sql = f'({sql} or {columns[0]["name"]} IS NULL)'
+      return (sql, tuple(range(len(columns))))
+    def condition_sql(index, condition):
+      column = columns[index]
+      return {
+        'null': f'{column["name"]} IS NULL',
+        'eq': f'{column["name"]} = {p}',
+        'not_null': f'{column["name"]} IS NOT NULL',
+        'after': f'{column["name"]} {op(column)} {p}',
+        'after_or_null': f'({column["name"]} {op(column)} {p} or {column["name"]} IS NULL)'
+      }[condition]
+    clauses = seek_clauses([(c['name'], c['direction'] == 'DESC') for c in columns], nulls, self.nulls_largest)
+    if not clauses:
+      return ('1 = 0', ())
+    indexes = tuple([index for clause in clauses for (index, condition) in clause if condition in ['eq', 'after', 'after_or_null']])
+    return ('(' + ' or '.join(['(' + ' and '.join([condition_sql(index, condition) for (index, condition) in clause]) + ')' for clause in clauses]) + ')', indexes)
+
+  def count_sql(self, table_name, shape):
+    return f'select count(*) as count from {table_name} {self.where_shape_sql(shape)[0]}'
+
+  def find_sql(self, table_name, shape, sort, seek, fields=None):
+    (where_clauses, seek_indexes) = self.where_shape_sql(shape, sort, seek)
+    p = self.placeholder
+    return (f'select {columns_sql(fields)} from {table_name} {where_clauses} {order_sql(sort)} LIMIT {p} OFFSET {p}', seek_indexes)
+
+  def find_with_count_sql(self, table_name, shape, sort, fields=None):
+    p = self.placeholder
+    return f'select {columns_sql(fields)}, count(*) OVER () AS {COUNT_COLUMN} from {table_name} {self.where_shape_sql(shape)[0]} {order_sql(sort)} LIMIT {p} OFFSET {p}'
+
+  def find_one_sql(self, table_name, fields=None):
+    return f'select {columns_sql(fields)} from {table_name} where id = {self.placeholder}'
+
+  def insert_sql(self, table_name, columns, returning='id'):
+    assert_valid_columns(columns)
+    if not columns:
+      return f'INSERT INTO {table_name} DEFAULT VALUES RETURNING {returning}'
+    return f'INSERT INTO {table_name} ({", ".join(columns)}) VALUES ({", ".join([self.placeholder for _ in columns])}) RETURNING {returning}'
+
+  def update_sql(self, table_name, columns, returning=None):
+    assert_valid_columns(columns)
+    sql = f'UPDATE {table_name} SET {", ".join([f"{c} = {self.placeholder}" for c in columns])} where id = {self.placeholder}'
+    return f'{sql} RETURNING {returning}' if returning else sql
+
+  def delete_sql(self, table_name, returning=None):
+    sql = f'DELETE from {table_name} where id = {self.placeholder}'
+    return f'{sql} RETURNING {returning}' if returning else sql
+
+  def claim_sql(self, table_name, column, columns, lock=''):
+    '''
+      One UPDATE that sets the columns of the first rows (in column order)
+      where column is before a value and returns them, lock is the locking
+      clause of the subquery (i.e. FOR UPDATE SKIP LOCKED)
+    '''
+    assert_valid_columns((column,) + columns)
+    p = self.placeholder
+    return (f'UPDATE {table_name} SET {", ".join([f"{c} = {p}" for c in columns])} '
+      f'WHERE id IN (SELECT id FROM {table_name} WHERE {column} < {p} ORDER BY {column} LIMIT {p} {lock}) RETURNING *')
@@ -0,0 +1,42 @@
+import pytest
+from content_api.db.sql_builder import SqlBuilder, order_sql, columns_sql
+
+builder = SqlBuilder('?', 'instr({column}, ?) > 0', lambda value: value, nulls_largest=False)
+
+def test_where_sql():
+  filter = {'url': {'op': 'contains', 'value': 'goo'}, 'id': {'op': 'gt', 'value': 5}}
+  assert builder.where_sql(filter) == ('WHERE instr(url, ?) > 0 and id > ?', ('goo', 5))
+  assert builder.where_sql(None, 'updated_at,-id', ['2023-12-02', 5]) == (
+    'WHERE ((updated_at > ?) or (updated_at = ? and id < ?))', ('2023-12-02', '2023-12-02', 5))
+  with pytest.raises(Exception):
+    builder.where_sql({'id; drop table urls': {'op': 'eq', 'value': 1}})
+
+def test_seek_nulls():
+  # NULLs are before the other values in SQLite, after them in PostgreSQL
+  pg = SqlBuilder('%s', '{column} like %s', lambda value: f'%{value}%')
+  assert builder.seek_sql('rank,id', (False, False)) == ('(rank, id) > (?, ?)', (0, 1))
+  assert builder.seek_sql('-rank,-id', (False, False)) == ('((rank, id) < (?, ?) or rank IS NULL)', (0, 1))
+  assert builder.seek_sql('rank,id', (True, False)) == ('((rank IS NOT NULL) or (rank IS NULL and id > ?))', (1,))
+  assert builder.seek_sql('-rank,-id', (True, False)) == ('((rank IS NULL and id < ?))', (1,))
+  assert pg.seek_sql('rank,id', (False, False)) == ('((rank, id) > (%s, %s) or rank IS NULL)', (0, 1))
+  assert pg.seek_sql('-rank,-id', (False, False)) == ('(rank, id) < (%s, %s)', (0, 1))
+  assert pg.seek_sql('rank,id', (True, False)) == ('((rank IS NULL and id > %s))', (1,))
+  assert pg.seek_sql('-rank,-id', (True, False)) == ('((rank IS NOT NULL) or (rank IS NULL and id < %s))', (1,))
+  assert pg.seek_sql('rank', (True,)) == ('1 = 0', ())
+
+def test_statements():
+  assert builder.find_sql('urls', (('id', 'lt'),), '-id', (False,), ('id', 'url')) == (
+    'select id, url from urls WHERE id < ? and (id) < (?) ORDER BY id DESC LIMIT ? OFFSET ?', (0,))
+  assert builder.insert_sql('urls', ()) == 'INSERT INTO urls DEFAULT VALUES RETURNING id'
+  assert builder.update_sql('urls', ('url', 'rank'), '*') == 'UPDATE urls SET url = ?, rank = ? where id = ? RETURNING *'
+  assert builder.delete_sql('urls') == 'DELETE from urls where id = ?'
+  assert order_sql('rank,-id') == 'ORDER BY rank ASC, id DESC'
+  assert columns_sql(None) == '*'
+
+def test_cache_stats():
+  # Each builder has caches of its own
+  other = SqlBuilder('%s', '{column} like %s', lambda value: f'%{value}%')
+  other.find_one_sql('urls')
+  other.find_one_sql('urls')
+  assert other.cache_stats()['find_one_sql']['hits'] == 1
+  assert builder.cache_stats()['find_one_sql']['hits'] == 0
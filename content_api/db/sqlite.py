@@ -0,0 +1,250 @@
+'''
+A SQLite backend (DATABASE=sqlite) for single node deployments, the
+database is the file at SQLITE_PATH. The database runs in WAL mode so that
+readers don't block the writer and each thread has its own connection
+(opened lazily, i.e. after any fork). Writes are serialized by SQLite,
+busy_timeout is how long a write waits for another one to finish.
+
+create_schema applies the PostgreSQL db_schema of the models, translated by
+translate_ddl. Differences from the PostgreSQL backend: NULLs sort first
+(last when descending) and there are no trigram indexes, see create_index.
+'''
+import os
+import re
+import sqlite3
+import threading
+from datetime import datetime, date
+from contextlib import contextmanager
+from content_api.db.seek import null_values
+from content_api.db.sql_builder import SqlBuilder, COUNT_COLUMN, group_by_columns, assert_valid_columns, filter_shape, order_sql
+
+SQLITE_PATH = os.environ.get('SQLITE_PATH', 'python-rest-api.sqlite3')
+SQLITE_BUSY_TIMEOUT = float(os.environ.get('SQLITE_BUSY_TIMEOUT', 5))
+
+# Generated SQL is cached per query shape like in pg.py, SQLite keeps the
+# compiled statements of each connection in its statement cache
+SQL_CACHE_SIZE = int(os.environ.get('DATABASE_SQL_CACHE_SIZE', 1024))
+
+# contains is instr since LIKE is case insensitive in SQLite
+builder = SqlBuilder('?', 'instr({column}, ?) > 0', lambda value: value, SQL_CACHE_SIZE, nulls_largest=False)
+
+# Timestamps are stored as ISO 8601 text, which sorts and compares like
+# the timestamps. Registered here since the default adapters are deprecated.
+sqlite3.register_adapter(datetime, lambda value: value.isoformat(' '))
+sqlite3.register_adapter(date, lambda value: value.isoformat())
+sqlite3.register_converter('TIMESTAMP', lambda value: datetime.fromisoformat(value.decode('utf-8')))
+sqlite3.register_converter('DATE', lambda value: date.fromisoformat(value.decode('utf-8')))
+
+local = threading.local()
+
+def connect():
+  conn = sqlite3.connect(SQLITE_PATH,
+    timeout=SQLITE_BUSY_TIMEOUT,
+    detect_types=sqlite3.PARSE_DECLTYPES,
+    isolation_level=None, # autocommit, see transaction
+    check_same_thread=False,
+    cached_statements=SQL_CACHE_SIZE)
+  conn.row_factory = sqlite3.Row
+  conn.execute('PRAGMA journal_mode = WAL')
+  # Durable as of the last checkpoint instead of every commit, safe with WAL
+  conn.execute('PRAGMA synchronous = NORMAL')
+  conn.execute('PRAGMA foreign_keys = ON')
+  return conn
+
+def connection():
+  # A connection inherited from the parent process must not be used
+  if getattr(local, 'pid', None) != os.getpid():
+    local.conn = connect()
+    local.pid = os.getpid()
+  return local.conn
+
+def sql_cache_stats():
+  return {'sql_cache': builder.cache_stats()}
+
+def execute(sql, values=None):
+  return connection().execute(sql, values or ())
+
+def execute_schema(sql):
+  '''
+    Runs PostgreSQL DDL (the db_schema of a model, see
+    models.create_schema) translated by translate_ddl
+  '''
+  return execute(translate_ddl(sql))
+
+def query(sql, values=None):
+  return [dict(row) for row in connection().execute(sql, values or ())]
+
+def query_one(sql, values=None):
+  rows = query(sql, values)
+  return rows[0] if len(rows) > 0 else None
+
+@contextmanager
+def transaction():
+  '''
+    Yields the connection of the thread where everything runs in one
+    transaction, committed on success and rolled back on any exception.
+    BEGIN IMMEDIATE takes the write lock up front so that a transaction
+    never fails to upgrade from a read to a write.
+  '''
+  conn = connection()
+  conn.execute('BEGIN IMMEDIATE')
+  try:
+    yield conn
+  except:
+    conn.execute('ROLLBACK')
+    raise
+  conn.execute('COMMIT')
+
+DDL_TRANSLATIONS = [
+  # AUTOINCREMENT so that ids are never reused, like a sequence
+  (re.compile(r'\b(?:big|small)?serial\s+PRIMARY\s+KEY\b', re.IGNORECASE), 'INTEGER PRIMARY KEY AUTOINCREMENT'),
+  (re.compile(r"'epoch'", re.IGNORECASE), "'1970-01-01 00:00:00'"),
+  (re.compile(r'\bnow\(\)', re.IGNORECASE), 'CURRENT_TIMESTAMP')
+]
+
+def translate_ddl(sql):
+  for (pattern, replacement) in DDL_TRANSLATIONS:
+    sql = pattern.sub(replacement, sql)
+  return sql
+
+#############################################################
+#
+# Database Interface
+#
+#############################################################
+
+id_json_schema = {'type': 'integer', 'minimum': 1, 'x-meta': {'writable': False}}
+
+# Unique, foreign key and NOT NULL violations
+integrity_errors = (sqlite3.IntegrityError,)
+
+def count(table_name, filter=None):
+  return query_one(builder.count_sql(table_name, filter_shape(filter)), builder.where_values(filter))['count']
+
+def estimate_count(table_name, filter=None):
+  # There are no row estimates in SQLite, the caller falls back to count
+  return None
+
+def find(table_name, limit=100, offset=0, sort=None, filter=None, after=None, fields=None):
+  (sql, seek_indexes) = builder.find_sql(table_name, filter_shape(filter), sort, null_values(after), fields)
+  return query(sql, builder.where_values(filter, seek_indexes, after) + (limit, offset))
+
+def find_with_count(table_name, limit=100, offset=0, sort=None, filter=None, fields=None):
+  '''
+    Returns (rows, count) where count is the number of rows matching the
+    filter, from one statement (see pg.find_with_count)
+  '''
+  sql = builder.find_with_count_sql(table_name, filter_shape(filter), sort, fields)
+  rows = query(sql, builder.where_values(filter) + (limit, offset))
+  if not rows:
+    return ([], count(table_name, filter) if offset > 0 else 0)
+  total = rows[0][COUNT_COLUMN]
+  return ([{k: v for k, v in row.items() if k != COUNT_COLUMN} for row in rows], total)
+
+def find_iter(table_name, sort=None, filter=None, batch_size=1000):
+  '''
+    Generator of all rows matching the filter, fetched batch_size rows at a
+    time from one read transaction (a snapshot in WAL mode) on a connection
+    of its own, so that writes of the thread are not part of it
+  '''
+  (where_clauses, where_values) = builder.where_sql(filter)
+  conn = connect()
+  try:
+    cur = conn.execute(f'select * from {table_name} {where_clauses} {order_sql(sort)}', where_values)
+    while True:
+      rows = cur.fetchmany(batch_size)
+      if not rows:
+        return
+      for row in rows:
+        yield dict(row)
+  finally:
+    conn.close()
+
+def find_one(table_name, id, fields=None):
+  return query_one(builder.find_one_sql(table_name, fields), [id])
+
+def create(table_name, doc):
+  columns = tuple(doc.keys())
+  return query_one(builder.insert_sql(table_name, columns), [doc[k] for k in columns])['id']
+
+def update(table_name, id, doc):
+  columns = tuple(doc.keys())
+  return execute(builder.update_sql(table_name, columns), [doc[k] for k in columns] + [id])
+
+def delete(table_name, id):
+  return execute(builder.delete_sql(table_name), [id])
+
+# The *_returning writes return the written row (None if there is no row
+# with the id) from the same statement, so there is no need to read it back
+
+def create_returning(table_name, doc):
+  columns = tuple(doc.keys())
+  return query_one(builder.insert_sql(table_name, columns, '*'), [doc[k] for k in columns])
+
+def update_returning(table_name, id, doc):
+  columns = tuple(doc.keys())
+  return query_one(builder.update_sql(table_name, columns, '*'), [doc[k] for k in columns] + [id])
+
+def delete_returning(table_name, id):
+  return query_one(builder.delete_sql(table_name, '*'), [id])
+
+# The bulk writes run in one transaction, which is what makes them fast:
+# the statements of a transaction are committed (and synced) once
+
+def create_many(table_name, docs):
+  rows = [None] * len(docs)
+  with transaction() as conn:
+    for columns, indexes in group_by_columns(docs).items():
+      sql = builder.insert_sql(table_name, columns, '*')
+      for i in indexes:
+        rows[i] = dict(conn.execute(sql, [docs[i][c] for c in columns]).fetchone())
+  return rows
+
+def update_many(table_name, docs):
+  '''
+    Updates docs (that need to have an id) in one transaction. Returns the
+    updated rows in the order of the docs, docs with an id that doesn't
+    exist are left out. Docs with only an id are returned unchanged.
+  '''
+  rows = []
+  with transaction() as conn:
+    for doc in docs:
+      columns = tuple(c for c in doc.keys() if c != 'id')
+      sql = builder.update_sql(table_name, columns, '*') if columns else builder.find_one_sql(table_name)
+      row = conn.execute(sql, [doc[c] for c in columns] + [doc['id']]).fetchone()
+      if row is not None:
+        rows.append(dict(row))
+  return rows
+
+def delete_many(table_name, ids):
+  rows = []
+  with transaction() as conn:
+    for id in ids:
+      row = conn.execute(builder.delete_sql(table_name, '*'), [id]).fetchone()
+      if row is not None:
+        rows.append(dict(row))
+  return rows
+
+def claim_due(table_name, column, due, until, limit, doc=None):
+  '''
+    Claims up to limit rows where column is before due (the earliest
+    first) by setting it to until (and the columns of doc) and returns
+    them, in one statement (see pg.claim_due). Writes are serialized so
+    no other writer can claim the same rows.
+  '''
+  doc = {**(doc or {}), column: until}
+  columns = tuple(doc.keys())
+  return query(builder.claim_sql(table_name, column, columns), [doc[c] for c in columns] + [due, limit])
+
+def create_index(table_name, index):
+  '''
+    Creates the index (see content_api/indexes.py) unless it exists.
+    contains filters are instr calls that no index serves, so trigram
+    indexes are skipped.
+  '''
+  if index['type'] == 'trigram':
+    return
+  assert_valid_columns([c.removeprefix('-') for c in index['columns']] + [index['name']])
+  columns_sql = ', '.join([f'{c[1:]} DESC' if c.startswith('-') else c for c in index['columns']])
+  unique = 'UNIQUE ' if index['unique'] else ''
+  execute(f'CREATE {unique}INDEX IF NOT EXISTS {index["name"]} ON {table_name} ({columns_sql})')
@@ -0,0 +1,139 @@
+import threading
+from datetime import datetime, timedelta
+import pytest
+import content_api.db.sqlite as sqlite
+
+URLS_SCHEMA = '''
+  CREATE TABLE urls (
+    id serial PRIMARY KEY,
+    url VARCHAR (355) UNIQUE NOT NULL,
+    created_at TIMESTAMP NOT NULL,
+    rank integer,
+    next_fetch_at TIMESTAMP NOT NULL DEFAULT 'epoch'
+  )
+'''
+
+@pytest.fixture(autouse=True)
+def database(tmp_path, monkeypatch):
+  monkeypatch.setattr(sqlite, 'SQLITE_PATH', str(tmp_path / 'test.sqlite3'))
+  monkeypatch.setattr(sqlite, 'local', threading.local())
+  sqlite.execute_schema(URLS_SCHEMA)
+  sqlite.execute_schema('CREATE TABLE fetches (id serial PRIMARY KEY, url_id integer not null references urls(id))')
+
+def make_docs(n=10):
+  start = datetime(2023, 12, 2)
+  return sqlite.create_many('urls', [{
+    'url': f'https://example.com/{i % 3}/{i}',
+    'created_at': start + timedelta(hours=i),
+    'rank': None if i % 4 == 0 else i % 5
+  } for i in range(n)])
+
+def test_translate_ddl():
+  assert sqlite.translate_ddl(URLS_SCHEMA).split('\n')[2].strip() == 'id INTEGER PRIMARY KEY AUTOINCREMENT,'
+  assert "DEFAULT '1970-01-01 00:00:00'" in sqlite.translate_ddl(URLS_SCHEMA)
+  assert sqlite.translate_ddl('applied_at timestamp DEFAULT now()') == 'applied_at timestamp DEFAULT CURRENT_TIMESTAMP'
+
+def test_execute():
+  # Only schemas are translated, not the values of other statements
+  sqlite.execute("INSERT INTO urls (url, created_at) VALUES ('https://a.com/now()', '2023-12-02 00:00:00')")
+  assert sqlite.find_one('urls', 1)['url'] == 'https://a.com/now()'
+
+def test_wal():
+  assert sqlite.query_one('PRAGMA journal_mode')['journal_mode'] == 'wal'
+
+def test_crud():
+  now = datetime(2023, 12, 2, 10, 30, 15, 500)
+  doc = sqlite.create_returning('urls', {'url': 'https://a.com', 'created_at': now})
+  assert doc == {'id': 1, 'url': 'https://a.com', 'created_at': now, 'rank': None, 'next_fetch_at': datetime(1970, 1, 1)}
+  assert sqlite.find_one('urls', '1') == doc
+  assert sqlite.find_one('urls', 1, fields=('id', 'url')) == {'id': 1, 'url': 'https://a.com'}
+  assert sqlite.update_returning('urls', 1, {'rank': 3})['rank'] == 3
+  assert sqlite.update_returning('urls', 2, {'rank': 3}) == None
+  assert sqlite.delete_returning('urls', 1)['url'] == 'https://a.com'
+  assert sqlite.find_one('urls', 1) == None
+  # Ids are not reused
+  assert sqlite.create('urls', {'url': 'https://b.com', 'created_at': now}) == 2
+
+def test_integrity_errors():
+  doc = sqlite.create_returning('urls', {'url': 'https://a.com', 'created_at': datetime.now()})
+  with pytest.raises(sqlite.integrity_errors):
+    sqlite.create('urls', {'url': 'https://a.com', 'created_at': datetime.now()})
+  with pytest.raises(sqlite.integrity_errors):
+    sqlite.create('fetches', {'url_id': 12345})
+  sqlite.create('fetches', {'url_id': doc['id']})
+  with pytest.raises(sqlite.integrity_errors):
+    sqlite.delete_returning('urls', doc['id'])
+
+def test_find():
+  docs = make_docs()
+  assert sqlite.count('urls') == 10
+  assert sqlite.count('urls', {'rank': {'op': 'eq', 'value': 1}}) == len([d for d in docs if d['rank'] == 1])
+  # contains is case sensitive like LIKE in PostgreSQL
+  assert sqlite.count('urls', {'url': {'op': 'contains', 'value': '/1/'}}) == 3
+  assert sqlite.count('urls', {'url': {'op': 'contains', 'value': 'EXAMPLE'}}) == 0
+  after = datetime(2023, 12, 2, 5)
+  found = sqlite.find('urls', 3, 0, '-created_at,-id', {'created_at': {'op': 'gt', 'value': after}})
+  assert [d['id'] for d in found] == [10, 9, 8]
+  found = sqlite.find('urls', 10, 0, '-created_at,-id', {'created_at': {'op': 'gt', 'value': after}}, after=(found[-1]['created_at'], found[-1]['id']))
+  assert [d['id'] for d in found] == [7]
+  (found, total) = sqlite.find_with_count('urls', 2, 0, 'rank,-id', {'id': {'op': 'lt', 'value': 9}}, fields=('id', 'rank'))
+  assert found == [{'id': 5, 'rank': None}, {'id': 1, 'rank': None}]
+  assert total == 8
+  assert sqlite.find_with_count('urls', 2, 20) == ([], 10)
+  assert [d['id'] for d in sqlite.find_iter('urls', '-id', batch_size=3)] == list(range(10, 0, -1))
+
+def test_seek_nulls():
+  make_docs()
+  # Pages continue across the NULL sort key values
+  for sort in ['rank,id', '-rank,-id', 'rank,-id', '-rank,id']:
+    ids = [d['id'] for d in sqlite.find('urls', 100, 0, sort)]
+    seen = []
+    after = None
+    while len(seen) < len(ids):
+      page = sqlite.find('urls', 1, 0, sort, after=after)
+      assert page
+      seen += [d['id'] for d in page]
+      after = (page[-1]['rank'], page[-1]['id'])
+    assert seen == ids
+
+def test_bulk_writes():
+  docs = make_docs(3)
+  with pytest.raises(sqlite.integrity_errors):
+    sqlite.create_many('urls', [{'url': 'https://new.com', 'created_at': datetime.now()}, {'url': docs[0]['url'], 'created_at': datetime.now()}])
+  # All or nothing
+  assert sqlite.count('urls') == 3
+  updated = sqlite.update_many('urls', [{'id': 2, 'rank': 9}, {'id': 12345, 'rank': 9}, {'id': 1, 'rank': 8, 'url': 'https://c.com'}])
+  assert [(d['id'], d['rank']) for d in updated] == [(2, 9), (1, 8)]
+  assert sqlite.update_many('urls', [{'id': 2}]) == [sqlite.find_one('urls', 2)]
+  assert [d['id'] for d in sqlite.delete_many('urls', [3, 12345, 1])] == [3, 1]
+  assert sqlite.count('urls') == 1
+
+def test_claim_due():
+  docs = make_docs(4)
+  sqlite.update_many('urls', [{'id': 3, 'next_fetch_at': datetime(1960, 1, 1)}, {'id': 4, 'next_fetch_at': datetime(2100, 1, 1)}])
+  until = datetime(2024, 1, 1)
+  claimed = sqlite.claim_due('urls', 'next_fetch_at', datetime(2023, 1, 1), until, 2, {'rank': 0})
+  # The earliest first
+  assert sorted(d['id'] for d in claimed) == [1, 3]
+  assert all(d['next_fetch_at'] == until and d['rank'] == 0 for d in claimed)
+  assert [d['id'] for d in sqlite.claim_due('urls', 'next_fetch_at', datetime(2023, 1, 1), until, 10)] == [2]
+  assert sqlite.claim_due('urls', 'next_fetch_at', datetime(2023, 1, 1), until, 10) == []
+
+def test_create_index():
+  sqlite.create_index('urls', {'name': 'urls_rank_id', 'columns': ['-rank', '-id'], 'type': 'btree', 'unique': False})
+  sqlite.create_index('urls', {'name': 'urls_url_trgm', 'columns': ['url'], 'type': 'trigram', 'unique': False})
+  names = [row['name'] for row in sqlite.query("select name from sqlite_master where type = 'index' and tbl_name = 'urls'")]
+  assert 'urls_rank_id' in names
+  assert 'urls_url_trgm' not in names
+
+def test_threads():
+  # Each thread has a connection of its own
+  connections = []
+  def run():
+    connections.append(sqlite.connection())
+  threads = [threading.Thread(target=run) for _ in range(2)]
+  for thread in threads:
+    thread.start()
+  for thread in threads:
+    thread.join()
+  assert len(set(id(conn) for conn in connections + [sqlite.connection()])) == 3
@@ -0,0 +1,145 @@
+import os
+import threading
+from types import SimpleNamespace
+from content_api.cache import TTLCache
+from content_api.json_schema import coerce_value
+from content_api.db import INTERFACE
+
+# Entity caches by model name, see entity_cache_stats
+entity_caches = {}
+
+def make_entity_cache(name, setting):
+  '''
+    Creates the cache for a model from its entity_cache setting which can be
+    True (default size and TTL), a dict with max_size and ttl, or any cache
+    object with the get/set/delete methods of TTLCache. Returns None if
+    the setting is falsy.
+  '''
+  if not setting:
+    return None
+  if setting is True:
+    cache = TTLCache(
+      max_size=int(os.environ.get('ENTITY_CACHE_SIZE', 1000)),
+      ttl=float(os.environ.get('ENTITY_CACHE_TTL', 60)))
+  elif isinstance(setting, dict):
+    cache = TTLCache(**setting)
+  else:
+    cache = setting
+  entity_caches[name] = cache
+  return cache
+
+def entity_cache_stats():
+  return {name: cache.stats() for name, cache in entity_caches.items() if hasattr(cache, 'stats')}
+
+def with_entity_cache(db, cache):
+  '''
+    Returns a database interface where find_one reads through the cache,
+    docs returned by create_returning and update_returning are written
+    through to the cache and other writes invalidate the cached docs. Other processes don't see the
+    invalidations so the TTL bounds how stale a cached doc can be.
+  '''
+  # Bumped on every invalidation and write through so that a doc read from
+  # the database concurrently with a write is not put in the cache
+  generation = [0]
+  lock = threading.Lock()
+
+  def key(table_name, id):
+    # Ids in paths are strings that can differ from the stored id (i.e. 05
+    # for 5 with PostgreSQL) so they are coerced to the type of the id first
+    return (table_name, str(coerce_value(id, db.id_json_schema) if isinstance(id, str) else id))
+
+  def invalidate(table_name, ids):
+    with lock:
+      generation[0] += 1
+    for id in ids:
+      cache.delete(key(table_name, id))
+
+  def put(table_name, doc, read_generation):
+    # Cached unless a write started or finished since the doc was read
+    with lock:
+      if read_generation == generation[0]:
+        cache.set(key(table_name, doc['id']), dict(doc))
+
+  def find_one(table_name, id, fields=None):
+    # Whole docs are cached, a sparse fieldset is projected from them
+    doc = cache.get(key(table_name, id))
+    if doc is None:
+      read_generation = generation[0]
+      doc = db.find_one(table_name, id)
+      if doc is not None:
+        put(table_name, doc, read_generation)
+    if doc is None:
+      return None
+    return {name: doc[name] for name in fields if name in doc} if fields else dict(doc)
+
+  def write_through(table_name, write_generation, doc):
+    # The written doc is cached unless another write invalidated it since.
+    # The generation is bumped after the write so that a read that started
+    # before it doesn't replace the written doc with the one it read.
+    with lock:
+      generation[0] += 1
+      if doc is not None and write_generation + 1 == generation[0]:
+        cache.set(key(table_name, doc['id']), dict(doc))
+    return doc
+
+  def create_returning(table_name, doc):
+    write_generation = generation[0]
+    return write_through(table_name, write_generation, db.create_returning(table_name, doc))
+
+  def update_returning(table_name, id, doc):
+    invalidate(table_name, [id])
+    write_generation = generation[0]
+    try:
+      updated_doc = db.update_returning(table_name, id, doc)
+    except Exception:
+      invalidate(table_name, [id])
+      raise
+    return write_through(table_name, write_generation, updated_doc)
+
+  def update(table_name, id, doc):
+    try:
+      return db.update(table_name, id, doc)
+    finally:
+      invalidate(table_name, [id])
+
+  def update_many(table_name, docs):
+    try:
+      return db.update_many(table_name, docs)
+    finally:
+      invalidate(table_name, [doc['id'] for doc in docs])
+
+  def claim_due(table_name, column, due, until, limit, doc=None):
+    claimed = db.claim_due(table_name, column, due, until, limit, doc)
+    invalidate(table_name, [row['id'] for row in claimed])
+    return claimed
+
+  def delete(table_name, id):
+    try:
+      return db.delete(table_name, id)
+    finally:
+      invalidate(table_name, [id])
+
+  def delete_returning(table_name, id):
+    try:
+      return db.delete_returning(table_name, id)
+    finally:
+      invalidate(table_name, [id])
+
+  def delete_many(table_name, ids):
+    try:
+      return db.delete_many(table_name, ids)
+    finally:
+      invalidate(table_name, ids)
+
+  cached = {
+    'find_one': find_one,
+    'create_returning': create_returning,
+    'update': update,
+    'update_returning': update_returning,
+    'update_many': update_many,
+    'claim_due': claim_due,
+    'delete': delete,
+    'delete_returning': delete_returning,
+    'delete_many': delete_many
+  }
+  return SimpleNamespace(**{name: cached.get(name, getattr(db, name)) for name in INTERFACE if hasattr(db, name)})
@@ -0,0 +1,112 @@
+import threading
+from types import SimpleNamespace
+from content_api.entity_cache import make_entity_cache, with_entity_cache, entity_cache_stats
+
+def make_db(docs):
+  calls = []
+  def find_one(table_name, id):
+    calls.append(('find_one', id))
+    return docs.get(int(id))
+  def update(table_name, id, doc):
+    docs[int(id)] = {**docs[int(id)], **doc}
+  def delete(table_name, id):
+    docs.pop(int(id), None)
+  def create_returning(table_name, doc):
+    id = max(docs.keys(), default=0) + 1
+    docs[id] = {**doc, 'id': id}
+    return dict(docs[id])
+  def update_returning(table_name, id, doc):
+    if int(id) not in docs:
+      return None
+    update(table_name, id, doc)
+    return dict(docs[int(id)])
+  def delete_returning(table_name, id):
+    return docs.pop(int(id), None)
+  db = SimpleNamespace(
+    find_one=find_one,
+    update=update,
+    delete=delete,
+    create_returning=create_returning,
+    update_returning=update_returning,
+    delete_returning=delete_returning,
+    id_json_schema={'type': 'integer'})
+  return (db, calls)
+
+def test_read_through():
+  (db, calls) = make_db({1: {'id': 1, 'url': 'a'}})
+  cached_db = with_entity_cache(db, make_entity_cache('test_read_through', {'max_size': 10, 'ttl': 60}))
+  assert cached_db.find_one('urls', '1') == {'id': 1, 'url': 'a'}
+  assert cached_db.find_one('urls', '1') == {'id': 1, 'url': 'a'}
+  assert cached_db.find_one('urls', 1) == {'id': 1, 'url': 'a'}
+  assert calls == [('find_one', '1')]
+  # Not found is not cached
+  assert cached_db.find_one('urls', '2') == None
+  assert cached_db.find_one('urls', '2') == None
+  assert len(calls) == 3
+  stats = entity_cache_stats()['test_read_through']
+  assert stats['hits'] == 2
+  assert stats['misses'] == 3
+
+def test_fields():
+  (db, calls) = make_db({1: {'id': 1, 'url': 'a'}})
+  cached_db = with_entity_cache(db, make_entity_cache('test_fields', True))
+  assert cached_db.find_one('urls', '1', fields=('id',)) == {'id': 1}
+  # The whole doc is cached
+  assert cached_db.find_one('urls', '1') == {'id': 1, 'url': 'a'}
+  assert calls == [('find_one', '1')]
+
+def test_invalidation():
+  (db, calls) = make_db({1: {'id': 1, 'url': 'a'}})
+  cached_db = with_entity_cache(db, make_entity_cache('test_invalidation', True))
+  assert cached_db.find_one('urls', '1')['url'] == 'a'
+  cached_db.update('urls', '1', {'url': 'b'})
+  assert cached_db.find_one('urls', '1')['url'] == 'b'
+  cached_db.delete('urls', '01')
+  assert cached_db.find_one('urls', '1') == None
+
+def test_write_through():
+  (db, calls) = make_db({1: {'id': 1, 'url': 'a'}})
+  cached_db = with_entity_cache(db, make_entity_cache('test_write_through', True))
+  created = cached_db.create_returning('urls', {'url': 'b'})
+  assert cached_db.find_one('urls', str(created['id'])) == {'id': 2, 'url': 'b'}
+  assert cached_db.update_returning('urls', '01', {'url': 'c'}) == {'id': 1, 'url': 'c'}
+  assert cached_db.find_one('urls', '1')['url'] == 'c'
+  assert calls == []
+  assert cached_db.update_returning('urls', '3', {'url': 'c'}) == None
+  assert cached_db.delete_returning('urls', '2') == {'id': 2, 'url': 'b'}
+  assert cached_db.find_one('urls', '2') == None
+
+def test_read_during_write():
+  # A read that misses before a write and returns after it doesn't replace
+  # the written doc in the cache with the one it read
+  (db, calls) = make_db({1: {'id': 1, 'url': 'old'}})
+  cached_db = with_entity_cache(db, make_entity_cache('test_read_during_write', True))
+  (read, written) = (threading.Event(), threading.Event())
+  (find_one, update_returning) = (db.find_one, db.update_returning)
+  def slow_find_one(table_name, id):
+    doc = find_one(table_name, id)
+    read.set()
+    written.wait()
+    return doc
+  reader = threading.Thread(target=cached_db.find_one, args=('urls', '1'))
+  def racing_update_returning(table_name, id, doc):
+    reader.start()
+    read.wait()
+    return update_returning(table_name, id, doc)
+  db.find_one = slow_find_one
+  db.update_returning = racing_update_returning
+  assert cached_db.update_returning('urls', '1', {'url': 'new'})['url'] == 'new'
+  written.set()
+  reader.join()
+  db.find_one = find_one
+  assert cached_db.find_one('urls', '1')['url'] == 'new'
+
+def test_returns_copies():
+  (db, calls) = make_db({1: {'id': 1, 'url': 'a'}})
+  cached_db = with_entity_cache(db, make_entity_cache('test_returns_copies', True))
+  cached_db.find_one('urls', '1')['url'] = 'changed'
+  assert cached_db.find_one('urls', '1')['url'] == 'a'
+
+def test_disabled():
+  assert make_entity_cache('test_disabled', None) == None
+  assert make_entity_cache('test_disabled', False) == None
@@ -0,0 +1,66 @@
+import json
+import hashlib
+from datetime import date
+
+def etag_value(value):
+  if isinstance(value, date):
+    return value.isoformat()
+  return str(value)
+
+def doc_tag(doc):
+  '''
+    Docs that have an id and an updated_at (set on every write by the model
+    API) are tagged by those so that the doc never needs to be serialized,
+    other docs by their content
+  '''
+  if doc.get('id') is not None and doc.get('updated_at') is not None:
+    return f'{doc["id"]}:{etag_value(doc["updated_at"])}'
+  return json.dumps(doc, sort_keys=True, default=etag_value)
+
+def make_etag(tags):
+  digest = hashlib.sha1()
+  for tag in tags:
+    digest.update(tag.encode('utf-8'))
+    digest.update(b'\n')
+  return f'"{digest.hexdigest()}"'
+
+def doc_etag(doc, fields=None):
+  # A sparse fieldset is another representation of the doc
+  return make_etag([doc_tag(doc)] + ([f'fields={fields}'] if fields else []))
+
+def docs_etag(docs, meta=None):
+  return make_etag([json.dumps(meta, sort_keys=True, default=etag_value)] + [doc_tag(doc) for doc in docs])
+
+def get_header(headers, name):
+  name = name.lower()
+  for k, v in (headers or {}).items():
+    if k.lower() == name:
+      return v
+  return None
+
+def etag_matches(if_none_match, etag):
+  if not if_none_match or not etag:
+    return False
+  if if_none_match.strip() == '*':
+    return True
+  # If-None-Match uses the weak comparison, see RFC 7232 section 3.2
+  tags = [tag.strip() for tag in if_none_match.split(',')]
+  return etag.removeprefix('W/') in [tag.removeprefix('W/') for tag in tags]
+
+def is_not_modified(request, etag):
+  return etag_matches(get_header(request.get('headers'), 'If-None-Match'), etag)
+
+def not_modified_response(response):
+  return {'status': 304, 'headers': response.get('headers', {})}
+
+def conditional_response(request_headers, response):
+  '''
+    Used by the framework adapters to turn a successful response with an
+    ETag header into a 304 (without a body) if the ETag matches If-None-Match
+  '''
+  if response.get('status', 200) != 200 or 'stream' in response:
+    return response
+  etag = get_header(response.get('headers'), 'ETag')
+  if etag_matches(get_header(request_headers, 'If-None-Match'), etag):
+    return not_modified_response(response)
+  return response
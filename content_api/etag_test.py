@@ -0,0 +1,33 @@
+from datetime import datetime
+from content_api.etag import doc_etag, docs_etag, etag_matches, conditional_response
+
+def test_doc_etag():
+  doc = {'id': 1, 'url': 'https://www.google.com', 'updated_at': datetime(2023, 12, 2, 9, 31, 28)}
+  assert doc_etag(doc) == doc_etag({**doc})
+  assert doc_etag(doc) != doc_etag({**doc, 'updated_at': datetime(2023, 12, 2, 9, 31, 29)})
+  assert doc_etag(doc).startswith('"')
+  # Without updated_at the content is used
+  assert doc_etag({'id': 1, 'url': 'a'}) != doc_etag({'id': 1, 'url': 'b'})
+
+def test_docs_etag():
+  docs = [{'id': 1, 'url': 'a'}, {'id': 2, 'url': 'b'}]
+  assert docs_etag(docs, {'offset': 0}) == docs_etag(docs, {'offset': 0})
+  assert docs_etag(docs, {'offset': 0}) != docs_etag(docs, {'offset': 1})
+  assert docs_etag(docs, {'offset': 0}) != docs_etag(docs[:1], {'offset': 0})
+
+def test_etag_matches():
+  assert etag_matches('"abc"', '"abc"')
+  assert etag_matches('W/"abc"', '"abc"')
+  assert etag_matches('"foo", "abc"', '"abc"')
+  assert etag_matches('*', '"abc"')
+  assert not etag_matches('"foo"', '"abc"')
+  assert not etag_matches(None, '"abc"')
+  assert not etag_matches('"abc"', None)
+
+def test_conditional_response():
+  response = {'body': {'hello': 'World!'}, 'headers': {'ETag': '"abc"'}}
+  assert conditional_response({'If-None-Match': '"abc"'}, response) == {'status': 304, 'headers': {'ETag': '"abc"'}}
+  assert conditional_response({'if-none-match': '"abc"'}, response)['status'] == 304
+  assert conditional_response({'If-None-Match': '"foo"'}, response) == response
+  assert conditional_response({}, response) == response
+  assert conditional_response({'If-None-Match': '"abc"'}, {**response, 'status': 400})['status'] == 400
@@ -0,0 +1,62 @@
+import io
+import csv
+from datetime import date
+from content_api.serialization import dumps
+
+EXPORT_FORMATS = {
+  'ndjson': 'application/x-ndjson',
+  'csv': 'text/csv'
+}
+
+def export_value(value):
+  if isinstance(value, date):
+    return value.isoformat()
+  return str(value)
+
+def batches(docs, batch_size):
+  batch = []
+  for doc in docs:
+    batch.append(doc)
+    if len(batch) >= batch_size:
+      yield batch
+      batch = []
+  if batch:
+    yield batch
+
+def close(iterator):
+  if hasattr(iterator, 'close'):
+    iterator.close()
+
+def ndjson_chunks(docs, batch_size=1000):
+  '''
+    Yields newline delimited JSON, one chunk of (at most) batch_size lines
+    at a time
+  '''
+  try:
+    for batch in batches(docs, batch_size):
+      yield b''.join([dumps(doc) + b'\n' for doc in batch])
+  finally:
+    close(docs)
+
+def csv_chunks(docs, columns, batch_size=1000):
+  '''
+    Yields CSV with a header row of the columns, one chunk of (at most)
+    batch_size rows at a time
+  '''
+  def csv_value(value):
+    return '' if value is None else export_value(value)
+  def write_rows(rows):
+    output = io.StringIO()
+    csv.writer(output).writerows(rows)
+    return output.getvalue()
+  try:
+    yield write_rows([columns])
+    for batch in batches(docs, batch_size):
+      yield write_rows([[csv_value(doc.get(c)) for c in columns] for doc in batch])
+  finally:
+    close(docs)
+
+def export_stream(format, docs, columns, batch_size=1000):
+  if format == 'csv':
+    return csv_chunks(docs, columns, batch_size)
+  return ndjson_chunks(docs, batch_size)
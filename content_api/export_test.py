@@ -0,0 +1,42 @@
+import json
+from datetime import datetime
+from content_api.export import export_stream
+
+docs = [
+  {'id': 1, 'url': 'https://www.google.com', 'created_at': datetime(2023, 12, 2, 9, 31, 28)},
+  {'id': 2, 'url': 'https://www.example.com/?q=a,b'},
+  {'id': 3, 'url': 'https://www.bing.com'}
+]
+
+def test_ndjson():
+  chunks = list(export_stream('ndjson', iter(docs), ['id', 'url', 'created_at'], batch_size=2))
+  assert len(chunks) == 2
+  lines = b''.join(chunks).splitlines()
+  assert [json.loads(line) for line in lines] == [
+    {'id': 1, 'url': 'https://www.google.com', 'created_at': '2023-12-02T09:31:28'},
+    {'id': 2, 'url': 'https://www.example.com/?q=a,b'},
+    {'id': 3, 'url': 'https://www.bing.com'}
+  ]
+
+def test_csv():
+  chunks = list(export_stream('csv', iter(docs), ['id', 'url', 'created_at'], batch_size=2))
+  assert len(chunks) == 3
+  assert ''.join(chunks).splitlines() == [
+    'id,url,created_at',
+    '1,https://www.google.com,2023-12-02T09:31:28',
+    '2,"https://www.example.com/?q=a,b",',
+    '3,https://www.bing.com,'
+  ]
+
+def test_close():
+  closed = []
+  def generate_docs():
+    try:
+      for doc in docs:
+        yield doc
+    finally:
+      closed.append(True)
+  stream = export_stream('ndjson', generate_docs(), ['id'], batch_size=1)
+  next(stream)
+  stream.close()
+  assert closed == [True]
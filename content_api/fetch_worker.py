@@ -0,0 +1,179 @@
+'''
+Fetches due urls (next_fetch_at in the past) concurrently and stores the
+responses in fetches, run with:
+
+  python -m content_api.fetch_worker
+  python -m content_api.fetch_worker --once
+'''
+import os
+import sys
+import time
+import threading
+from datetime import datetime, timedelta
+from urllib.parse import urlsplit
+from concurrent.futures import ThreadPoolExecutor
+from content_api.url_validation import make_session
+
+def percentile(values, p):
+  if not values:
+    return None
+  values = sorted(values)
+  return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+class HostLimiter:
+  '''
+    Politeness per host: at most concurrency requests at a time and at
+    least delay seconds between the starts of two requests
+  '''
+  def __init__(self, concurrency=2, delay=0.5):
+    self.concurrency = concurrency
+    self.delay = delay
+    self._hosts = {}
+    self._lock = threading.Lock()
+
+  def host(self, url):
+    name = urlsplit(url).netloc.lower()
+    with self._lock:
+      if name not in self._hosts:
+        self._hosts[name] = {'semaphore': threading.BoundedSemaphore(self.concurrency), 'lock': threading.Lock(), 'last_start': 0}
+      return self._hosts[name]
+
+  def run(self, url, fetch):
+    host = self.host(url)
+    with host['semaphore']:
+      with host['lock']:
+        wait = host['last_start'] + self.delay - time.monotonic()
+        if wait > 0:
+          time.sleep(wait)
+        host['last_start'] = time.monotonic()
+      return fetch(url)
+
+class FetchWorker:
+  def __init__(self, db,
+    session=None,
+    concurrency=10,
+    host_concurrency=2,
+    host_delay=0.5,
+    timeout=10,
+    interval=3600,
+    retry_interval=300,
+    batch_size=100,
+    insert_batch_size=50,
+    max_bytes=1_000_000):
+    self.db = db
+    self.session = session or make_session(concurrency)
+    self.concurrency = concurrency
+    self.limiter = HostLimiter(host_concurrency, host_delay)
+    self.timeout = timeout
+    self.interval = interval
+    self.retry_interval = retry_interval
+    self.batch_size = batch_size
+    self.insert_batch_size = insert_batch_size
+    self.max_bytes = max_bytes
+
+  def claim_due_urls(self, now):
+    # One atomic statement, so concurrent workers never claim the same url
+    return self.db.claim_due('urls', 'next_fetch_at', now, now + timedelta(seconds=self.interval), self.batch_size, {'updated_at': now})
+
+  def fetch(self, url):
+    '''
+      Returns (data, error, seconds), the body is read up to max_bytes
+    '''
+    start = time.monotonic()
+    try:
+      response = self.session.get(url, timeout=self.timeout, stream=True)
+      try:
+        if response.status_code != 200:
+          return (None, f'status {response.status_code}', time.monotonic() - start)
+        content = b''
+        for chunk in response.iter_content(chunk_size=64 * 1024):
+          content += chunk
+          if len(content) >= self.max_bytes:
+            content = content[:self.max_bytes]
+            break
+        # PostgreSQL text can't contain NUL characters
+        data = content.decode(response.encoding or 'utf-8', errors='replace').replace('\x00', '')
+        return (data, None, time.monotonic() - start)
+      finally:
+        response.close()
+    except Exception as error:
+      return (None, type(error).__name__, time.monotonic() - start)
+
+  def run_once(self):
+    '''
+      Fetches one batch of due urls. They are claimed (next_fetch_at moved
+      interval ahead) before fetching, failed fetches are due again after
+      retry_interval. Both writes set updated_at, which the ETag of a url
+      is made of. Returns stats of the batch.
+    '''
+    start = time.monotonic()
+    now = datetime.now()
+    urls = self.claim_due_urls(now)
+    stats = {'urls': len(urls), 'fetched': 0, 'errors': {}, 'bytes': 0, 'inserted': 0}
+    if not urls:
+      return {**stats, 'seconds': time.monotonic() - start}
+    latencies = []
+    pending = []
+    failed = []
+    def insert(docs):
+      if docs:
+        stats['inserted'] += len(self.db.create_many('fetches', docs))
+    with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='fetch') as executor:
+      futures = [(url, executor.submit(self.limiter.run, url['url'], self.fetch)) for url in urls]
+      for (url, future) in futures:
+        (data, error, seconds) = future.result()
+        latencies.append(seconds)
+        if error:
+          stats['errors'][error] = stats['errors'].get(error, 0) + 1
+          failed.append(url)
+          continue
+        stats['fetched'] += 1
+        stats['bytes'] += len(data)
+        fetched_at = datetime.now()
+        pending.append({'url_id': url['id'], 'data': data, 'created_at': fetched_at, 'updated_at': fetched_at})
+        if len(pending) >= self.insert_batch_size:
+          insert(pending)
+          pending = []
+    insert(pending)
+    if failed:
+      failed_at = datetime.now()
+      retry_at = failed_at + timedelta(seconds=self.retry_interval)
+      self.db.update_many('urls', [{'id': url['id'], 'next_fetch_at': retry_at, 'updated_at': failed_at} for url in failed])
+    seconds = time.monotonic() - start
+    return {
+      **stats,
+      'seconds': seconds,
+      'fetches_per_second': len(urls) / seconds if seconds else None,
+      'latency_p50': percentile(latencies, 50),
+      'latency_p99': percentile(latencies, 99),
+      'latency_max': max(latencies)
+    }
+
+  def run(self, poll_interval=10, once=False):
+    while True:
+      stats = self.run_once()
+      if stats['urls']:
+        print(f'fetch_worker: {stats}')
+      if once:
+        return stats
+      if stats['urls'] < self.batch_size:
+        time.sleep(poll_interval)
+
+def make_fetch_worker(db):
+  return FetchWorker(db,
+    concurrency=int(os.environ.get('FETCH_CONCURRENCY', 10)),
+    host_concurrency=int(os.environ.get('FETCH_HOST_CONCURRENCY', 2)),
+    host_delay=float(os.environ.get('FETCH_HOST_DELAY', 0.5)),
+    timeout=float(os.environ.get('FETCH_TIMEOUT', 10)),
+    interval=float(os.environ.get('FETCH_INTERVAL', 3600)),
+    retry_interval=float(os.environ.get('FETCH_RETRY_INTERVAL', 300)),
+    batch_size=int(os.environ.get('FETCH_BATCH_SIZE', 100)),
+    insert_batch_size=int(os.environ.get('FETCH_INSERT_BATCH_SIZE', 50)),
+    max_bytes=int(os.environ.get('FETCH_MAX_BYTES', 1_000_000)))
+
+if __name__ == '__main__':
+  from content_api.db import db
+  # The worker is a process of its own, so its writes don't invalidate the
+  # entity caches of the API processes, which serve their cached urls for up
+  # to the entity_cache TTL of the urls model
+  make_fetch_worker(db).run(poll_interval=float(os.environ.get('FETCH_POLL_INTERVAL', 10)), once='--once' in sys.argv)
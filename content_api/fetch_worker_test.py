@@ -0,0 +1,85 @@
+import time
+import importlib
+import threading
+from datetime import datetime
+import pytest
+import content_api.db.memory as memory
+from content_api.fetch_worker import FetchWorker, HostLimiter, percentile
+
+@pytest.fixture
+def base_url(stub_server):
+  stub_server.responses.update({'/big': {'body': b'x' * 100}, '/missing': {'status': 404}})
+  return stub_server.url
+
+@pytest.fixture
+def db(monkeypatch):
+  # The in-memory backend with the urls table of the urls model
+  monkeypatch.setattr(memory, 'tables', {})
+  memory.define_table('urls', importlib.import_module('models.00_urls').db_schema)
+  return memory
+
+@pytest.fixture
+def inserts(db, monkeypatch):
+  # The sizes of the create_many calls
+  inserts = []
+  create_many = db.create_many
+  def record_create_many(table_name, docs):
+    inserts.append(len(docs))
+    return create_many(table_name, docs)
+  monkeypatch.setattr(db, 'create_many', record_create_many)
+  return inserts
+
+def create_urls(db, urls):
+  now = datetime.now()
+  return db.create_many('urls', [{'url': url, 'created_at': now, 'updated_at': now} for url in urls])
+
+def test_run_once(base_url, db, inserts):
+  created = create_urls(db, [f'{base_url}/{i}' for i in range(5)] + [f'{base_url}/missing'])
+  # New urls are due right away
+  assert all(url['next_fetch_at'] == datetime(1970, 1, 1) for url in created)
+  inserts.clear()
+  worker = FetchWorker(db, host_delay=0, insert_batch_size=2, interval=60, retry_interval=10)
+  stats = worker.run_once()
+  assert stats['urls'] == 6
+  assert stats['fetched'] == 5
+  assert stats['inserted'] == 5
+  assert stats['errors'] == {'status 404': 1}
+  assert stats['latency_p50'] != None
+  assert inserts == [2, 2, 1]
+  fetches = db.find('fetches', limit=10, sort='id')
+  assert sorted((f['url_id'], f['data']) for f in fetches) == [(url['id'], f'page /{i}') for i, url in enumerate(created[:5])]
+  urls = {url['id']: url for url in db.find('urls', limit=10)}
+  # Fetched urls are due again after interval, failed ones after retry_interval
+  assert all((urls[url['id']]['next_fetch_at'] - datetime.now()).total_seconds() > 50 for url in created[:5])
+  assert 0 < (urls[created[5]['id']]['next_fetch_at'] - datetime.now()).total_seconds() < 11
+  # Both writes change the ETag of the url
+  assert all(url['updated_at'] > created[0]['updated_at'] for url in urls.values())
+  assert urls[created[5]['id']]['updated_at'] > urls[created[0]['id']]['updated_at']
+  assert worker.run_once()['urls'] == 0
+
+def test_max_bytes(base_url, db):
+  create_urls(db, [f'{base_url}/big'])
+  FetchWorker(db, max_bytes=10).run_once()
+  assert db.find('fetches')[0]['data'] == 'x' * 10
+
+def test_host_limiter(base_url, stub_server, db):
+  limiter = HostLimiter(concurrency=1, delay=0.1)
+  worker = FetchWorker(db)
+  starts = []
+  def fetch(url):
+    # Timed where the limiter lets the request start, the server sees it later
+    starts.append(time.monotonic())
+    return worker.fetch(url)
+  threads = [threading.Thread(target=limiter.run, args=(f'{base_url}/{i}', fetch)) for i in range(3)]
+  for thread in threads:
+    thread.start()
+  for thread in threads:
+    thread.join()
+  starts.sort()
+  assert len(stub_server.requests) == 3
+  assert all(b - a >= 0.09 for (a, b) in zip(starts, starts[1:]))
+
+def test_percentile():
+  assert percentile([], 50) == None
+  assert percentile([3, 1, 2], 50) == 2
+  assert percentile(list(range(100)), 99) == 99
@@ -0,0 +1,78 @@
+import re
+import logging
+import content_api.util as util
+
+logger = logging.getLogger(__name__)
+
+INDEX_TYPES = ['btree', 'trigram']
+
+def normalize_index(table_name, index):
+  '''
+    An index is a dict with columns (prefix a column with - for descending
+    order), and the optional type (btree, the default, or trigram for
+    filter.column[contains]), unique and name
+  '''
+  columns = [index] if isinstance(index, str) else index['columns']
+  index = {} if isinstance(index, str) else index
+  type = index.get('type', 'btree')
+  if type not in INDEX_TYPES:
+    raise Exception(f'Invalid index type {type} for table {table_name}, must be one of {", ".join(INDEX_TYPES)}')
+  unique = index.get('unique', False)
+  names = [c[1:] + '_desc' if c.startswith('-') else c for c in columns]
+  suffix = ('_unique' if unique else '') + ('_trgm' if type == 'trigram' else '')
+  return {
+    'columns': columns,
+    'type': type,
+    'unique': unique,
+    'name': index.get('name', f'{table_name}_{"_".join(names)}{suffix}_idx')
+  }
+
+def model_indexes(table_name, json_schema, indexes=[]):
+  '''
+    The indexes of a model, from its indexes list and from properties with
+    x-meta index set to True (btree) or an index type (i.e. trigram)
+  '''
+  property_indexes = []
+  for name, property in json_schema.get('properties', {}).items():
+    index = util.get(property, 'x-meta.index')
+    if index:
+      property_indexes.append({'columns': [name], 'type': 'btree' if index is True else index})
+  return [normalize_index(table_name, index) for index in property_indexes + list(indexes)]
+
+def column_name(column):
+  return column[1:] if column.startswith('-') else column
+
+def schema_indexed_columns(db_schema):
+  # Columns declared PRIMARY KEY or UNIQUE in CREATE TABLE are indexed
+  pattern = re.compile(r'^\s*([a-zA-Z0-9_]+)\s+[^,\n]*\b(PRIMARY KEY|UNIQUE)\b', re.IGNORECASE | re.MULTILINE)
+  return set(match.group(1) for match in pattern.finditer(db_schema or ''))
+
+def unindexed_columns(json_schema, indexes, db_schema=None):
+  '''
+    Returns {column: [use, ...]} for the columns that list can sort or
+    filter on (sort/filter) or filter with contains on without an index.
+    Only the first column of a btree index counts, and properties with
+    x-meta index set to False are left out on purpose. Strings with an enum
+    or a format (i.e. date-time) are filtered by value, not with contains.
+  '''
+  btree_columns = {'id'} | schema_indexed_columns(db_schema) | set(column_name(i['columns'][0]) for i in indexes if i['type'] == 'btree')
+  trigram_columns = set(column_name(c) for i in indexes if i['type'] == 'trigram' for c in i['columns'])
+  result = {}
+  for name, property in json_schema.get('properties', {}).items():
+    if name == 'id' or util.get(property, 'x-meta.index') == False:
+      continue
+    uses = []
+    if name not in btree_columns:
+      uses.append('sort/filter')
+    if property.get('type') == 'string' and 'enum' not in property and 'format' not in property and name not in trigram_columns:
+      uses.append('contains')
+    if uses:
+      result[name] = uses
+  return result
+
+def warn_unindexed(model_name, json_schema, indexes, db_schema=None):
+  columns = unindexed_columns(json_schema, indexes, db_schema)
+  if columns:
+    description = ', '.join([f'{name} ({" and ".join(uses)})' for name, uses in columns.items()])
+    logger.warning(f'The {model_name} list route can sort or filter on unindexed columns: {description}. Declare indexes for them in the model or set x-meta index to False.')
+  return columns
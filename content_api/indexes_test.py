@@ -0,0 +1,50 @@
+from content_api.indexes import model_indexes, unindexed_columns, schema_indexed_columns
+
+json_schema = {
+  'type': 'object',
+  'properties': {
+    'id': {'type': 'integer'},
+    'url': {'type': 'string', 'x-meta': {'index': 'trigram'}},
+    'title': {'type': 'string'},
+    'body': {'type': 'string', 'x-meta': {'index': False}},
+    'status': {'type': 'string', 'enum': ['pending', 'valid'], 'x-meta': {'index': True}},
+    'email': {'type': 'string', 'format': 'email', 'x-meta': {'index': True}},
+    'created_at': {'type': 'string', 'format': 'date-time', 'x-meta': {'writable': False, 'index': True}},
+    'updated_at': {'type': 'string', 'format': 'date-time'}
+  }
+}
+
+db_schema = '''
+  CREATE TABLE urls (
+    id serial PRIMARY KEY,
+    title text UNIQUE NOT NULL,
+    url text
+  )
+'''
+
+def test_model_indexes():
+  indexes = model_indexes('urls', json_schema, [{'columns': ['-updated_at', '-id']}, {'columns': ['title'], 'unique': True}])
+  assert indexes == [
+    {'columns': ['url'], 'type': 'trigram', 'unique': False, 'name': 'urls_url_trgm_idx'},
+    {'columns': ['status'], 'type': 'btree', 'unique': False, 'name': 'urls_status_idx'},
+    {'columns': ['email'], 'type': 'btree', 'unique': False, 'name': 'urls_email_idx'},
+    {'columns': ['created_at'], 'type': 'btree', 'unique': False, 'name': 'urls_created_at_idx'},
+    {'columns': ['-updated_at', '-id'], 'type': 'btree', 'unique': False, 'name': 'urls_updated_at_desc_id_desc_idx'},
+    {'columns': ['title'], 'type': 'btree', 'unique': True, 'name': 'urls_title_unique_idx'}
+  ]
+
+def test_schema_indexed_columns():
+  assert schema_indexed_columns(db_schema) == {'id', 'title'}
+
+def test_unindexed_columns():
+  # Enum and format strings (status, email, the timestamps) are not
+  # filtered with contains
+  indexes = model_indexes('urls', json_schema)
+  assert unindexed_columns(json_schema, indexes, db_schema) == {
+    'url': ['sort/filter'],
+    'title': ['contains'],
+    'updated_at': ['sort/filter']
+  }
+  indexes = model_indexes('urls', json_schema, [{'columns': ['-updated_at', '-id']}, 'url'])
+  assert 'updated_at' not in unindexed_columns(json_schema, indexes, db_schema)
+  assert 'url' not in unindexed_columns(json_schema, indexes, db_schema)
@@ -1,4 +1,5 @@
-from jsonschema import validate, ValidationError
+from jsonschema import validate, validators, ValidationError
+from jsonschema.exceptions import best_match
 from content_api.util import get
 from dateutil.parser import parse as parse_date
 
@@ -9,6 +10,19 @@ def validate_schema(instance, schema):
   except ValidationError as schema_error:
     return schema_error
 
+def compile_schema(schema):
+  '''
+    Checks the schema against its meta schema and builds a validator that
+    can be reused, see validate_compiled.
+  '''
+  validator_class = validators.validator_for(schema)
+  validator_class.check_schema(schema)
+  return validator_class(schema)
+
+def validate_compiled(instance, validator):
+  # Picks the same error as jsonschema.validate would raise
+  return best_match(validator.iter_errors(instance))
+
 def coerce_value(value, value_schema):
   value_type = get(value_schema, 'type')
   if not value_type or value is None:
@@ -33,7 +47,12 @@ def coerce_values(values, schema):
 def is_writable(property):
   return get(property, 'x-meta.writable') != False
 
+def is_array_schema(schema):
+  return bool(schema) and schema.get('type') == 'array' and 'items' in schema
+
 def writable_schema(schema):
+  if is_array_schema(schema):
+    return {**schema, 'items': writable_schema(schema['items'])}
   if not schema or not 'properties' in schema:
     return schema
   properties = {key: property for key, property in schema['properties'].items() if is_writable(property)}
@@ -45,6 +64,8 @@ def writable_schema(schema):
   }
 
 def writable_doc(schema, doc):
+  if is_array_schema(schema) and isinstance(doc, list):
+    return [writable_doc(schema['items'], item) for item in doc]
   if not doc or not schema or not 'properties' in schema:
     return doc
   unwritable_keys = [k for k, v in schema['properties'].items() if not is_writable(v)]
@@ -53,3 +74,12 @@ def writable_doc(schema, doc):
 def schema_error_response(schema_error):
   body = {'error': {'message': schema_error.message, 'path': list(schema_error.path), 'schema': schema_error.schema}}
   return {'status': 400, 'body': body}
+
+def schema_errors_response(item_errors):
+  '''
+    Validation failure of individual items in an array, item_errors is a list
+    of (index, schema_error) tuples
+  '''
+  items = [{'index': index, 'message': e.message, 'path': list(e.path), 'schema': e.schema} for index, e in item_errors]
+  body = {'error': {'message': f'Invalid items at indexes {[index for index, _ in item_errors]}', 'items': items}}
+  return {'status': 400, 'body': body}
@@ -1,4 +1,4 @@
-from content_api.json_schema import writable_schema, writable_doc
+from content_api.json_schema import writable_schema, writable_doc, compile_schema, validate_compiled, validate_schema
 
 def test_writable_schema():
   schema = {
@@ -39,3 +39,32 @@ def test_writable_doc():
   assert writable_doc(schema, None) == None
   assert writable_doc(None, doc) == doc
   assert writable_doc(schema, doc) == expected_doc
+
+def test_validate_compiled():
+  schema = {
+    'type': 'object',
+    'properties': {
+      'title': {'type': 'string', 'minLength': 2}
+    },
+    'required': ['title'],
+    'additionalProperties': False
+  }
+  validator = compile_schema(schema)
+  assert validate_compiled({'title': 'the title'}, validator) == None
+  for invalid_doc in [{}, {'title': 1}, {'title': 'a'}, {'title': 'the title', 'foo': 1}]:
+    schema_error = validate_compiled(invalid_doc, validator)
+    assert schema_error
+    assert schema_error.message == validate_schema(invalid_doc, schema).message
+
+def test_writable_array():
+  item_schema = {
+    'type': 'object',
+    'properties': {
+      'id': {'type': 'integer', 'x-meta': {'writable': False}},
+      'title': {'type': 'string'}
+    },
+    'required': ['id', 'title']
+  }
+  schema = {'type': 'array', 'items': item_schema}
+  assert writable_schema(schema) == {'type': 'array', 'items': writable_schema(item_schema)}
+  assert writable_doc(schema, [{'id': 1, 'title': 'foo'}, {'title': 'bar'}]) == [{'title': 'foo'}, {'title': 'bar'}]
@@ -0,0 +1,215 @@
+'''
+Request counts and latency histograms per route (model_name and name),
+recorded by the handler that set_route_defaults wraps every route with, and
+served by the adapters from /metrics in the Prometheus text format along
+with the database call metrics (see content_api/db/instrumentation.py) and
+the stats of the connection pool and the caches. The metrics are per
+process, with several workers (i.e. gunicorn) each one is scraped on its own.
+'''
+import time
+import threading
+from bisect import bisect_left
+from functools import wraps
+from content_api.db import db
+from content_api.db.instrumentation import query_scope, query_metrics, query_metrics_lock
+from content_api.entity_cache import entity_cache_stats
+
+# Upper bounds (seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+class RouteMetrics:
+  '''
+    The counters of one route, each route has its own lock so that
+    requests to different routes don't contend
+  '''
+  def __init__(self, model_name, name, method, buckets=LATENCY_BUCKETS):
+    self.labels = {'model': model_name, 'route': name, 'method': method}
+    self.buckets = buckets
+    self.bucket_counts = [0] * (len(buckets) + 1)
+    self.statuses = {}
+    self.sum = 0.0
+    self.count = 0
+    self.db_sum = 0.0
+    self.db_count = 0
+    self.lock = threading.Lock()
+
+  def observe(self, status, duration, db_duration=0.0, db_count=0):
+    status_class = f'{status // 100}xx'
+    i = bisect_left(self.buckets, duration)
+    with self.lock:
+      self.bucket_counts[i] += 1
+      self.statuses[status_class] = self.statuses.get(status_class, 0) + 1
+      self.sum += duration
+      self.count += 1
+      self.db_sum += db_duration
+      self.db_count += db_count
+
+  def snapshot(self):
+    with self.lock:
+      return (list(self.bucket_counts), dict(self.statuses), self.sum, self.count, self.db_sum, self.db_count)
+
+# RouteMetrics by (model_name, name, method) in the order the routes are made
+route_metrics = {}
+route_metrics_lock = threading.Lock()
+
+def get_route_metrics(model_name, name, method):
+  key = (model_name, name, method)
+  with route_metrics_lock:
+    if key not in route_metrics:
+      route_metrics[key] = RouteMetrics(model_name, name, method)
+    return route_metrics[key]
+
+def with_metrics(route, handler):
+  '''
+    Wraps the handler of the route to record the status, the latency and
+    the database time and calls of each response, an exception is recorded
+    as a 500. The database time and calls are also returned in a
+    Server-Timing header. Streamed responses (exports) are timed until the
+    stream is returned.
+  '''
+  metrics = get_route_metrics(route['model_name'], route['name'], route['method'])
+  @wraps(handler)
+  def with_metrics_handler(request):
+    start = time.perf_counter()
+    status = 500
+    with query_scope() as queries:
+      try:
+        response = handler(request)
+        status = response.get('status', 200)
+      finally:
+        metrics.observe(status, time.perf_counter() - start, queries.duration, queries.count)
+    if queries.count:
+      server_timing = f'db;dur={queries.duration * 1000:.3f};desc="{queries.count} queries"'
+      response = {**response, 'headers': {**response.get('headers', {}), 'Server-Timing': server_timing}}
+    return response
+  return with_metrics_handler
+
+# (name, stats function, label, counters) where the stats are a dict of
+# numbers (nested dicts are flattened into the metric names) or a dict of
+# those by the label value. counters are the (flattened) names of the stats
+# that only increase, they are exported as counters and the others as gauges.
+collectors = [
+  ('db_pool', getattr(db, 'pool_stats', None), None, ('checkouts', 'waits', 'wait_time_total', 'timeouts', 'connects', 'discarded')),
+  ('entity_cache', entity_cache_stats, 'model', ('hits', 'misses', 'evictions'))
+]
+
+def register_collector(name, stats, label=None, counters=()):
+  # Registering a name again replaces the collector, i.e. when a model
+  # module is loaded again
+  collectors[:] = [collector for collector in collectors if collector[0] != name]
+  collectors.append((name, stats, label, tuple(counters)))
+
+def label_text(labels):
+  if not labels:
+    return ''
+  escaped = {k: str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for k, v in labels.items()}
+  return '{' + ','.join(f'{k}="{v}"' for k, v in escaped.items()) + '}'
+
+def format_value(value):
+  if value == float('inf'):
+    return '+Inf'
+  return repr(float(value)) if isinstance(value, float) else str(int(value))
+
+def flatten(stats, prefix):
+  for key, value in stats.items():
+    name = f'{prefix}_{key}'
+    if isinstance(value, dict):
+      yield from flatten(value, name)
+    elif isinstance(value, (int, float)):
+      yield (name, value)
+
+def route_lines():
+  with route_metrics_lock:
+    routes = list(route_metrics.values())
+  lines = [
+    '# HELP content_api_requests_total Requests by route and status class.',
+    '# TYPE content_api_requests_total counter'
+  ]
+  snapshots = [(route, route.snapshot()) for route in routes]
+  for route, (_, statuses, _, _, _, _) in snapshots:
+    for status_class, count in sorted(statuses.items()):
+      lines.append(f'content_api_requests_total{label_text({**route.labels, "status": status_class})} {count}')
+  lines += [
+    '# HELP content_api_request_duration_seconds Request latency by route.',
+    '# TYPE content_api_request_duration_seconds histogram'
+  ]
+  for route, (bucket_counts, _, total, count, _, _) in snapshots:
+    lines += histogram_lines('content_api_request_duration_seconds', route.labels, route.buckets, bucket_counts, total, count)
+  lines += [
+    '# HELP content_api_request_db_seconds_total Database time of the requests by route.',
+    '# TYPE content_api_request_db_seconds_total counter'
+  ]
+  lines += [f'content_api_request_db_seconds_total{label_text(route.labels)} {format_value(db_sum)}' for route, (_, _, _, _, db_sum, _) in snapshots]
+  lines += [
+    '# HELP content_api_request_db_queries_total Database calls of the requests by route.',
+    '# TYPE content_api_request_db_queries_total counter'
+  ]
+  lines += [f'content_api_request_db_queries_total{label_text(route.labels)} {db_count}' for route, (_, _, _, _, _, db_count) in snapshots]
+  return lines
+
+def histogram_lines(name, labels, buckets, bucket_counts, total, count):
+  lines = []
+  cumulative = 0
+  for le, bucket_count in zip(buckets + (float('inf'),), bucket_counts):
+    cumulative += bucket_count
+    lines.append(f'{name}_bucket{label_text({**labels, "le": format_value(le)})} {cumulative}')
+  lines.append(f'{name}_sum{label_text(labels)} {format_value(total)}')
+  lines.append(f'{name}_count{label_text(labels)} {count}')
+  return lines
+
+def query_lines():
+  with query_metrics_lock:
+    queries = list(query_metrics.values())
+  snapshots = [(query, query.snapshot()) for query in queries]
+  lines = [
+    '# HELP content_api_db_query_duration_seconds Database call latency by operation and table.',
+    '# TYPE content_api_db_query_duration_seconds histogram'
+  ]
+  for query, snapshot in snapshots:
+    lines += histogram_lines('content_api_db_query_duration_seconds', query.labels, query.buckets, snapshot.bucket_counts, snapshot.sum, snapshot.count)
+  lines += [
+    '# HELP content_api_db_query_rows_total Rows returned or written by operation and table.',
+    '# TYPE content_api_db_query_rows_total counter'
+  ]
+  lines += [f'content_api_db_query_rows_total{label_text(query.labels)} {snapshot.rows}' for query, snapshot in snapshots]
+  lines += [
+    '# HELP content_api_db_query_errors_total Failed database calls by operation and table.',
+    '# TYPE content_api_db_query_errors_total counter'
+  ]
+  lines += [f'content_api_db_query_errors_total{label_text(query.labels)} {snapshot.errors}' for query, snapshot in snapshots]
+  return lines
+
+def collector_lines():
+  samples = {}
+  types = {}
+  for (name, stats, label, counters) in collectors:
+    if stats is None:
+      continue
+    prefix = f'content_api_{name}'
+    counter_names = {f'{prefix}_{counter}' for counter in counters}
+    result = stats()
+    groups = result.items() if label else [(None, result)]
+    for label_value, group_stats in groups:
+      labels = {label: label_value} if label else {}
+      for (metric, value) in flatten(group_stats, prefix):
+        if metric in counter_names:
+          metric = metric if metric.endswith('_total') else f'{metric}_total'
+          types[metric] = 'counter'
+        samples.setdefault(metric, []).append((labels, value))
+  lines = []
+  for metric, values in samples.items():
+    lines.append(f'# TYPE {metric} {types.get(metric, "gauge")}')
+    lines += [f'{metric}{label_text(labels)} {format_value(value)}' for (labels, value) in values]
+  return lines
+
+def render_metrics():
+  return '\n'.join(route_lines() + query_lines() + collector_lines()) + '\n'
+
+def metrics_response():
+  '''
+    Returns a dict with status, headers and content (bytes) like
+    swagger_response
+  '''
+  return {'status': 200, 'headers': {'Content-Type': CONTENT_TYPE, 'Cache-Control': 'no-store'}, 'content': render_metrics().encode('utf-8')}
@@ -0,0 +1,91 @@
+import re
+import threading
+import pytest
+from content_api import metrics
+from types import SimpleNamespace
+from content_api.metrics import with_metrics, render_metrics, RouteMetrics
+from content_api.db.instrumentation import InstrumentedDatabase
+
+def route(name, handler):
+  return {'model_name': 'test_metrics', 'name': name, 'method': 'GET', 'handler': handler}
+
+def sample(text, metric, **labels):
+  label_pattern = ','.join(f'{k}="{re.escape(v)}"' for k, v in labels.items())
+  match = re.search(rf'^{metric}\{{{label_pattern}\}} (\S+)$', text, re.MULTILINE)
+  return float(match.group(1)) if match else None
+
+def test_observe():
+  route_metrics = RouteMetrics('m', 'r', 'GET', buckets=(0.1, 1))
+  route_metrics.observe(200, 0.05)
+  route_metrics.observe(404, 0.1)
+  route_metrics.observe(500, 2, db_duration=0.5, db_count=2)
+  assert route_metrics.snapshot() == ([2, 0, 1], {'2xx': 1, '4xx': 1, '5xx': 1}, 2.15, 3, 0.5, 2)
+
+def test_with_metrics():
+  def ok(request):
+    return {'body': {}}
+  def invalid(request):
+    return {'status': 400}
+  def fail(request):
+    raise Exception('fail')
+  handlers = [with_metrics(route(h.__name__, h), h) for h in [ok, invalid, fail]]
+  for handler in handlers[:2]:
+    handler({})
+  handlers[0]({})
+  with pytest.raises(Exception):
+    handlers[2]({})
+  text = render_metrics()
+  assert sample(text, 'content_api_requests_total', model='test_metrics', route='ok', method='GET', status='2xx') == 2
+  assert sample(text, 'content_api_requests_total', model='test_metrics', route='invalid', method='GET', status='4xx') == 1
+  assert sample(text, 'content_api_requests_total', model='test_metrics', route='fail', method='GET', status='5xx') == 1
+  assert sample(text, 'content_api_request_duration_seconds_bucket', model='test_metrics', route='ok', method='GET', le='+Inf') == 2
+  assert sample(text, 'content_api_request_duration_seconds_count', model='test_metrics', route='ok', method='GET') == 2
+  assert handlers[0].__name__ == 'ok'
+
+def test_db_time():
+  database = InstrumentedDatabase(SimpleNamespace(find_one=lambda table_name, id: {'id': id}), ['find_one'])
+  def get(request):
+    database.find_one('test_metrics', 1)
+    return {'body': database.find_one('test_metrics', 2), 'headers': {'ETag': '"1"'}}
+  response = with_metrics(route('db_time', get), get)({})
+  assert response['body'] == {'id': 2}
+  assert response['headers']['ETag'] == '"1"'
+  assert re.match(r'^db;dur=\d+\.\d{3};desc="2 queries"$', response['headers']['Server-Timing'])
+  text = render_metrics()
+  assert sample(text, 'content_api_request_db_queries_total', model='test_metrics', route='db_time', method='GET') == 2
+  assert sample(text, 'content_api_db_query_duration_seconds_count', operation='find_one', table='test_metrics') >= 2
+
+def test_threads():
+  def ok(request):
+    return {'body': {}}
+  handler = with_metrics(route('threads', ok), ok)
+  def run():
+    for _ in range(1000):
+      handler({})
+  threads = [threading.Thread(target=run) for _ in range(4)]
+  for thread in threads:
+    thread.start()
+  for thread in threads:
+    thread.join()
+  assert sample(render_metrics(), 'content_api_request_duration_seconds_count', model='test_metrics', route='threads', method='GET') == 4000
+
+def test_collectors(monkeypatch):
+  monkeypatch.setattr(metrics, 'collectors', [
+    ('cache', lambda: {'a': {'hits': 3, 'ttl': 1.5}, 'b': {'hits': 1, 'name': 'b'}}, 'model', ('hits',)),
+    ('pool', lambda: {'size': 2, 'waits': {'count': 1}, 'wait_time_total': 0.5}, None, ('waits_count', 'wait_time_total'))
+  ])
+  metrics.register_collector('queue', lambda: {'size': 1})
+  metrics.register_collector('queue', lambda: {'size': 2, 'requests': 5}, counters=('requests',))
+  text = render_metrics()
+  assert sample(text, 'content_api_cache_hits_total', model='a') == 3
+  assert sample(text, 'content_api_cache_hits_total', model='b') == 1
+  assert sample(text, 'content_api_cache_ttl', model='a') == 1.5
+  assert 'content_api_cache_name' not in text
+  assert text.count('# TYPE content_api_cache_hits_total counter') == 1
+  assert '# TYPE content_api_cache_ttl gauge' in text
+  assert re.search(r'^content_api_pool_waits_count_total 1$', text, re.MULTILINE)
+  assert re.search(r'^content_api_pool_wait_time_total 0.5$', text, re.MULTILINE)
+  assert '# TYPE content_api_pool_wait_time_total counter' in text
+  # A collector registered again replaces the previous one
+  assert re.search(r'^content_api_queue_size 2$', text, re.MULTILINE)
+  assert re.search(r'^content_api_queue_requests_total 5$', text, re.MULTILINE)
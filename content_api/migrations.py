@@ -0,0 +1,191 @@
+import os
+import re
+import time
+import psycopg2
+import psycopg2.errors
+
+# Applied migrations by model and migration name
+MIGRATIONS_TABLE = 'schema_migrations'
+
+# Held during a run so that two processes (i.e. deploys) never migrate at once
+ADVISORY_LOCK_ID = 5_143_411
+
+# A migration that waits longer than lock_timeout for a lock gives up (so
+# that queries queued behind it are not stalled) and is retried with backoff
+LOCK_TIMEOUT = os.environ.get('MIGRATION_LOCK_TIMEOUT', '5s')
+STATEMENT_TIMEOUT = os.environ.get('MIGRATION_STATEMENT_TIMEOUT', '5min')
+RETRIES = int(os.environ.get('MIGRATION_RETRIES', 5))
+RETRY_DELAY = float(os.environ.get('MIGRATION_RETRY_DELAY', 1))
+BATCH_SIZE = int(os.environ.get('MIGRATION_BATCH_SIZE', 1000))
+
+RETRY_ERRORS = (psycopg2.errors.LockNotAvailable, psycopg2.errors.DeadlockDetected)
+
+def is_concurrent(sql):
+  # CREATE/DROP INDEX CONCURRENTLY can't run inside a transaction
+  return re.search(r'\bCONCURRENTLY\b', sql, re.IGNORECASE) is not None
+
+def concurrent_index_name(sql):
+  match = re.search(r'\bCREATE\s+(?:UNIQUE\s+)?INDEX\s+CONCURRENTLY\s+(?:IF\s+NOT\s+EXISTS\s+)?([a-zA-Z0-9_]+)', sql, re.IGNORECASE)
+  return match.group(1) if match else None
+
+def backfill_sql(table_name, backfill, batch_size):
+  '''
+    Updates (at most) batch_size of the rows matching where. The where
+    condition is repeated on the outer UPDATE so that a row changed by a
+    concurrent write since it was selected is rechecked, and it has to be
+    false for a row once set has been applied or the backfill never ends.
+    The statement has no parameters (batch_size is inlined) so that set and
+    where can contain % (i.e. url LIKE 'http%').
+  '''
+  where = backfill['where']
+  return f'UPDATE {table_name} SET {backfill["set"]} WHERE id IN (SELECT id FROM {table_name} WHERE {where} LIMIT {int(batch_size)}) AND ({where})'
+
+def migration_type(migration):
+  if 'backfill' in migration:
+    return 'backfill'
+  if migration.get('transaction') == False or is_concurrent(migration['sql']):
+    return 'concurrent'
+  return 'transaction'
+
+def validate_migration(model_name, migration):
+  if not isinstance(migration, dict) or not migration.get('name') or not ('sql' in migration or 'backfill' in migration):
+    raise Exception(f'Invalid migration for model {model_name}, must be a dict with a name and sql or backfill: {migration}')
+  if 'backfill' in migration and not ('set' in migration['backfill'] and 'where' in migration['backfill']):
+    raise Exception(f'Invalid backfill migration {migration["name"]} for model {model_name}, needs set and where')
+  batch_size = migration.get('backfill', {}).get('batch_size', BATCH_SIZE)
+  if not isinstance(batch_size, int) or isinstance(batch_size, bool) or batch_size < 1:
+    raise Exception(f'Invalid backfill migration {migration["name"]} for model {model_name}, batch_size must be a positive integer')
+
+def with_retries(run, description, retries=RETRIES):
+  for attempt in range(retries + 1):
+    try:
+      return run()
+    except RETRY_ERRORS as error:
+      if attempt == retries:
+        raise
+      delay = RETRY_DELAY * 2 ** attempt
+      print(f'{description}: {type(error).__name__}, retrying in {delay}s ({attempt + 1}/{retries})')
+      time.sleep(delay)
+
+def set_timeouts(cur, migration, local, statement_timeout=STATEMENT_TIMEOUT):
+  scope = 'LOCAL ' if local else ''
+  cur.execute(f'SET {scope}lock_timeout = %s', [migration.get('lock_timeout', LOCK_TIMEOUT)])
+  cur.execute(f'SET {scope}statement_timeout = %s', [migration.get('statement_timeout', statement_timeout)])
+
+def in_transaction(conn, migration, run):
+  # Timeouts are SET LOCAL so they end with the transaction
+  conn.autocommit = False
+  try:
+    with conn:
+      cur = conn.cursor()
+      set_timeouts(cur, migration, local=True)
+      return run(cur)
+  finally:
+    if not conn.closed:
+      conn.autocommit = True
+
+def record(cur, model_name, migration, duration):
+  cur.execute(f'INSERT INTO {MIGRATIONS_TABLE} (model, name, duration) VALUES (%s, %s, %s)', [model_name, migration['name'], duration])
+
+def run_transaction(conn, model_name, migration):
+  start = time.monotonic()
+  def run(cur):
+    cur.execute(migration['sql'])
+    # Recorded in the same transaction, the migration is applied once or not at all
+    record(cur, model_name, migration, time.monotonic() - start)
+  with_retries(lambda: in_transaction(conn, migration, run), f'{model_name} {migration["name"]}')
+
+def drop_invalid_index(cur, name):
+  # A failed CREATE INDEX CONCURRENTLY leaves an invalid index behind
+  cur.execute('SELECT 1 FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid WHERE c.relname = %s AND NOT i.indisvalid', [name])
+  if cur.fetchone():
+    cur.execute(f'DROP INDEX CONCURRENTLY IF EXISTS {name}')
+
+def run_concurrent(conn, model_name, migration):
+  '''
+    Runs outside of a transaction (i.e. CREATE INDEX CONCURRENTLY), so a
+    migration that is interrupted before it is recorded runs again and
+    should be idempotent (IF NOT EXISTS)
+  '''
+  start = time.monotonic()
+  cur = conn.cursor()
+  def run():
+    # Index builds take long but only need a lock that doesn't block writes
+    set_timeouts(cur, migration, local=False, statement_timeout='0')
+    try:
+      cur.execute(migration['sql'])
+    except psycopg2.Error:
+      name = concurrent_index_name(migration['sql'])
+      if name:
+        drop_invalid_index(cur, name)
+      raise
+    finally:
+      cur.execute('RESET lock_timeout')
+      cur.execute('RESET statement_timeout')
+  with_retries(run, f'{model_name} {migration["name"]}')
+  record(cur, model_name, migration, time.monotonic() - start)
+
+def run_backfill(conn, model_name, migration):
+  '''
+    Updates batch_size rows per transaction until no rows match where, so
+    that row locks are held briefly. An interrupted backfill continues
+    where it stopped.
+  '''
+  start = time.monotonic()
+  backfill = migration['backfill']
+  batch_size = backfill.get('batch_size', BATCH_SIZE)
+  sql = backfill_sql(backfill.get('table', model_name), backfill, batch_size)
+  def run_batch(cur):
+    cur.execute(sql)
+    return cur.rowcount
+  total = 0
+  while True:
+    count = with_retries(lambda: in_transaction(conn, migration, run_batch), f'{model_name} {migration["name"]}')
+    total += count
+    if count < batch_size:
+      break
+    print(f'{model_name} {migration["name"]}: {total} rows')
+    time.sleep(backfill.get('pause', 0))
+  record(conn.cursor(), model_name, migration, time.monotonic() - start)
+
+MIGRATION_RUNNERS = {
+  'transaction': run_transaction,
+  'concurrent': run_concurrent,
+  'backfill': run_backfill
+}
+
+def applied_migrations(cur):
+  cur.execute(f'SELECT model, name FROM {MIGRATIONS_TABLE}')
+  return set(cur.fetchall())
+
+def migrate(conn, models):
+  '''
+    Runs the db_migrations of the models that have not been applied, in
+    model order and then in list order. Stops at the first migration that
+    fails. Returns the (model name, migration name) tuples applied.
+  '''
+  cur = conn.cursor()
+  cur.execute(f'''
+    CREATE TABLE IF NOT EXISTS {MIGRATIONS_TABLE} (
+      model text NOT NULL,
+      name text NOT NULL,
+      applied_at timestamp NOT NULL DEFAULT now(),
+      duration float,
+      PRIMARY KEY (model, name)
+    )
+  ''')
+  cur.execute('SELECT pg_advisory_lock(%s)', [ADVISORY_LOCK_ID])
+  try:
+    applied = applied_migrations(cur)
+    result = []
+    for model in models:
+      for migration in getattr(model, 'db_migrations', []):
+        validate_migration(model.name, migration)
+        if (model.name, migration['name']) in applied:
+          continue
+        print(f'migration: {model.name} {migration["name"]} ({migration_type(migration)})')
+        MIGRATION_RUNNERS[migration_type(migration)](conn, model.name, migration)
+        result.append((model.name, migration['name']))
+    return result
+  finally:
+    cur.execute('SELECT pg_advisory_unlock(%s)', [ADVISORY_LOCK_ID])
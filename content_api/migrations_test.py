@@ -0,0 +1,62 @@
+import pytest
+import psycopg2
+from types import SimpleNamespace
+from content_api import migrations
+from content_api.db.pg import DATABASE_URL
+from content_api.migrations import is_concurrent, concurrent_index_name, backfill_sql, migration_type, validate_migration
+
+def test_concurrent():
+  sql = 'CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS urls_url_idx ON urls (url)'
+  assert is_concurrent(sql)
+  assert concurrent_index_name(sql) == 'urls_url_idx'
+  assert concurrent_index_name('create index concurrently urls_url_idx on urls (url)') == 'urls_url_idx'
+  assert not is_concurrent('ALTER TABLE urls ADD COLUMN title text')
+  assert concurrent_index_name('DROP INDEX CONCURRENTLY urls_url_idx') == None
+
+def test_migration_type():
+  assert migration_type({'name': '1', 'sql': 'ALTER TABLE urls ADD COLUMN title text'}) == 'transaction'
+  assert migration_type({'name': '2', 'sql': 'CREATE INDEX CONCURRENTLY urls_title_idx ON urls (title)'}) == 'concurrent'
+  assert migration_type({'name': '3', 'sql': 'VACUUM urls', 'transaction': False}) == 'concurrent'
+  assert migration_type({'name': '4', 'backfill': {'set': 'title = url', 'where': 'title IS NULL'}}) == 'backfill'
+
+def test_backfill_sql():
+  assert backfill_sql('urls', {'set': 'title = url', 'where': 'title IS NULL'}, 100) == \
+    'UPDATE urls SET title = url WHERE id IN (SELECT id FROM urls WHERE title IS NULL LIMIT 100) AND (title IS NULL)'
+
+def test_validate_migration():
+  validate_migration('urls', {'name': '1', 'sql': 'ALTER TABLE urls ADD COLUMN title text'})
+  with pytest.raises(Exception):
+    validate_migration('urls', 'ALTER TABLE urls ADD COLUMN title text')
+  with pytest.raises(Exception):
+    validate_migration('urls', {'sql': 'ALTER TABLE urls ADD COLUMN title text'})
+  with pytest.raises(Exception):
+    validate_migration('urls', {'name': '2', 'backfill': {'set': 'title = url'}})
+  with pytest.raises(Exception):
+    validate_migration('urls', {'name': '2', 'backfill': {'set': 'title = url', 'where': 'title IS NULL', 'batch_size': '10; drop table urls'}})
+
+@pytest.fixture
+def conn(monkeypatch):
+  try:
+    conn = psycopg2.connect(DATABASE_URL)
+  except psycopg2.OperationalError:
+    pytest.skip('PostgreSQL is not available')
+  conn.autocommit = True
+  # Temporary tables, dropped with the connection
+  monkeypatch.setattr(migrations, 'MIGRATIONS_TABLE', 'test_migrations')
+  cur = conn.cursor()
+  cur.execute('CREATE TEMPORARY TABLE test_migrations (model text NOT NULL, name text NOT NULL, applied_at timestamp NOT NULL DEFAULT now(), duration float, PRIMARY KEY (model, name))')
+  cur.execute('CREATE TEMPORARY TABLE backfill_test (id serial PRIMARY KEY, url text, secure boolean)')
+  yield conn
+  conn.close()
+
+def test_backfill_percent(conn):
+  # % in set and where is not taken for a parameter
+  cur = conn.cursor()
+  cur.execute("INSERT INTO backfill_test (url) SELECT CASE WHEN i % 2 = 0 THEN 'https' ELSE 'http' END || '://a.com/' || i FROM generate_series(1, 5) i")
+  cur.execute("INSERT INTO backfill_test (url) VALUES ('ftp://a.com')")
+  model = SimpleNamespace(name='backfill_test', db_migrations=[
+    {'name': '0001_secure', 'backfill': {'set': "secure = url LIKE 'https%'", 'where': "secure IS NULL AND url LIKE 'http%'", 'batch_size': 2}}
+  ])
+  assert migrations.migrate(conn, [model]) == [('backfill_test', '0001_secure')]
+  cur.execute('SELECT secure, count(*) FROM backfill_test GROUP BY secure ORDER BY secure')
+  assert cur.fetchall() == [(False, 3), (True, 2), (None, 1)]
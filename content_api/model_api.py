@@ -1,15 +1,34 @@
+import os
 import re
-from datetime import datetime
+import json
+import base64
+from datetime import datetime, date
+from functools import wraps
 from content_api.json_schema import validate_schema, schema_error_response, coerce_value, writable_doc
 from types import SimpleNamespace
 from content_api.db import db
+from content_api.cache import TTLCache
+from content_api.export import EXPORT_FORMATS, export_stream
+from content_api.etag import doc_etag, docs_etag, is_not_modified
+from content_api.entity_cache import make_entity_cache, with_entity_cache
 import content_api.util as util
-from content_api.util import exception_response, invalid_response, remove_none
-from psycopg2.errors import UniqueViolation, ForeignKeyViolation
+from content_api.util import exception_response, invalid_response, invalid_items_response, remove_none
+
+COUNT_MODES = ['exact', 'estimate', 'none']
+
+# Short lived cache of the estimate mode list counts per table and filter,
+# exact counts are not cached since the writes of other processes don't
+# invalidate it
+count_cache = TTLCache(
+  max_size=int(os.environ.get('COUNT_CACHE_SIZE', 1000)),
+  ttl=float(os.environ.get('COUNT_CACHE_TTL', 5)))
 
 def empty_decorator(operation):
   return operation
 
+def unchanged_values(doc, id=None):
+  return doc
+
 def is_valid_sort(json_schema, sort):
   if not sort:
     return True
@@ -19,6 +38,66 @@ def is_valid_sort(json_schema, sort):
       return False
   return True
 
+def is_valid_fields(json_schema, fields):
+  if not fields:
+    return True
+  return all(name in json_schema['properties'].keys() for name in fields.split(','))
+
+def query_fields(json_schema, fields, sort=None):
+  '''
+    The fields to read from the database for a fields parameter (None for
+    all fields). Besides the requested fields these are the id and
+    updated_at that the ETag is computed from and the sort key of the cursor.
+  '''
+  if not fields:
+    return None
+  names = ['id', *fields.split(','), *(['updated_at'] if 'updated_at' in json_schema['properties'] else []), *(sort_names(sort) if sort else [])]
+  return tuple(dict.fromkeys(names))
+
+def project(doc, fields):
+  if not fields:
+    return doc
+  return {name: doc[name] for name in fields.split(',') if name in doc}
+
+def sort_names(sort):
+  return [item[1:] if item.startswith('-') else item for item in sort.split(',')]
+
+def seek_sort(sort):
+  '''
+    Appends id as a tiebreaker to the sort so that the sort order is total,
+    which is needed for cursor (keyset) pagination
+  '''
+  if 'id' in sort_names(sort):
+    return sort
+  direction = '-' if sort.split(',')[-1].startswith('-') else ''
+  return f'{sort},{direction}id'
+
+def cursor_json_value(value):
+  if isinstance(value, (datetime, date)):
+    return value.isoformat()
+  return str(value)
+
+def encode_cursor(sort, doc):
+  values = [doc.get(name) for name in sort_names(sort)]
+  data = json.dumps({'sort': sort, 'values': values}, default=cursor_json_value)
+  return base64.urlsafe_b64encode(data.encode('utf-8')).decode('ascii').rstrip('=')
+
+def decode_cursor(json_schema, sort, cursor):
+  '''
+    Returns the sort key values encoded in the cursor (coerced to their
+    JSON schema types) or None if the cursor is invalid or for another sort
+  '''
+  try:
+    data = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    names = sort_names(sort)
+    if data['sort'] != sort or len(data['values']) != len(names):
+      return None
+    properties = json_schema['properties']
+    return tuple(coerce_value(value, properties.get(name)) if isinstance(value, str) else value
+      for name, value in zip(names, data['values']))
+  except Exception:
+    return None
+
 def filter_param_pattern(json_schema):
   property_names = json_schema['properties'].keys()
   return f'^filter\\.({"|".join(property_names)})(?:\\[(contains|lt|gt)\\])?$'
@@ -37,12 +116,29 @@ def parse_filter(json_schema, query):
       }
   return result
 
+def filter_key(filter):
+  return tuple(sorted((name, f['op'], f['value']) for name, f in filter.items()))
+
 def make_model_api(table_name, json_schema,
   list_decorator=empty_decorator,
   get_decorator=empty_decorator,
   create_decorator=empty_decorator,
   update_decorator=empty_decorator,
-  delete_decorator=empty_decorator):
+  delete_decorator=empty_decorator,
+  export_decorator=empty_decorator,
+  bulk_create_decorator=empty_decorator,
+  bulk_update_decorator=empty_decorator,
+  bulk_delete_decorator=empty_decorator,
+  entity_cache=None,
+  write_values=unchanged_values):
+  '''
+    write_values(doc, id) returns the values to write for the writable
+    values of a create (id is None) or an update, i.e. to set columns that
+    are not writable in the same write
+  '''
+
+  cache = make_entity_cache(table_name, entity_cache)
+  database = with_entity_cache(db, cache) if cache else db
 
   def response_schema(operation):
     if operation == 'list':
@@ -54,17 +150,80 @@ def make_model_api(table_name, json_schema,
             'items': json_schema
           },
           'count': {'type': 'integer'},
+          'count_mode': {'type': 'string', 'enum': COUNT_MODES},
           'limit': {'type': 'integer'},
           'offset': {'type': 'integer'},
           'sort': {'type': 'string'},
-          'filter': {'type': 'object'}
+          'fields': {'type': 'string'},
+          'filter': {'type': 'object'},
+          'cursor': {'type': 'string'},
+          'next_cursor': {'type': 'string'}
+        },
+        'additionalProperties': False,
+        'required': ['data', 'count_mode', 'limit', 'offset']
+      }
+    elif operation.startswith('bulk_'):
+      return {
+        'type': 'object',
+        'properties': {
+          'data': {
+            'type': 'array',
+            'items': json_schema
+          },
+          'count': {'type': 'integer'},
+          'not_found': {
+            'type': 'array',
+            'items': json_schema['properties']['id']
+          }
         },
         'additionalProperties': False,
-        'required': ['data', 'count', 'limit', 'offset']
+        'required': ['data', 'count']
       }
     else:
       return json_schema
 
+  def with_create_timestamps(data, now):
+    if 'created_at' in json_schema['properties'] and 'updated_at' in json_schema['properties']:
+      return {**data, 'created_at': now, 'updated_at': now}
+    return data
+
+  def with_update_timestamp(data, now):
+    if 'updated_at' in json_schema['properties']:
+      return {**data, 'updated_at': now}
+    return data
+
+  def list_page(limit, offset, sort, filter, after, count_mode, fields=None):
+    '''
+      Returns the docs, the count and the count mode that produced it. The
+      estimate mode falls back to an exact count if the database can't
+      estimate. Exact counts of offset pages come with the docs in one
+      query if the database supports it. Estimates are cached for
+      COUNT_CACHE_TTL seconds.
+    '''
+    def find():
+      return database.find(table_name, limit, offset, sort, filter, after=after, fields=fields)
+    if count_mode == 'none':
+      return (find(), None, count_mode)
+    key = (table_name, filter_key(filter))
+    cached = count_cache.get(key) if count_mode == 'estimate' else None
+    if cached:
+      return (find(), *cached)
+    if count_mode == 'exact' and after is None and hasattr(database, 'find_with_count'):
+      # A cursor page can't be counted by the same query since the seek
+      # predicate excludes the rows before it
+      (docs, count) = database.find_with_count(table_name, limit, offset, sort, filter, fields=fields)
+      result = (count, count_mode)
+    else:
+      count = database.estimate_count(table_name, filter) if count_mode == 'estimate' else None
+      result = (count, count_mode) if count is not None else (database.count(table_name, filter), 'exact')
+      docs = find()
+    if count_mode == 'estimate':
+      count_cache.set(key, result)
+    return (docs, *result)
+
+  def invalidate_counts():
+    count_cache.clear(lambda key: key[0] == table_name)
+
   @list_decorator
   def list(request):
       limit = int(util.get(request, 'query.limit', 100))
@@ -72,78 +231,174 @@ def make_model_api(table_name, json_schema,
       sort = util.get(request, 'query.sort') or '-updated_at'
       if not is_valid_sort(json_schema, sort):
         return invalid_response('Invalid sort parameter, must be on the format column1,column2,column3... For descending sort, use -column1')
+      fields = util.get(request, 'query.fields') or None
+      if not is_valid_fields(json_schema, fields):
+        return invalid_response('Invalid fields parameter, must be on the format column1,column2,column3...')
+      count_mode = util.get(request, 'query.count') or 'exact'
+      if count_mode not in COUNT_MODES:
+        return invalid_response(f'Invalid count parameter, must be one of {", ".join(COUNT_MODES)}')
       filter = parse_filter(json_schema, request.get('query', {}))
-      count = db.count(table_name, filter)
-      docs = [remove_none(doc) for doc in db.find(table_name, limit, offset, sort, filter)]
-      body = {
+      db_sort = seek_sort(sort)
+      cursor = util.get(request, 'query.cursor')
+      after = None
+      if cursor:
+        after = decode_cursor(json_schema, db_sort, cursor)
+        if after is None:
+          return invalid_response('Invalid cursor parameter, must be the next_cursor value of a previous list response with the same sort')
+        offset = 0
+      (docs, count, count_mode) = list_page(limit, offset, db_sort, filter, after, count_mode, query_fields(json_schema, fields, db_sort))
+      meta = remove_none({
         'count': count,
+        'count_mode': count_mode,
         'limit': limit,
         'offset': offset,
         'sort': sort,
+        'fields': fields,
         'filter': filter,
-        'data': docs
-      }
-      return {'body': body}
+        'cursor': cursor or None
+      })
+      if docs and len(docs) == limit:
+        meta['next_cursor'] = encode_cursor(db_sort, docs[-1])
+      # The ETag is computed (and a 304 decided) without serializing the body
+      headers = {'ETag': docs_etag(docs, meta)}
+      if is_not_modified(request, headers['ETag']):
+        return {'status': 304, 'headers': headers}
+      return {'body': {**meta, 'data': [remove_none(project(doc, fields)) for doc in docs]}, 'headers': headers}
 
   @get_decorator
   def get(request):
       id = request.get('path_params')['id']
-      doc = db.find_one(table_name, id)
+      fields = util.get(request, 'query.fields') or None
+      if not is_valid_fields(json_schema, fields):
+        return invalid_response('Invalid fields parameter, must be on the format column1,column2,column3...')
+      doc = database.find_one(table_name, id, fields=query_fields(json_schema, fields))
       if not doc:
           return {'status': 404}
-      return {'body': remove_none(doc)}
+      headers = {'ETag': doc_etag(doc, fields)}
+      if is_not_modified(request, headers['ETag']):
+        return {'status': 304, 'headers': headers}
+      return {'body': remove_none(project(doc, fields)), 'headers': headers}
 
   @create_decorator
   def create(request):
-      data = writable_doc(json_schema, request.get('body'))
-      if 'created_at' in json_schema['properties'] and 'updated_at' in json_schema['properties']:
-        now = datetime.now()
-        data = {**data, 'created_at': now, 'updated_at': now}
+      data = with_create_timestamps(write_values(writable_doc(json_schema, request.get('body'))), datetime.now())
       try:
-        id = db.create(table_name, data)
-        created_doc = db.find_one(table_name, id)
-        return {'body': remove_none(created_doc)}
-      except (UniqueViolation, ForeignKeyViolation) as db_error:
+        created_doc = database.create_returning(table_name, data)
+      except database.integrity_errors as db_error:
           return exception_response(db_error)
+      invalidate_counts()
+      return {'body': remove_none(created_doc)}
 
   @update_decorator
   def update(request):
       id = request.get('path_params')['id']
-      data = writable_doc(json_schema, request.get('body'))
+      data = write_values(writable_doc(json_schema, request.get('body')), id)
       try:
-        if 'updated_at' in json_schema['properties']:
-          data = {**data, 'updated_at': datetime.now()}
-        db.update(table_name, id, data)
-      except (UniqueViolation, ForeignKeyViolation) as db_error:
+        updated_doc = database.update_returning(table_name, id, with_update_timestamp(data, datetime.now()))
+      except database.integrity_errors as db_error:
           return exception_response(db_error)
-      updated_doc = db.find_one(table_name, id)
       if not updated_doc:
           return {'status': 404}
+      invalidate_counts()
       return {'body': remove_none(updated_doc)}
 
   @delete_decorator
   def delete(request):
       id = request.get('path_params')['id']
-      doc = db.find_one(table_name, id)
+      try:
+        doc = database.delete_returning(table_name, id)
+      except database.integrity_errors as db_error:
+          return exception_response(db_error)
       if not doc:
           return {'status': 404}
-      db.delete(table_name, id)
+      invalidate_counts()
       return {'body': remove_none(doc)}
 
+  @export_decorator
+  def export(request):
+      format = util.get(request, 'query.format') or 'ndjson'
+      if format not in EXPORT_FORMATS:
+        return invalid_response(f'Invalid format parameter, must be one of {", ".join(EXPORT_FORMATS.keys())}')
+      sort = util.get(request, 'query.sort') or 'id'
+      if not is_valid_sort(json_schema, sort):
+        return invalid_response('Invalid sort parameter, must be on the format column1,column2,column3... For descending sort, use -column1')
+      filter = parse_filter(json_schema, request.get('query', {}))
+      docs = (remove_none(doc) for doc in database.find_iter(table_name, seek_sort(sort), filter))
+      headers = {
+        'Content-Type': EXPORT_FORMATS[format],
+        'Content-Disposition': f'attachment; filename="{table_name}.{format}"'
+      }
+      return {'stream': export_stream(format, docs, [*json_schema['properties'].keys()]), 'headers': headers}
+
+  def bulk_response(docs, ids=None):
+    body = {'count': len(docs), 'data': [remove_none(doc) for doc in docs]}
+    if ids is not None:
+      found_ids = set(doc['id'] for doc in docs)
+      not_found = [id for id in ids if id not in found_ids]
+      if not_found:
+        body['not_found'] = not_found
+    return {'body': body}
+
+  @bulk_create_decorator
+  def bulk_create(request):
+      now = datetime.now()
+      docs = [with_create_timestamps(write_values(writable_doc(json_schema, doc)), now) for doc in request.get('body')]
+      try:
+        created_docs = database.create_many(table_name, docs)
+      except database.integrity_errors as db_error:
+          return exception_response(db_error)
+      invalidate_counts()
+      return bulk_response(created_docs)
+
+  @bulk_update_decorator
+  def bulk_update(request):
+      now = datetime.now()
+      writable_docs = [{k: v for k, v in writable_doc(json_schema, doc).items() if k != 'id'} for doc in request.get('body')]
+      empty = [(index, 'No columns to update') for index, doc in enumerate(writable_docs) if not doc]
+      if empty:
+        return invalid_items_response(empty)
+      docs = [{**with_update_timestamp(write_values(doc, item['id']), now), 'id': item['id']} for doc, item in zip(writable_docs, request.get('body'))]
+      ids = [doc['id'] for doc in docs]
+      if len(set(ids)) != len(ids):
+        return invalid_response('Each id can only be updated once per request')
+      try:
+        updated_docs = database.update_many(table_name, docs)
+      except database.integrity_errors as db_error:
+          return exception_response(db_error)
+      invalidate_counts()
+      return bulk_response(updated_docs, ids)
+
+  @bulk_delete_decorator
+  def bulk_delete(request):
+      ids = request.get('body')
+      try:
+        deleted_docs = database.delete_many(table_name, ids)
+      except database.integrity_errors as db_error:
+          return exception_response(db_error)
+      invalidate_counts()
+      return bulk_response(deleted_docs, ids)
+
   api = {
     'response_schema': response_schema,
     'list': list,
     'get': get,
     'create': create,
     'update': update,
-    'delete': delete
+    'delete': delete,
+    'export': export,
+    'bulk_create': bulk_create,
+    'bulk_update': bulk_update,
+    'bulk_delete': bulk_delete,
+    # The database interface of the handlers (with the entity cache if any)
+    # for writes outside of requests that should invalidate the cache
+    'database': database
   }
   return SimpleNamespace(**api)
 
 def empty_validate(request):
   return None
 
-def make_model_api_with_validation(name, json_schema, validate=empty_validate):
+def make_model_api_with_validation(name, json_schema, validate=empty_validate, entity_cache=None, write_values=unchanged_values):
   def create_with_validation(_create):
     def create(request):
       invalid_message = validate(request)
@@ -160,6 +415,20 @@ def make_model_api_with_validation(name, json_schema, validate=empty_validate):
       return _update(request)
     return update
 
+  def bulk_with_validation(_bulk):
+    @wraps(_bulk)
+    def bulk(request):
+      item_messages = [(index, validate({**request, 'body': doc})) for index, doc in enumerate(request.get('body') or [])]
+      item_messages = [(index, message) for index, message in item_messages if message]
+      if item_messages:
+        return invalid_items_response(item_messages)
+      return _bulk(request)
+    return bulk
+
   return make_model_api(name, json_schema,
     create_decorator=create_with_validation,
-    update_decorator=update_with_validation)
+    update_decorator=update_with_validation,
+    bulk_create_decorator=bulk_with_validation,
+    bulk_update_decorator=bulk_with_validation,
+    entity_cache=entity_cache,
+    write_values=write_values)
@@ -0,0 +1,42 @@
+from datetime import datetime
+from content_api.model_api import seek_sort, encode_cursor, decode_cursor, is_valid_fields, query_fields, project
+
+json_schema = {
+  'type': 'object',
+  'properties': {
+    'id': {'type': 'integer'},
+    'url': {'type': 'string'},
+    'created_at': {'type': 'string', 'format': 'date-time'}
+  }
+}
+
+def test_seek_sort():
+  assert seek_sort('created_at') == 'created_at,id'
+  assert seek_sort('-created_at') == '-created_at,-id'
+  assert seek_sort('url,-created_at') == 'url,-created_at,-id'
+  assert seek_sort('-id') == '-id'
+  assert seek_sort('id,url') == 'id,url'
+
+def test_cursor():
+  created_at = datetime(2023, 12, 2, 9, 31, 28, 92946)
+  doc = {'id': 5, 'url': 'https://www.google.com', 'created_at': created_at}
+  sort = '-created_at,-id'
+  cursor = encode_cursor(sort, doc)
+  assert isinstance(cursor, str)
+  assert decode_cursor(json_schema, sort, cursor) == (created_at, 5)
+  assert decode_cursor(json_schema, 'created_at,id', cursor) == None
+  assert decode_cursor(json_schema, sort, 'foobar') == None
+  assert decode_cursor(json_schema, sort, cursor[:-2]) == None
+
+def test_fields():
+  assert is_valid_fields(json_schema, None)
+  assert is_valid_fields(json_schema, 'url,created_at')
+  assert not is_valid_fields(json_schema, 'url,foo')
+  assert not is_valid_fields(json_schema, 'url,')
+  assert query_fields(json_schema, None) == None
+  # id for the ETag and the sort key for the cursor are always read
+  assert query_fields(json_schema, 'url') == ('id', 'url')
+  assert query_fields(json_schema, 'url,id', '-created_at,-id') == ('id', 'url', 'created_at')
+  doc = {'id': 5, 'url': 'https://www.google.com', 'created_at': datetime(2023, 12, 2)}
+  assert project(doc, 'url') == {'url': 'https://www.google.com'}
+  assert project(doc, None) == doc
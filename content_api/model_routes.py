@@ -1,5 +1,6 @@
 from content_api.db import db
-from content_api.model_api import filter_param_pattern
+from content_api.model_api import filter_param_pattern, COUNT_MODES
+from content_api.export import EXPORT_FORMATS
 
 id_parameter = {
     'name': 'id',
@@ -8,6 +9,14 @@ id_parameter = {
     'schema': db.id_json_schema
 }
 
+fields_parameter = {
+    'name': 'fields',
+    'in': 'query',
+    'required': False,
+    'schema': {'type': 'string'},
+    'description': 'Comma separated list of the fields to return (column1,column2,column3...), all fields by default. Only the needed columns are read from the database.'
+}
+
 def list_parameters(json_schema):
     return [
         {
@@ -29,6 +38,21 @@ def list_parameters(json_schema):
             'schema': {'type': 'string'},
             'description': 'Sort order on the format column1,column2,column3... For descending sort, use -column1'
         },
+        fields_parameter,
+        {
+            'name': 'cursor',
+            'in': 'query',
+            'required': False,
+            'schema': {'type': 'string'},
+            'description': 'Cursor (keyset) pagination, pass the next_cursor value of the previous page (with the same sort and filter) to get the next page. Unlike offset this does not scan the skipped rows. The offset parameter is ignored when a cursor is given.'
+        },
+        {
+            'name': 'count',
+            'in': 'query',
+            'required': False,
+            'schema': {'type': 'string', 'enum': COUNT_MODES},
+            'description': 'How to count the total number of rows matching the filter: exact (default), estimate (from database statistics, cheap on large tables) or none (no count). The count_mode in the response tells which mode produced the count.'
+        },
         {
             'name': 'filter',
             'in': 'query',
@@ -41,11 +65,46 @@ def list_parameters(json_schema):
         }
     ]
 
-default_route_names = ['list', 'get', 'create', 'update', 'delete']
+def export_parameters(json_schema):
+    return [
+        {
+            'name': 'format',
+            'in': 'query',
+            'required': False,
+            'schema': {'type': 'string', 'enum': [*EXPORT_FORMATS.keys()]},
+            'description': 'Export format, ndjson (newline delimited JSON, default) or csv'
+        },
+        *[p for p in list_parameters(json_schema) if p['name'] in ['sort', 'filter']]
+    ]
+
+BULK_MAX_ITEMS = 1000
+
+def writable_id_schema():
+    return {k: v for k, v in db.id_json_schema.items() if k != 'x-meta'}
+
+def bulk_request_schema(items_schema):
+    return {
+        'type': 'array',
+        'items': items_schema,
+        'minItems': 1,
+        'maxItems': BULK_MAX_ITEMS
+    }
+
+def bulk_update_item_schema(json_schema):
+    # Like the update schema but with the (otherwise not writable) id required
+    return {
+        **json_schema,
+        'properties': {**json_schema['properties'], 'id': writable_id_schema()},
+        'required': ['id'] + [r for r in json_schema.get('required', []) if r != 'id']
+    }
+
+default_route_names = ['list', 'get', 'create', 'update', 'delete', 'export', 'bulk_create', 'bulk_update', 'bulk_delete']
 
 def get_model_routes(name, json_schema, api, route_names = default_route_names):
     list_path = f'/v1/{name}'
     get_path = f'/v1/{name}/<id>'
+    bulk_path = f'/v1/{name}/_bulk'
+    export_path = f'/v1/{name}/_export'
     all_routes = [
         {
             'method': 'GET',
@@ -56,6 +115,43 @@ def get_model_routes(name, json_schema, api, route_names = default_route_names):
             'parameters': list_parameters(json_schema),
             'response_schema': api.response_schema('list')
         },
+        # NOTE: export and bulk routes need to come before the get_path routes
+        # for Tornado where paths are matched in order
+        {
+            'method': 'GET',
+            'path': export_path,
+            'name': 'export',
+            'handler': api.export,
+            'model_name': name,
+            'parameters': export_parameters(json_schema)
+        },
+        {
+            'method': 'POST',
+            'path': bulk_path,
+            'name': 'bulk_create',
+            'handler': api.bulk_create,
+            'model_name': name,
+            'request_schema': bulk_request_schema(json_schema),
+            'response_schema': api.response_schema('bulk_create')
+        },
+        {
+            'method': 'PUT',
+            'path': bulk_path,
+            'name': 'bulk_update',
+            'handler': api.bulk_update,
+            'model_name': name,
+            'request_schema': bulk_request_schema(bulk_update_item_schema(json_schema)),
+            'response_schema': api.response_schema('bulk_update')
+        },
+        {
+            'method': 'DELETE',
+            'path': bulk_path,
+            'name': 'bulk_delete',
+            'handler': api.bulk_delete,
+            'model_name': name,
+            'request_schema': {**bulk_request_schema(writable_id_schema()), 'uniqueItems': True},
+            'response_schema': api.response_schema('bulk_delete')
+        },
         {
             'method': 'GET',
             'path': get_path,
@@ -63,7 +159,8 @@ def get_model_routes(name, json_schema, api, route_names = default_route_names):
             'handler': api.get,
             'model_name': name,
             'parameters': [
-                id_parameter
+                id_parameter,
+                fields_parameter
             ],
             'response_schema': api.response_schema('get')
         },
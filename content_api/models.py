@@ -7,15 +7,19 @@ from content_api.db import db
 from content_api.model_api import make_model_api
 from content_api.model_routes import get_model_routes, default_route_names
 from content_api.request_validation import decorate_handler_with_validation
+from content_api.indexes import model_indexes, warn_unindexed
+from content_api.migrations import migrate
+from content_api.metrics import with_metrics
 
 def set_route_defaults(route, name):
-  return {
+  route = {
     **route,
     'method': route.get('method', 'GET'),
     'name': route.get('name', route['handler'].__name__),
-    'model_name': name,
-    'handler': decorate_handler_with_validation(route)
+    'model_name': name
   }
+  # Timed outermost so that validation failures are counted too, see content_api/metrics.py
+  return {**route, 'handler': with_metrics(route, decorate_handler_with_validation(route))}
 
 def set_model_defaults(default_name, model):
   if not 'name' in dir(model):
@@ -23,10 +27,16 @@ def set_model_defaults(default_name, model):
   if 'routes' not in dir(model):
     if not ('db_schema' in dir(model) and 'json_schema' in dir(model)):
       raise Exception(f'You need to specify db_schema and json_schema for model {name}')
-    setattr(model, 'api', make_model_api(model.name, model.json_schema))
+    setattr(model, 'api', make_model_api(model.name, model.json_schema, entity_cache=getattr(model, 'entity_cache', None)))
     route_names = model.route_names if 'route_names' in dir(model) else default_route_names
     setattr(model, 'routes', get_model_routes(model.name, model.json_schema, model.api, route_names=route_names))
   setattr(model, 'routes', [set_route_defaults(route, model.name) for route in model.routes])
+  if 'db_schema' in dir(model) and hasattr(db, 'define_table'):
+    # The in-memory backend applies the column defaults of the schema
+    db.define_table(model.name, model.db_schema)
+  if 'json_schema' in dir(model):
+    # The declared indexes and indexed json_schema properties, see content_api/indexes.py
+    setattr(model, 'db_indexes', model_indexes(model.name, model.json_schema, getattr(model, 'indexes', [])))
   return model
 
 def module_name(filename):
@@ -47,25 +57,57 @@ def all_models():
     models.append(model)
   return models
 
+def create_indexes(models):
+  for model in models:
+    for index in getattr(model, 'db_indexes', []):
+      try:
+        print(f'index: {index["name"]}')
+        db.create_index(model.name, index)
+      except:
+        error = sys.exc_info()[0]
+        print(f'Could not create index {index["name"]} for model {model.name}', error)
+        traceback.print_exc()
+
 def create_schema():
   models = [model for model in all_models() if 'db_schema' in dir(model)]
   for model in models:
     try:
       print(f'model: {model.name}')
       print(model.db_schema)
-      db.conn.cursor().execute(model.db_schema)
+      if hasattr(db, 'execute_schema'):
+        db.execute_schema(model.db_schema)
+      elif hasattr(db, 'execute'):
+        db.execute(model.db_schema)
     except:
       error = sys.exc_info()[0]
       print(f'Could not create schema for model {model.name}', error)
       traceback.print_exc()
+  create_indexes(models)
 
 def migrate_schema():
-  # TODO: create db_migrations table if not exists
-  # TODO: For each model, run any migrations not run (wrapped in a try/catch)
-  pass
+  '''
+    Runs the db_migrations of all models that have not been run yet (see
+    content_api/migrations.py) and then creates any declared indexes that
+    don't exist
+  '''
+  if not hasattr(db, 'pool'):
+    raise Exception('Migrations are only supported with PostgreSQL')
+  models = [model for model in all_models() if 'db_schema' in dir(model)]
+  with db.pool.connection() as conn:
+    applied = migrate(conn, models)
+  print(f'Applied {len(applied)} migrations')
+  create_indexes(models)
+  return applied
+
+def check_indexes(models):
+  for model in models:
+    if 'db_schema' in dir(model) and 'db_indexes' in dir(model) and any(route['name'] == 'list' for route in model.routes):
+      warn_unindexed(model.name, model.json_schema, model.db_indexes, model.db_schema)
 
 def all_model_routes():
   routes = []
-  for model in all_models():
+  models = all_models()
+  for model in models:
       routes += model.routes
+  check_indexes(models)
   return routes
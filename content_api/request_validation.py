@@ -1,5 +1,5 @@
-from content_api.json_schema import validate_schema, schema_error_response, writable_schema, writable_doc, coerce_values
-from content_api.util import get, invalid_response
+from content_api.json_schema import compile_schema, validate_compiled, schema_error_response, schema_errors_response, writable_schema, writable_doc, coerce_values, is_array_schema
+from content_api.util import get, omit, invalid_response
 from functools import wraps
 
 def parameters_schema(parameters, source):
@@ -17,31 +17,61 @@ def parameters_schema(parameters, source):
     'additionalProperties': additional_properties
   }
 
-def validate_parameters(route, request):
+def compile_parameters(route):
   if 'parameters' not in route:
-    return None
+    return []
   sources = {'query': 'query', 'path': 'path_params', 'header': 'headers'}
+  compiled = []
   for source, arg_name in sources.items():
     parameters_in = [p for p in route['parameters'] if p['in'] == source]
     schema = parameters_schema(parameters_in, source)
     if schema:
-      values = coerce_values(request.get(arg_name, {}), schema)
-      schema_error = validate_schema(values, schema)
-      if schema_error:
-        return schema_error
+      compiled.append((arg_name, schema, compile_schema(schema)))
+  return compiled
+
+def validate_parameters(compiled_parameters, request):
+  for arg_name, schema, validator in compiled_parameters:
+    values = coerce_values(request.get(arg_name, {}), schema)
+    schema_error = validate_compiled(values, validator)
+    if schema_error:
+      return schema_error
+
+def compile_request_schema(data_schema):
+  '''
+    Returns a (validator, items_validator) tuple. Arrays are validated
+    without their items first and then item by item so that errors can
+    be reported per item.
+  '''
+  if not data_schema:
+    return (None, None)
+  write_schema = writable_schema(data_schema)
+  if is_array_schema(write_schema):
+    return (compile_schema(omit(write_schema, ['items'])), compile_schema(write_schema['items']))
+  return (compile_schema(write_schema), None)
+
+def validate_items(data, items_validator):
+  item_errors = [(index, validate_compiled(item, items_validator)) for index, item in enumerate(data)]
+  return [(index, error) for index, error in item_errors if error]
 
 def decorate_handler_with_validation(route):
-  @wraps(route['handler'])
+  # Schemas and validators are built once per route, not per request
+  compiled_parameters = compile_parameters(route)
+  data_schema = route.get('request_schema')
+  (data_validator, items_validator) = compile_request_schema(data_schema)
+  handler = route['handler']
+  @wraps(handler)
   def handler_with_validation(request):
-    schema_error = validate_parameters(route, request)
+    schema_error = validate_parameters(compiled_parameters, request)
     if schema_error:
       return schema_error_response(schema_error)
-    data_schema = route.get('request_schema')
-    if data_schema:
-      write_schema = writable_schema(data_schema)
+    if data_validator:
       data = writable_doc(data_schema, request.get('body'))
-      schema_error = validate_schema(data, write_schema)
+      schema_error = validate_compiled(data, data_validator)
       if schema_error:
         return schema_error_response(schema_error)
-    return route['handler'](request)
+      if items_validator:
+        item_errors = validate_items(data, items_validator)
+        if item_errors:
+          return schema_errors_response(item_errors)
+    return handler(request)
   return handler_with_validation
@@ -0,0 +1,50 @@
+import os
+import json
+from datetime import date
+from decimal import Decimal
+
+try:
+  import orjson
+except ImportError:
+  orjson = None
+
+try:
+  from bson.objectid import ObjectId
+except ImportError:
+  ObjectId = None
+
+# orjson (if installed) or json, set JSON_BACKEND=json to force the standard library
+JSON_BACKEND = os.environ.get('JSON_BACKEND', 'orjson' if orjson else 'json')
+
+def default(obj):
+  if isinstance(obj, date): # ISO date formating
+    return obj.isoformat()
+  if isinstance(obj, Decimal):
+    # A string since a float can't represent every decimal (i.e. numeric columns)
+    return str(obj)
+  if ObjectId and isinstance(obj, ObjectId):
+    return str(obj)
+  raise TypeError(f'Object of type {type(obj).__name__} is not JSON serializable')
+
+def dumps(data, pretty=False):
+  '''
+    Serializes data to compact UTF-8 encoded JSON bytes, or indented JSON
+    if pretty is set
+  '''
+  if JSON_BACKEND == 'orjson':
+    option = orjson.OPT_NON_STR_KEYS | (orjson.OPT_INDENT_2 if pretty else 0)
+    return orjson.dumps(data, default=default, option=option)
+  if pretty:
+    return json.dumps(data, default=default, indent=2, ensure_ascii=False).encode('utf-8')
+  return json.dumps(data, default=default, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+
+def split_pretty(query):
+  '''
+    Responses are pretty printed on request with the pretty query parameter
+    (i.e. ?pretty or ?pretty=1), which is removed from the query that is
+    passed to the handler. Returns a (query, pretty) tuple.
+  '''
+  if 'pretty' not in query:
+    return (query, False)
+  pretty = query['pretty'] not in ['0', 'false']
+  return ({k: v for k, v in query.items() if k != 'pretty'}, pretty)
@@ -0,0 +1,56 @@
+import json
+from datetime import date, datetime
+from decimal import Decimal
+from bson.objectid import ObjectId
+import content_api.serialization as serialization
+from content_api.serialization import dumps, split_pretty
+
+data = {
+  'id': 1,
+  'title': 'Räksmörgås',
+  'created_at': datetime(2023, 12, 2, 9, 31, 28, 92946),
+  'date': date(2023, 12, 2),
+  'price': Decimal('9.95'),
+  'amount': Decimal('10'),
+  'balance': Decimal('12345678901234567890.123456789'),
+  'object_id': ObjectId('5f299b3e9cd7d821d2b898c1'),
+  'tags': ['a', None]
+}
+
+expected = {
+  'id': 1,
+  'title': 'Räksmörgås',
+  'created_at': '2023-12-02T09:31:28.092946',
+  'date': '2023-12-02',
+  'price': '9.95',
+  'amount': '10',
+  'balance': '12345678901234567890.123456789',
+  'object_id': '5f299b3e9cd7d821d2b898c1',
+  'tags': ['a', None]
+}
+
+def test_dumps(monkeypatch):
+  for backend in ['json', 'orjson'] if serialization.orjson else ['json']:
+    monkeypatch.setattr(serialization, 'JSON_BACKEND', backend)
+    result = dumps(data)
+    assert isinstance(result, bytes)
+    assert b'\n' not in result
+    assert b', ' not in result
+    assert json.loads(result) == expected
+    pretty = dumps(data, pretty=True)
+    assert b'\n' in pretty
+    assert json.loads(pretty) == expected
+
+def test_datetime_format(monkeypatch):
+  # ISO 8601 with a T separator (str() in earlier versions used a space)
+  # with both backends, like the cursors and exports
+  for backend in ['json', 'orjson'] if serialization.orjson else ['json']:
+    monkeypatch.setattr(serialization, 'JSON_BACKEND', backend)
+    assert dumps({'at': datetime(2023, 12, 2, 9, 31, 28, 92946), 'on': date(2023, 12, 2)}) == b'{"at":"2023-12-02T09:31:28.092946","on":"2023-12-02"}'
+    assert dumps([datetime(2023, 12, 2, 9, 31)]) == b'["2023-12-02T09:31:00"]'
+
+def test_split_pretty():
+  assert split_pretty({'limit': '1'}) == ({'limit': '1'}, False)
+  assert split_pretty({'limit': '1', 'pretty': ''}) == ({'limit': '1'}, True)
+  assert split_pretty({'pretty': '1'}) == ({}, True)
+  assert split_pretty({'pretty': 'false'}) == ({}, False)
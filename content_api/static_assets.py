@@ -0,0 +1,154 @@
+'''
+Serves the static directory with precompressed (gzip) variants and
+content hash based caching. Local references in HTML files are rewritten
+to ?v=<hash> urls which are cached as immutable, other requests revalidate
+with the ETag. The .gz variants are written at build time with:
+
+  python -m content_api.static_assets
+
+Assets without an up to date .gz file are compressed in memory the first
+time they are requested, at COMPRESSION_LEVEL like the JSON responses.
+'''
+import os
+import re
+import sys
+import gzip
+import hashlib
+import mimetypes
+import threading
+from types import SimpleNamespace
+from content_api.etag import get_header, etag_matches
+from content_api.compression import accepts_gzip, COMPRESSION_LEVEL
+
+COMPRESSIBLE_TYPES = ['text/', 'application/javascript', 'application/json', 'image/svg+xml']
+MIN_COMPRESS_SIZE = 1024
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+REVALIDATE_CACHE_CONTROL = 'no-cache'
+
+# src="./swagger-ui.css" and href="index.css" but not absolute or external urls
+REFERENCE_PATTERN = re.compile(r'''(\b(?:src|href)=)(["'])(?!/|[a-z]+:|#)([^"'?#]+)\2''')
+
+def content_type(path):
+  if path.endswith('.map'):
+    return 'application/json'
+  return mimetypes.guess_type(path)[0] or 'application/octet-stream'
+
+def is_compressible(path, size):
+  return size >= MIN_COMPRESS_SIZE and any(content_type(path).startswith(t) for t in COMPRESSIBLE_TYPES)
+
+def content_hash(content):
+  return hashlib.sha256(content).hexdigest()[:16]
+
+def walk(root):
+  for directory, _, filenames in os.walk(root):
+    for filename in sorted(filenames):
+      if not filename.endswith('.gz'):
+        file_path = os.path.join(directory, filename)
+        yield (os.path.relpath(file_path, root).replace(os.sep, '/'), file_path)
+
+def rewrite_references(html, path, hashes):
+  '''
+    Appends ?v=<hash> to the local src and href references of the HTML
+    file at path (relative to the static root) that are known assets
+  '''
+  directory = os.path.dirname(path)
+  def versioned(match):
+    (attribute, quote, reference) = match.groups()
+    target = os.path.normpath(os.path.join(directory, reference)).replace(os.sep, '/')
+    if target not in hashes:
+      return match.group(0)
+    return f'{attribute}{quote}{reference}?v={hashes[target]}{quote}'
+  return REFERENCE_PATTERN.sub(versioned, html)
+
+def load_static_assets(root='static'):
+  '''
+    Returns the assets under root by path, each with its content hash, and
+    rewritten content for HTML files (other files are read when served)
+  '''
+  files = list(walk(root))
+  hashes = {}
+  for (path, file_path) in files:
+    with open(file_path, 'rb') as f:
+      hashes[path] = content_hash(f.read())
+  assets = {}
+  for (path, file_path) in files:
+    content = None
+    if content_type(path) == 'text/html':
+      with open(file_path, 'rb') as f:
+        content = rewrite_references(f.read().decode('utf-8'), path, hashes).encode('utf-8')
+    size = len(content) if content is not None else os.path.getsize(file_path)
+    assets[path] = SimpleNamespace(
+      file_path=file_path,
+      content=content,
+      hash=hashes[path] if content is None else content_hash(content),
+      content_type=content_type(path),
+      compressible=is_compressible(path, size),
+      gzip_content=None,
+      # Compressing one asset doesn't hold up the requests of the others
+      lock=threading.Lock())
+  return SimpleNamespace(root=root, assets=assets)
+
+def read_content(asset):
+  if asset.content is not None:
+    return asset.content
+  with open(asset.file_path, 'rb') as f:
+    return f.read()
+
+def gzip_path(asset):
+  # A .gz file written by build_static_assets for the current content
+  path = f'{asset.file_path}.gz'
+  if asset.content is None and os.path.exists(path) and os.path.getmtime(path) >= os.path.getmtime(asset.file_path):
+    return path
+  return None
+
+def read_gzip_content(static, asset):
+  path = gzip_path(asset)
+  if path:
+    with open(path, 'rb') as f:
+      return f.read()
+  if asset.gzip_content is None:
+    with asset.lock:
+      if asset.gzip_content is None:
+        asset.gzip_content = gzip.compress(read_content(asset), compresslevel=COMPRESSION_LEVEL, mtime=0)
+  return asset.gzip_content
+
+def static_response(static, path, request_headers, query=None):
+  '''
+    Returns a dict with status, headers and content (bytes) for the asset
+    at path, like swagger_response
+  '''
+  asset = static.assets.get(path)
+  if asset is None:
+    return {'status': 404, 'headers': {'Content-Type': 'text/plain'}, 'content': b'Not Found'}
+  versioned = (query or {}).get('v') == asset.hash
+  headers = {
+    'Content-Type': asset.content_type,
+    'Cache-Control': IMMUTABLE_CACHE_CONTROL if versioned else REVALIDATE_CACHE_CONTROL,
+    'ETag': f'"{asset.hash}"'
+  }
+  if asset.compressible:
+    headers['Vary'] = 'Accept-Encoding'
+  if etag_matches(get_header(request_headers, 'If-None-Match'), headers['ETag']):
+    return {'status': 304, 'headers': headers, 'content': b''}
+  if asset.compressible and accepts_gzip(get_header(request_headers, 'Accept-Encoding')):
+    return {'status': 200, 'headers': {**headers, 'Content-Encoding': 'gzip'}, 'content': read_gzip_content(static, asset)}
+  return {'status': 200, 'headers': headers, 'content': read_content(asset)}
+
+def build_static_assets(root='static'):
+  '''
+    Writes a .gz file next to each compressible asset (except HTML files,
+    which are rewritten at startup), returns the written paths
+  '''
+  written = []
+  for path, asset in load_static_assets(root).assets.items():
+    if asset.compressible and asset.content is None and not gzip_path(asset):
+      with open(asset.file_path, 'rb') as f:
+        content = gzip.compress(f.read(), compresslevel=9, mtime=0)
+      with open(f'{asset.file_path}.gz', 'wb') as f:
+        f.write(content)
+      written.append(f'{asset.file_path}.gz')
+  return written
+
+if __name__ == '__main__':
+  for path in build_static_assets(sys.argv[1] if len(sys.argv) > 1 else 'static'):
+    print(path)
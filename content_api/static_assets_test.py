@@ -0,0 +1,61 @@
+import gzip
+from content_api.static_assets import load_static_assets, static_response, build_static_assets, rewrite_references
+
+def make_root(tmp_path):
+  (tmp_path / 'docs').mkdir()
+  (tmp_path / 'docs' / 'index.html').write_text('<link href="./app.css"><script src="app.js"></script><a href="/other">x</a><img src="https://example.com/a.png">')
+  (tmp_path / 'docs' / 'app.css').write_text('body { margin: 0; }\n' * 100)
+  (tmp_path / 'docs' / 'app.js').write_text('x')
+  return str(tmp_path)
+
+def test_rewrite_references():
+  hashes = {'docs/app.css': 'abc', 'app.js': 'def'}
+  assert rewrite_references('<link href="./app.css"><script src="../app.js">', 'docs/index.html', hashes) == \
+    '<link href="./app.css?v=abc"><script src="../app.js?v=def">'
+  assert rewrite_references('<a href="/app.js"><a href="missing.css">', 'index.html', hashes) == '<a href="/app.js"><a href="missing.css">'
+
+def test_static_response(tmp_path):
+  static = load_static_assets(make_root(tmp_path))
+  css = static.assets['docs/app.css']
+  html = static_response(static, 'docs/index.html', {})
+  assert html['headers']['Cache-Control'] == 'no-cache'
+  assert f'href="./app.css?v={css.hash}"'.encode() in html['content']
+  assert b'href="/other"' in html['content']
+
+  # Versioned urls are immutable
+  response = static_response(static, 'docs/app.css', {'Accept-Encoding': 'gzip'}, {'v': css.hash})
+  assert response['headers']['Cache-Control'] == 'public, max-age=31536000, immutable'
+  assert response['headers']['Content-Type'] == 'text/css'
+  assert response['headers']['Content-Encoding'] == 'gzip'
+  assert gzip.decompress(response['content']) == b'body { margin: 0; }\n' * 100
+  assert static_response(static, 'docs/app.css', {}, {'v': 'stale'})['headers']['Cache-Control'] == 'no-cache'
+
+  # Small files are not compressed
+  response = static_response(static, 'docs/app.js', {'Accept-Encoding': 'gzip'})
+  assert 'Content-Encoding' not in response['headers']
+  assert response['content'] == b'x'
+
+  response = static_response(static, 'docs/app.css', {'If-None-Match': f'"{css.hash}"'})
+  assert response['status'] == 304
+  assert static_response(static, '../secret', {})['status'] == 404
+
+def test_compression_locks(tmp_path):
+  root = make_root(tmp_path)
+  (tmp_path / 'docs' / 'other.css').write_text('p { margin: 0; }\n' * 100)
+  static = load_static_assets(root)
+  (css, other) = (static.assets['docs/app.css'], static.assets['docs/other.css'])
+  # An asset being compressed doesn't block the requests of the others
+  with css.lock:
+    response = static_response(static, 'docs/other.css', {'Accept-Encoding': 'gzip'})
+  assert gzip.decompress(response['content']) == b'p { margin: 0; }\n' * 100
+  assert other.gzip_content is not None and css.gzip_content is None
+
+def test_build_static_assets(tmp_path):
+  root = make_root(tmp_path)
+  assert build_static_assets(root) == [str(tmp_path / 'docs' / 'app.css.gz')]
+  assert build_static_assets(root) == []
+  (tmp_path / 'docs' / 'app.css.gz').write_bytes(gzip.compress(b'prebuilt'))
+  static = load_static_assets(root)
+  # The .gz file is served as is and not listed as an asset
+  assert 'docs/app.css.gz' not in static.assets
+  assert gzip.decompress(static_response(static, 'docs/app.css', {'Accept-Encoding': 'gzip'})['content']) == b'prebuilt'
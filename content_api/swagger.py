@@ -1,4 +1,10 @@
 import re
+import json
+import gzip
+import hashlib
+from types import SimpleNamespace
+from content_api.etag import get_header, etag_matches
+from content_api.compression import accepts_gzip
 
 # Covert /v1/foobar/<id> to /v1/foobar/{id}
 def swagger_path(route_path):
@@ -59,3 +65,32 @@ def generate_swagger(model_routes):
     },
     'paths': swagger_paths(model_routes)
   }
+
+def swagger_document(model_routes):
+  '''
+    The routes don't change after startup so the OpenAPI document is
+    generated and encoded once, with a gzipped variant and an ETag
+  '''
+  body = json.dumps(generate_swagger(model_routes), separators=(',', ':')).encode('utf-8')
+  etag = f'"{hashlib.sha1(body).hexdigest()}"'
+  return SimpleNamespace(
+    body=body,
+    gzip_body=gzip.compress(body, compresslevel=9, mtime=0),
+    headers={
+      'Content-Type': 'application/json',
+      'Cache-Control': 'public, max-age=300',
+      'ETag': etag,
+      'Vary': 'Accept-Encoding'
+    })
+
+def swagger_response(document, request_headers):
+  '''
+    Returns a dict with status, headers and content (bytes) for serving the
+    document from swagger_document
+  '''
+  headers = document.headers
+  if etag_matches(get_header(request_headers, 'If-None-Match'), headers['ETag']):
+    return {'status': 304, 'headers': headers, 'content': b''}
+  if accepts_gzip(get_header(request_headers, 'Accept-Encoding')):
+    return {'status': 200, 'headers': {**headers, 'Content-Encoding': 'gzip'}, 'content': document.gzip_body}
+  return {'status': 200, 'headers': headers, 'content': document.body}
@@ -0,0 +1,119 @@
+import os
+import threading
+import traceback
+from urllib.parse import urlsplit
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from requests.adapters import HTTPAdapter
+from content_api.cache import TTLCache
+
+def make_session(pool_size=10):
+  # Keep-alive connections are reused for up to pool_size hosts
+  session = requests.Session()
+  adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=0)
+  session.mount('http://', adapter)
+  session.mount('https://', adapter)
+  return session
+
+class UrlValidator:
+  '''
+    Validates that urls respond with 200 OK. Requests go through a pooled
+    session, results are cached (negative results for a shorter time) and
+    at most host_concurrency requests per host run at the same time (a
+    validation waits at most queue_timeout seconds for its turn). Validations
+    can also run in the background, see submit.
+  '''
+  def __init__(self, timeout=5, cache_size=10000, ttl=300, negative_ttl=60, host_concurrency=4, queue_timeout=1, pool_size=10, workers=4, session=None):
+    self.timeout = timeout
+    self.queue_timeout = queue_timeout
+    self.cache = TTLCache(max_size=cache_size, ttl=ttl)
+    self.negative_ttl = negative_ttl
+    self.host_concurrency = host_concurrency
+    self.session = session or make_session(pool_size)
+    self.workers = workers
+    self._executor = None
+    self._semaphores = {}
+    self._lock = threading.Lock()
+    self._stats = {'requests': 0, 'host_limited': 0, 'submitted': 0}
+
+  def _count(self, name):
+    with self._lock:
+      self._stats[name] += 1
+
+  def host_semaphore(self, host):
+    with self._lock:
+      if host not in self._semaphores:
+        if len(self._semaphores) >= 10000:
+          # Bounds memory, requests already holding a dropped semaphore
+          # release it without affecting the new one
+          self._semaphores.clear()
+        self._semaphores[host] = threading.BoundedSemaphore(self.host_concurrency)
+      return self._semaphores[host]
+
+  def fetch(self, url, wait=False):
+    '''
+      Returns (message, cacheable) where message is None for a valid url.
+      If wait is False and host_concurrency requests to the host are
+      already running for longer than queue_timeout it gives up.
+    '''
+    host = urlsplit(url).netloc.lower()
+    semaphore = self.host_semaphore(host)
+    if not semaphore.acquire(timeout=None if wait else self.queue_timeout):
+      self._count('host_limited')
+      return (f'Too many concurrent requests to validate urls on {host}, please try again later', False)
+    try:
+      self._count('requests')
+      response = self.session.get(url, timeout=self.timeout, stream=True)
+      try:
+        if response.status_code != 200:
+          return (f'Expected status code 200 for url {url} but got {response.status_code}', True)
+        return (None, True)
+      finally:
+        # Only the status is needed so the body is never downloaded
+        response.close()
+    except Exception as error:
+      return (f'Could not fetch url {url}: {type(error).__name__}', True)
+    finally:
+      semaphore.release()
+
+  def validate(self, url, wait=False):
+    '''
+      Returns None if the url is valid or else an error message
+    '''
+    cached = self.cache.get(url)
+    if cached is not None:
+      return cached[0]
+    (message, cacheable) = self.fetch(url, wait)
+    if cacheable:
+      self.cache.set(url, (message,), ttl=None if message is None else self.negative_ttl)
+    return message
+
+  def submit(self, url, callback):
+    '''
+      Validates the url on a background thread and then calls
+      callback(message), returns a Future
+    '''
+    with self._lock:
+      if self._executor is None:
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='url_validation')
+      self._stats['submitted'] += 1
+    def run():
+      try:
+        callback(self.validate(url, wait=True))
+      except Exception:
+        print(f'Could not record the validation of url {url}')
+        traceback.print_exc()
+    return self._executor.submit(run)
+
+  def stats(self):
+    with self._lock:
+      return {**self._stats, 'cache': self.cache.stats()}
+
+url_validator = UrlValidator(
+  timeout=float(os.environ.get('URL_VALIDATION_TIMEOUT', 5)),
+  cache_size=int(os.environ.get('URL_VALIDATION_CACHE_SIZE', 10000)),
+  ttl=float(os.environ.get('URL_VALIDATION_CACHE_TTL', 300)),
+  negative_ttl=float(os.environ.get('URL_VALIDATION_NEGATIVE_TTL', 60)),
+  host_concurrency=int(os.environ.get('URL_VALIDATION_HOST_CONCURRENCY', 4)),
+  queue_timeout=float(os.environ.get('URL_VALIDATION_QUEUE_TIMEOUT', 1)),
+  workers=int(os.environ.get('URL_VALIDATION_WORKERS', 4)))
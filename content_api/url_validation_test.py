@@ -0,0 +1,100 @@
+import time
+import importlib
+import threading
+from types import SimpleNamespace
+import pytest
+import content_api.model_api as model_api
+import content_api.db.memory as memory
+from content_api.url_validation import UrlValidator
+
+@pytest.fixture
+def base_url(stub_server):
+  stub_server.responses.update({'/slow': {'delay': 0.5}, '/missing': {'status': 404}})
+  return stub_server.url
+
+def requested_paths(stub_server):
+  return [path for (path, _) in stub_server.requests]
+
+def test_validate(base_url):
+  validator = UrlValidator(timeout=2)
+  assert validator.validate(f'{base_url}/ok') == None
+  assert 'got 404' in validator.validate(f'{base_url}/missing')
+  assert 'Could not fetch url' in validator.validate('http://127.0.0.1:1/refused')
+
+def test_cache(base_url, stub_server):
+  validator = UrlValidator(timeout=2, negative_ttl=0.2)
+  for _ in range(3):
+    assert validator.validate(f'{base_url}/ok') == None
+    assert validator.validate(f'{base_url}/missing') != None
+  assert requested_paths(stub_server) == ['/ok', '/missing']
+  # Negative results expire sooner
+  time.sleep(0.3)
+  assert validator.validate(f'{base_url}/ok') == None
+  assert validator.validate(f'{base_url}/missing') != None
+  assert requested_paths(stub_server) == ['/ok', '/missing', '/missing']
+  assert validator.stats()['requests'] == 3
+
+def test_host_concurrency(base_url):
+  validator = UrlValidator(timeout=2, host_concurrency=1, queue_timeout=0.1)
+  results = {}
+  slow = threading.Thread(target=lambda: results.update(slow=validator.validate(f'{base_url}/slow', wait=True)))
+  slow.start()
+  time.sleep(0.1)
+  assert 'Too many concurrent requests' in validator.validate(f'{base_url}/ok')
+  slow.join()
+  assert results['slow'] == None
+  assert validator.stats()['host_limited'] == 1
+  # Not cached, the next validation goes through
+  assert validator.validate(f'{base_url}/ok') == None
+
+def test_submit(base_url):
+  validator = UrlValidator(timeout=2)
+  results = []
+  validator.submit(f'{base_url}/ok', results.append).result()
+  validator.submit(f'{base_url}/missing', results.append).result()
+  assert results[0] == None
+  assert 'got 404' in results[1]
+
+@pytest.fixture
+def urls(monkeypatch):
+  '''
+    The handlers of the urls model in deferred mode on the in-memory
+    backend, the submitted validations are recorded in submitted
+  '''
+  model = importlib.import_module('models.00_urls')
+  monkeypatch.setattr(model_api, 'db', memory)
+  monkeypatch.setattr(memory, 'tables', {})
+  api = model_api.make_model_api_with_validation('urls', model.json_schema, write_values=model.with_pending_validation)
+  monkeypatch.setattr(model, 'api', api)
+  submitted = []
+  monkeypatch.setattr(model.url_validator, 'submit', lambda url, callback: submitted.append((url, callback)))
+  return SimpleNamespace(
+    create=model.with_deferred_validation(api.create),
+    update=model.with_deferred_validation(api.update),
+    bulk_update=model.with_deferred_validation(api.bulk_update),
+    submitted=submitted)
+
+def test_deferred_validation(urls):
+  created = urls.create({'body': {'url': 'https://a.com'}})['body']
+  assert created['validation_status'] == 'pending'
+  assert [url for (url, _) in urls.submitted] == ['https://a.com']
+  (_, record) = urls.submitted[0]
+  record('got 404')
+  assert memory.find_one('urls', created['id'])['validation_status'] == 'invalid'
+  # The same url is not validated again
+  request = {'path_params': {'id': created['id']}, 'body': {'url': 'https://a.com'}}
+  updated = urls.update(request)['body']
+  assert (updated['validation_status'], updated['validation_error']) == ('invalid', 'got 404')
+  assert len(urls.submitted) == 1
+  # A changed url is pending from the update itself
+  updated = urls.update({**request, 'body': {'url': 'https://b.com'}})['body']
+  assert updated['validation_status'] == 'pending'
+  assert 'validation_error' not in updated
+  assert updated == {k: v for k, v in memory.find_one('urls', created['id']).items() if v is not None}
+  assert [url for (url, _) in urls.submitted] == ['https://a.com', 'https://b.com']
+  # An outdated result is not recorded
+  record(None)
+  assert memory.find_one('urls', created['id'])['validation_status'] == 'pending'
+  response = urls.bulk_update({'body': [{'id': created['id'], 'url': 'https://b.com'}]})
+  assert response['body']['count'] == 1
+  assert len(urls.submitted) == 2
@@ -4,6 +4,15 @@ import re
 def invalid_response(message):
   return {'body': {'error': {'message': message}}, 'status': 400}
 
+def invalid_items_response(item_messages):
+  '''
+    Validation failure of individual items in an array, item_messages is a
+    list of (index, message) tuples
+  '''
+  indexes = [index for index, _ in item_messages]
+  items = [{'index': index, 'message': message} for index, message in item_messages]
+  return {'body': {'error': {'message': f'Invalid items at indexes {indexes}', 'items': items}}, 'status': 400}
+
 def exception_body(exception):
   return {
         'error': {
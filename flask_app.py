@@ -1,27 +1,28 @@
 import os
-import json
-from datetime import date
-from flask import Flask, jsonify, make_response, request, redirect, send_from_directory
+from flask import Flask, request, redirect
 from content_api.util import exception_body
-from content_api.swagger import generate_swagger
+from content_api.serialization import dumps, split_pretty
+from content_api.etag import conditional_response
+from content_api.compression import gzip_response
+from content_api.static_assets import load_static_assets, static_response
+from content_api.swagger import swagger_document, swagger_response
+from content_api.metrics import metrics_response
 from content_api.models import all_model_routes
 
-app = Flask(__name__)
+# The static directory is served by send_static, see content_api/static_assets.py
+app = Flask(__name__, static_folder=None)
 
-class JsonEncoder(json.JSONEncoder):
-	def default(self, obj):
-		if isinstance(obj, date): # ISO date formating
-			return str(obj)
-		return json.JSONEncoder.default(self, obj)
-
-app.json_encoder = JsonEncoder
-
-def flask_response(result):
-    # response = app.response_class(response=jsonify(result.get('body', {})),
-    #                               status=result.get('status', 200),
-    #                               mimetype='application/json')
-    response = make_response(jsonify(result.get('body', {})), result.get('status', 200))
-    for k, v in result.get('headers', {}).items():
+def flask_response(result, pretty=False, request_headers=None):
+    headers = result.get('headers', {})
+    if 'stream' in result:
+        # Streamed responses (i.e. exports) are written chunk by chunk
+        response = app.response_class(result['stream'], status=result.get('status', 200))
+    elif result.get('status') == 304:
+        response = app.response_class(status=304)
+    else:
+        (content, headers) = gzip_response(request_headers, dumps(result.get('body', {}), pretty), headers)
+        response = app.response_class(content, status=result.get('status', 200), mimetype='application/json')
+    for k, v in headers.items():
         response.headers[k] = v
     return response
 
@@ -35,11 +36,13 @@ def make_flask_routes(model_routes):
     def get_flask_handler(index, route):
         handler = route['handler']
         def flask_handler(**kwargs):
-            return flask_response(handler({
+            headers = dict(request.headers)
+            query, pretty = split_pretty(dict(request.args))
+            return flask_response(conditional_response(headers, handler({
                 'path_params': kwargs,
                 'body': request.json if request.is_json else None,
-                'headers': dict(request.headers),
-                'query': dict(request.args)}))
+                'headers': headers,
+                'query': query})), pretty, headers)
         # Flask handler names need to be uniqe, see: https://stackoverflow.com/questions/17256602/assertionerror-view-function-mapping-is-overwriting-an-existing-endpoint-functi
         flask_handler.__name__ = f'{route["model_name"]}_{route["name"]}_{index}'
         return flask_handler
@@ -47,9 +50,12 @@ def make_flask_routes(model_routes):
         print(route['method'], route['path'])
         app.route(route['path'], methods = [route['method']])(get_flask_handler(index, route))
 
+static = load_static_assets('static')
+
 @app.route('/static/<path:path>')
 def send_static(path):
-    return send_from_directory('./static', path)
+    result = static_response(static, path, request.headers, request.args)
+    return app.response_class(result['content'], status=result['status'], headers=result['headers'])
 
 model_routes = all_model_routes()
 make_flask_routes(model_routes)
@@ -58,6 +64,14 @@ make_flask_routes(model_routes)
 def redirect_to_swagger():
     return redirect('/static/index.html')
 
+swagger = swagger_document(model_routes)
+
 @app.route('/v1/swagger.json')
 def swagger_json():
-    return jsonify(generate_swagger(model_routes))
+    result = swagger_response(swagger, request.headers)
+    return app.response_class(result['content'], status=result['status'], headers=result['headers'])
+
+@app.route('/metrics')
+def metrics():
+    result = metrics_response()
+    return app.response_class(result['content'], status=result['status'], headers=result['headers'])
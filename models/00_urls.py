@@ -1,19 +1,32 @@
-import sys
-import requests
+import os
+import contextvars
+from datetime import datetime
+from functools import wraps
 from content_api.util import invalid_response
 from content_api.model_api import make_model_api_with_validation
 from content_api.model_routes import get_model_routes
+from content_api.url_validation import url_validator
+from content_api.metrics import register_collector
 from content_api.db import db
 
 name = 'urls'
 
+# sync (default) rejects urls that don't respond with 200 OK, deferred
+# accepts them and records the validation_status when it is done
+URL_VALIDATION_MODE = os.environ.get('URL_VALIDATION_MODE', 'sync')
+
 json_schema = {
   'type': 'object',
   'properties': {
       'id': db.id_json_schema,
-      'url': {'type': 'string', 'format': 'uri', 'pattern': '^https?://.+$'},
-      'created_at': {'type': 'string', 'format': 'date-time', 'x-meta': {'writable': False}},
-      'updated_at': {'type': 'string', 'format': 'date-time', 'x-meta': {'writable': False}}
+      'url': {'type': 'string', 'format': 'uri', 'pattern': '^https?://.+$', 'x-meta': {'index': 'trigram'}},
+      'created_at': {'type': 'string', 'format': 'date-time', 'x-meta': {'writable': False, 'index': True}},
+      'updated_at': {'type': 'string', 'format': 'date-time', 'x-meta': {'writable': False}},
+      'validation_status': {'type': 'string', 'enum': ['pending', 'valid', 'invalid'], 'x-meta': {'writable': False, 'index': True}},
+      'validation_error': {'type': 'string', 'x-meta': {'writable': False, 'index': False}},
+      'validated_at': {'type': 'string', 'format': 'date-time', 'x-meta': {'writable': False, 'index': False}},
+      # When content_api.fetch_worker fetches the url next
+      'next_fetch_at': {'type': 'string', 'format': 'date-time', 'x-meta': {'writable': False, 'index': True}}
   },
   'required': ['id', 'url', 'created_at'],
   'additionalProperties': False
@@ -24,24 +37,107 @@ db_schema = f'''
     id serial PRIMARY KEY,
     url VARCHAR (355) UNIQUE NOT NULL,
     created_at TIMESTAMP NOT NULL,
-    updated_at TIMESTAMP
+    updated_at TIMESTAMP,
+    validation_status VARCHAR (16),
+    validation_error TEXT,
+    validated_at TIMESTAMP,
+    next_fetch_at TIMESTAMP NOT NULL DEFAULT 'epoch'
   )
 '''
 
-db_migrations = []
+# Indexes in addition to the x-meta index properties (see content_api/indexes.py),
+# this one serves the default -updated_at sort and its cursor pages
+indexes = [
+  {'columns': ['-updated_at', '-id']}
+]
+
+db_migrations = [
+  {'name': '0001_add_validation_status', 'sql': f'''
+    ALTER TABLE {name}
+      ADD COLUMN IF NOT EXISTS validation_status VARCHAR (16),
+      ADD COLUMN IF NOT EXISTS validation_error TEXT,
+      ADD COLUMN IF NOT EXISTS validated_at TIMESTAMP
+  '''},
+  # A constant default doesn't rewrite the table
+  {'name': '0002_add_next_fetch_at', 'sql': f"ALTER TABLE {name} ADD COLUMN IF NOT EXISTS next_fetch_at TIMESTAMP NOT NULL DEFAULT 'epoch'"}
+]
+
+# Read through cache for get (see content_api/entity_cache.py)
+entity_cache = {'max_size': 10000, 'ttl': 60}
 
 def validate_url(request):
   data = request.get('body')
-  if not data or not 'url' in data:
+  if not data or not 'url' in data or URL_VALIDATION_MODE == 'deferred':
     return None
-  try:
-    result = requests.get(data['url'], timeout=5)
-    if result.status_code != 200:
-      return f'Expected status code 200 for for url {data["url"]} but got {result.status_code}'
-  except:
-    error = sys.exc_info()[0]
-    return f'Could not fetch url {data["url"]}: {error}'
-
-api = make_model_api_with_validation(name, json_schema, validate=validate_url)
+  return url_validator.validate(data['url'])
+
+# The urls marked pending by the writes of the current request, None
+# outside of with_deferred_validation
+pending_urls = contextvars.ContextVar('pending_urls', default=None)
+
+def with_pending_validation(doc, id=None):
+  '''
+    In deferred mode a new or changed url is written as pending by the
+    create or update itself, so that updated_at (and the ETag) only
+    change once
+  '''
+  marked = pending_urls.get()
+  if marked is None or 'url' not in doc:
+    return doc
+  if id is not None:
+    current = api.database.find_one(name, id, fields=('url',))
+    if current is not None and current['url'] == doc['url']:
+      return doc
+  marked.add(doc['url'])
+  return {**doc, 'validation_status': 'pending', 'validation_error': None}
+
+api = make_model_api_with_validation(name, json_schema, validate=validate_url, entity_cache=entity_cache, write_values=with_pending_validation)
+
+def record_validation(id, url):
+  def record(message):
+    doc = api.database.find_one(name, id)
+    if not doc or doc['url'] != url:
+      # Deleted, or changed and validated again, since
+      return
+    now = datetime.now()
+    api.database.update(name, id, {
+      'validation_status': 'invalid' if message else 'valid',
+      'validation_error': message,
+      'validated_at': now,
+      # A new updated_at also changes the ETag of the doc
+      'updated_at': now
+    })
+  return record
+
+def with_deferred_validation(handler):
+  '''
+    Validates the urls that the write marked pending (see
+    with_pending_validation) in the background, works for the single doc
+    and the bulk (data list) responses
+  '''
+  @wraps(handler)
+  def deferred(request):
+    token = pending_urls.set(set())
+    try:
+      response = handler(request)
+      marked = pending_urls.get()
+    finally:
+      pending_urls.reset(token)
+    if response.get('status', 200) != 200:
+      return response
+    body = response['body']
+    for doc in body['data'] if 'data' in body else [body]:
+      if doc['url'] in marked:
+        url_validator.submit(doc['url'], record_validation(doc['id'], doc['url']))
+    return response
+  return deferred
+
+if URL_VALIDATION_MODE == 'deferred':
+  api.create = with_deferred_validation(api.create)
+  api.update = with_deferred_validation(api.update)
+  api.bulk_create = with_deferred_validation(api.bulk_create)
+  api.bulk_update = with_deferred_validation(api.bulk_update)
+
+register_collector('url_validation', url_validator.stats, counters=('requests', 'host_limited', 'submitted', 'cache_hits', 'cache_misses', 'cache_evictions'))
 
 routes = get_model_routes(name, json_schema, api)
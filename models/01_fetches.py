@@ -6,9 +6,9 @@ json_schema = {
   'type': 'object',
   'properties': {
     'id': db.id_json_schema,
-    'url_id': {'type': 'integer'},
-    'data': {'type': 'string'},
-    'created_at': {'type': 'string', 'format': 'date-time', 'x-meta': {'writable': False}},
+    'url_id': {'type': 'integer', 'x-meta': {'index': True}},
+    'data': {'type': 'string', 'x-meta': {'index': False}},
+    'created_at': {'type': 'string', 'format': 'date-time', 'x-meta': {'writable': False, 'index': True}},
     'updated_at': {'type': 'string', 'format': 'date-time', 'x-meta': {'writable': False}}
   },
   'additionalProperties': False,
@@ -20,6 +20,17 @@ db_schema = f'''
     id serial PRIMARY KEY,
     url_id integer not null references urls(id),
     data text NOT NULL,
-    created_at TIMESTAMP NOT NULL
+    created_at TIMESTAMP NOT NULL,
+    updated_at TIMESTAMP
   )
 '''
+
+indexes = [
+  {'columns': ['-updated_at', '-id']}
+]
+
+# Run with content_api.models.migrate_schema, see content_api/migrations.py
+db_migrations = [
+  {'name': '0001_add_updated_at', 'sql': 'ALTER TABLE fetches ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP'},
+  {'name': '0002_backfill_updated_at', 'backfill': {'set': 'updated_at = created_at', 'where': 'updated_at IS NULL'}}
+]
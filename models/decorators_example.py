@@ -7,9 +7,9 @@ def with_headers(response, headers):
 def timer(handler):
   @wraps(handler)
   def with_timer(request):
-    start_time = time.time()
+    start_time = time.perf_counter()
     response = handler(request)
-    elapsed = round((time.time() - start_time)*1000, 3)
+    elapsed = round((time.perf_counter() - start_time)*1000, 3)
     return with_headers(response, {'X-Response-Time': f'{elapsed}ms'})
   return with_timer
 
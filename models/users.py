@@ -4,7 +4,7 @@ json_schema = {
   'type': 'object',
   'properties': {
     'id': db.id_json_schema,
-    'email': {'type': 'string'}
+    'email': {'type': 'string', 'x-meta': {'index': 'trigram'}}
   },
   'additionalProperties': False,
   'required': ['id', 'email']
@@ -1,61 +1,100 @@
 import re
 import json
 import os
-from datetime import date
+from concurrent.futures import ThreadPoolExecutor
 import tornado.ioloop
 import tornado.web
+from tornado.ioloop import IOLoop
 from tornado.web import Application, RequestHandler
 from tornado.log import enable_pretty_logging
-from content_api.swagger import generate_swagger
+from content_api.serialization import dumps, split_pretty
+from content_api.swagger import swagger_document, swagger_response
+from content_api.metrics import metrics_response
+from content_api.etag import conditional_response
+from content_api.compression import gzip_response
+from content_api.static_assets import load_static_assets, static_response
 from content_api.models import all_model_routes
 
-class JsonEncoder(json.JSONEncoder):
-	def default(self, obj):
-		if isinstance(obj, date): # ISO date formating
-			return str(obj)
-		return json.JSONEncoder.default(self, obj)
-
-def to_json(data):
-  return json.dumps(data, indent=4, cls=JsonEncoder)
-
 def request_body(method, request):
-  if not method in ['PUT', 'POST']:
+  if not method in ['PUT', 'POST', 'DELETE'] or not request.body:
     return None
   try:
     return json.loads(request.body)
   except:
     return None
 
+# Route handlers are synchronous (i.e. they block on database queries) so by
+# default they run on a thread pool to keep the IOLoop serving other requests.
+# Set TORNADO_EXECUTOR_WORKERS=0 to run handlers on the IOLoop thread.
+def make_executor(workers=int(os.environ.get('TORNADO_EXECUTOR_WORKERS', 10))):
+  return ThreadPoolExecutor(max_workers=workers, thread_name_prefix='handler') if workers > 0 else None
+
+executor = make_executor()
+
+async def run_handler(executor, handler, request):
+  if executor is None:
+    return handler(request)
+  return await IOLoop.current().run_in_executor(executor, handler, request)
+
+def next_chunk(iterator):
+  return next(iterator, None)
+
 class Handler(RequestHandler):
-  def initialize(self, routes):
+  def initialize(self, routes, executor=None):
     self.routes = routes
-  def handle_request(self, method, *params, **kwparams):
+    self.executor = executor
+  async def handle_request(self, method, *params, **kwparams):
     route = self.routes.get(method)
     self.set_header('Content-Type', 'application/json')
     if not route:
       self.set_status(405)
       self.finish()
       return
-    query = {k: self.get_argument(k) for k in self.request.query_arguments}
+    query, pretty = split_pretty({k: self.get_argument(k) for k in self.request.query_arguments})
     body = request_body(route['method'], self.request)
-    response = route['handler']({
+    headers = dict(self.request.headers)
+    response = conditional_response(headers, await run_handler(self.executor, route['handler'], {
       'path_params': kwparams,
       'body': body,
-      'headers': dict(self.request.headers),
-      'query': query})
+      'headers': headers,
+      'query': query}))
     status = response.get('status', 200)
     self.set_status(status)
-    for k, v in response.get('headers', {}).items():
+    if 'stream' in response or status == 304:
+      for k, v in response.get('headers', {}).items():
+        self.set_header(k, v)
+      if 'stream' in response:
+        await self.write_stream(response['stream'])
+      else:
+        self.finish()
+      return
+    (content, headers) = gzip_response(headers, dumps(response.get('body', {}), pretty), response.get('headers', {}))
+    for k, v in headers.items():
       self.set_header(k, v)
-    self.finish(to_json(response.get('body', {})))
-  def get(self, *params, **kwparams):
-    self.handle_request('GET', *params, **kwparams)
-  def put(self, *params, **kwparams):
-    self.handle_request('PUT', *params, **kwparams)
-  def post(self, *params, **kwparams):
-    self.handle_request('POST', *params, **kwparams)
-  def delete(self, *params, **kwparams):
-    self.handle_request('DELETE', *params, **kwparams)
+    self.finish(content)
+  async def write_stream(self, stream):
+    # Chunks are produced on the executor since they come from blocking
+    # database cursors and each chunk is flushed before the next is read
+    iterator = iter(stream)
+    try:
+      while True:
+        chunk = await run_handler(self.executor, next_chunk, iterator)
+        if chunk is None:
+          break
+        self.write(chunk)
+        await self.flush()
+      self.finish()
+    finally:
+      if hasattr(iterator, 'close'):
+        await run_handler(self.executor, lambda iterator: iterator.close(), iterator)
+  async def get(self, *params, **kwparams):
+    await self.handle_request('GET', *params, **kwparams)
+  async def put(self, *params, **kwparams):
+    await self.handle_request('PUT', *params, **kwparams)
+  async def post(self, *params, **kwparams):
+    await self.handle_request('POST', *params, **kwparams)
+  async def delete(self, *params, **kwparams):
+    await self.handle_request('DELETE', *params, **kwparams)
 
 # Covert /v1/foobar/<id> to /v1/foobar/([^/]+)
 def tornado_path(route_path):
@@ -71,17 +110,43 @@ def routes_by_path(routes):
 
 model_routes = all_model_routes()
 
+swagger = swagger_document(model_routes)
+
 class SwaggerHandler(RequestHandler):
   def get(self):
-    self.set_header('Content-Type', 'application/json')
-    self.finish(to_json(generate_swagger(model_routes)))
+    result = swagger_response(swagger, self.request.headers)
+    self.set_status(result['status'])
+    for k, v in result['headers'].items():
+      self.set_header(k, v)
+    # Tornado doesn't allow writing (even an empty) body for 304 responses
+    self.finish(result['content'] or None)
+
+class MetricsHandler(RequestHandler):
+  def get(self):
+    result = metrics_response()
+    self.set_status(result['status'])
+    for k, v in result['headers'].items():
+      self.set_header(k, v)
+    self.finish(result['content'])
+
+static = load_static_assets('static')
+
+class StaticHandler(RequestHandler):
+  def get(self, path):
+    result = static_response(static, path, self.request.headers, {k: self.get_argument(k) for k in self.request.query_arguments})
+    self.set_status(result['status'])
+    for k, v in result['headers'].items():
+      self.set_header(k, v)
+    self.finish(result['content'] or None)
 
-def make_app():
+def make_app(routes=model_routes, executor=executor, debug=True):
   urls = []
-  for path, routes in routes_by_path(model_routes).items():
-    urls.append((tornado_path(path), Handler, {'routes': routes}))
+  for path, path_routes in routes_by_path(routes).items():
+    urls.append((tornado_path(path), Handler, {'routes': path_routes, 'executor': executor}))
   urls.append(('/v1/swagger.json', SwaggerHandler))
-  return Application(urls, debug=True)
+  urls.append(('/metrics', MetricsHandler))
+  urls.append(('/static/(.*)', StaticHandler))
+  return Application(urls, debug=debug)
 
 if __name__ == '__main__':
     app = make_app()